@@ -0,0 +1,142 @@
+import asyncio
+import io
+import sys
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from server import *
+
+## ASGI entry point:  AGORA_SERVER=asgi gunicorn -c gunicorn.conf.py,  or  python3 asgi.py PORT ... for development.
+## The event loop reads each request in full and writes each response out, so a slow client only costs
+## a coroutine. In between, the Flask routes run unchanged on the model's bounded thread pool, and the
+## captcha of a login, signup, post or comment is checked on the loop before the request takes a thread.
+
+CAPTCHA_ENDPOINTS = {'agora.join_post', 'agora.login_post', 'agora.write_post', 'agora.write_comment'}
+
+class AgoraASGI:
+    def __init__(self, flask):
+        self.flask = flask
+        self.model = flask.extensions['agora'].asyncModel
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return await send({'type': 'websocket.close'})
+        body = await self.readBody(receive)
+        if body is None:
+            return      # The client went away before it finished sending
+        if len(body) > ASGI_MAX_BODY_BYTES:
+            return await self.respond(send, 413, [('Content-Type', 'text/plain')], [b"Request body too large\n"])
+        environ = self.environ(scope, body)
+        if scope['method'] == 'POST' and self.endpoint(environ) in CAPTCHA_ENDPOINTS:
+            environ['agora.captcha'] = await self.checkCaptcha(environ, body)
+        status, headers, chunks = await self.model.run(self.callFlask, environ)
+        await self.respond(send, status, headers, chunks)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.model.close()
+                await asyncio.get_running_loop().run_in_executor(None, self.flask.extensions['agora'].close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Stops reading once the body is over ASGI_MAX_BODY_BYTES
+    async def readBody(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if size > ASGI_MAX_BODY_BYTES or not message.get('more_body', False):
+                return b''.join(chunks)
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name == 'CONTENT_LENGTH':
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def endpoint(self, environ):
+        try:
+            return self.flask.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return None
+
+    # An error is passed along for the route to raise, so that it shows up on the error page and in the metrics
+    async def checkCaptcha(self, environ, body):
+        request = Request(dict(environ, **{'wsgi.input': io.BytesIO(body)}))
+        captcha = request.form.get('g-recaptcha-response')
+        if captcha is None:
+            return None
+        try:
+            return await self.model.verifyCaptcha(captcha, request.cookies.get('session'))
+        except AgoraException as err:
+            return err
+
+    # Runs on the model's threads, and takes the whole response off Flask before handing it back to the loop
+    def callFlask(self, environ):
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+        iterable = self.flask(environ, start_response)
+        try:
+            chunks = [chunk for chunk in iterable if chunk]
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], response['headers'], chunks
+
+    async def respond(self, send, status, headers, chunks):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+def create_asgi_app(config=None):
+    return AgoraASGI(create_app(config))
+
+# Development server only; production runs the factory under gunicorn (see gunicorn.conf.py)
+if __name__ == '__main__':
+    import uvicorn
+    app = create_asgi_app(config_from_argv(sys.argv))
+    uvicorn.run(app, host="0.0.0.0", port=app.flask.config['PORT'])
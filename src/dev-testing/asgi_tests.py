@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import urllib.parse
+os.chdir("..")      # server.py finds its params, utilities and templates relative to src
+sys.path.insert(1, ".")
+
+from asgi import *
+
+## Drives the ASGI app straight from asyncio, without a server in between.
+
+volumes = tempfile.mkdtemp()
+for d in ["posts", "img", "logs"]:
+    os.mkdir(os.path.join(volumes, d))
+config = config_from_env()
+config.update({
+    'DBFILE': os.path.join(volumes, "agora.db"),
+    'POSTDIR': os.path.join(volumes, "posts"),
+    'IMGDIR': os.path.join(volumes, "img"),
+    'LOGDIR': os.path.join(volumes, "logs"),
+    'RECAPTCHA_VERIFIER': 'stub',
+    'MAILGUN_API': 'http://127.0.0.1:9/v3'      # Nothing listens there; mail just waits in the outbox
+})
+conn = sqlite3.connect(config['DBFILE'])
+conn.executescript(open("./params/agora.schema").read())
+conn.close()
+
+app = create_asgi_app(config)
+services = app.flask.extensions['agora']
+captcha = services.semantics.captcha
+
+async def call(method, path, form=None, cookie=None):
+    body = b"" if form is None else urllib.parse.urlencode(form).encode()
+    headers = [(b"host", b"agora.test")]
+    if form is not None:
+        headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+    if cookie is not None:
+        headers.append((b"cookie", f"session={cookie}".encode()))
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": headers,
+            "http_version": "1.1", "scheme": "http", "server": ("agora.test", 80), "client": ("127.0.0.1", 5000)}
+    # Sent in two pieces, the way a slow client would
+    pieces = [{"type": "http.request", "body": body[:5], "more_body": True}, {"type": "http.request", "body": body[5:]}]
+    async def receive():
+        return pieces.pop(0)
+    sent = []
+    async def send(message):
+        sent.append(message)
+    await app(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+async def main():
+    status, headers, body = await call("GET", "/")
+    assert status == 200 and b"<html" in body.lower()
+
+    # Sent back to the login page, and still counted as an error
+    status, headers, body = await call("POST", "/account", {"status": "hi"}, cookie="x" * SESSION_TOKEN_LENGTH)
+    assert status == 302 and headers[b"location"].endswith(b"/login")
+    assert 'agora_errors_total{endpoint="agora.account_post",error="AgoraEInvalidToken"} 1' in services.metrics.render()
+
+    await app.model.createAccount("alice@agora.test", "alice", "passwordpassword1", "captcha")
+    token = services.db.query("SELECT value FROM tokens WHERE type = 'creation'")[0]["value"]
+    status, headers, body = await call("GET", f"/join/{token}")
+    assert status < 400
+
+    # Every login waits on its captcha at once, while only ASGI_MODEL_THREADS of them ever hold a thread
+    captcha.latency = 0.5
+    calls = captcha.stats()["calls"]
+    start = time.monotonic()
+    results = await asyncio.gather(*[call("POST", "/login", {"username": "alice", "password": "passwordpassword1",
+            "g-recaptcha-response": "captcha"}) for _ in range(100)])
+    assert time.monotonic() - start < 3
+    assert all(status == 302 for status, headers, body in results)
+    assert captcha.stats()["calls"] == calls + 100
+    session = results[0][1][b"set-cookie"].decode().split(";")[0].split("=", 1)[1]
+
+    # A failed captcha still gets the error page, from the route
+    captcha.latency = 0
+    captcha.score = 0.0
+    status, headers, body = await call("POST", "/login", {"username": "alice", "password": "passwordpassword1",
+            "g-recaptcha-response": "captcha"})
+    assert status == 200 and b"AgoraEAreYouHuman" in body
+    captcha.score = 1.0
+
+    status, headers, body = await call("POST", "/write", {"title": "Hello", "content": "From *asyncio*",
+            "g-recaptcha-response": "captcha"}, cookie=session)
+    assert status == 302
+    status, headers, body = await call("GET", headers[b"location"].decode())
+    assert status == 200 and b"From <em>asyncio</em>" in body
+
+    identity = await app.model.identify(session)
+    assert identity.uid is not None
+    assert (await app.model.getMyUser(identity, True))["username"] == "alice"
+
+    status, headers, body = await call("POST", "/login", {"username": "x" * ASGI_MAX_BODY_BYTES})
+    assert status == 413
+
+    sent = []
+    async def send(message):
+        sent.append(message["type"])
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    async def receive():
+        return messages.pop(0)
+    await app({"type": "lifespan"}, receive, send)
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert services.closed
+
+asyncio.run(main())
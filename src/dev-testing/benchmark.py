@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+INVOKED_FROM = os.getcwd()
+os.chdir("..")      # server.py finds its params, utilities and templates relative to src
+sys.path.insert(1, ".")
+sys.path.insert(1, "./dev-testing")
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from server import *
+from fake_mailgun import *
+
+## Fills a scratch database and volumes with a synthetic dataset, then drives the main routes through
+## the Flask test client from a fixed number of threads. Captchas and email are stubbed out.
+## Prints a JSON report: throughput, p50/p95/p99 latency and SQL statements per request, overall and per route.
+## usage: python3 benchmark.py [--users 300] [--requests 3000] [--concurrency 8] [--output run.json]
+
+WORDS = ("agora forum market people idea stone temple river light dark city road garden letter music "
+    "number table window paper story question answer reason voice island winter summer morning evening "
+    "friend stranger teacher student harbor mountain valley field bridge tower lamp book ink song").split()
+
+# Relative weight of each operation in the request mix
+MIX = {
+    "GET /post": 35,
+    "GET /user": 15,
+    "GET /browse/posts": 10,
+    "GET /browse/users": 5,
+    "GET /search": 10,
+    "POST /vote": 12,
+    "POST /comment": 8,
+    "POST /write": 5
+}
+
+def zipfWeights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def markdownBody(rng):
+    parts = [f"# {sentence(rng, 4)[:-1]}"]
+    for _ in range(rng.randint(2, 6)):
+        match rng.randint(0, 5):
+            case 0:
+                parts.append("\n".join(f"- {sentence(rng, rng.randint(3, 8))}" for _ in range(rng.randint(2, 5))))
+            case 1:
+                parts.append(f"## {sentence(rng, 3)[:-1]}")
+            case 2:
+                parts.append(f"> {sentence(rng, rng.randint(6, 14))}")
+            case 3:
+                parts.append(f"Some *{rng.choice(WORDS)}* and **{rng.choice(WORDS)}**, see [here](https://example.com/{rng.choice(WORDS)}).")
+            case _:
+                parts.append(" ".join(sentence(rng, rng.randint(6, 16)) for _ in range(rng.randint(2, 6))))
+    return "\n\n".join(parts) + "\n"
+
+def pngBytes(rng, size):
+    img = Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    for _ in range(8):
+        x, y = rng.randrange(size), rng.randrange(size)
+        img.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (x, y, min(size, x + size // 4), min(size, y + size // 4)))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def seed(services, args, rng):
+    db, fm, interpreter = services.db, services.fm, services.interpreter
+    start = time.perf_counter()
+
+    hpassword = hashlib.sha256(b"passwordpassword1").hexdigest()
+    uids, sessions = [], []
+    for batch in chunks(range(args.users), 500):
+        with db.transaction() as tx:
+            refs = []
+            for i in batch:
+                ref = db.createUser(f"user{i}@agora.test", f"user{i}", hpassword, hpassword, "0" * IMG_RANDOM_ID_LENGTH)
+                db.verifyUser(ref)
+                token = interpreter.generateToken("session")
+                db.createToken(ref, token, "session")
+                refs.append(ref)
+                sessions.append(token)
+        uids.extend(tx.resolve(ref) for ref in refs)
+
+    # Preferential attachment: each newcomer befriends people with probability proportional to how many friends they have
+    edges, ends = set(), []
+    for i, uid in enumerate(uids):
+        for other in {rng.choice(ends) if ends and rng.random() < 0.9 else rng.choice(uids[:i + 1]) for _ in range(args.friends)}:
+            if other != uid and (other, uid) not in edges:
+                edges.add((uid, other))
+                ends.extend([uid, other])
+    edges = sorted(edges)
+    for batch in chunks(edges, 1000):
+        with db.transaction():
+            for uid1, uid2 in batch:
+                db.insertFriendReq(uid1, uid2)
+                if rng.random() < 0.85:
+                    db.insertFriendReq(uid2, uid1)
+
+    # A few prolific posters and a long tail
+    numPosts = args.users * args.posts_per_user
+    owners = rng.choices(uids, weights=zipfWeights(len(uids), 1.0), k=numPosts)
+    pids = []
+    for batch in chunks(owners, 500):
+        with db.transaction() as tx:
+            refs = []
+            for owner in batch:
+                title = sentence(rng, rng.randint(2, 7))[:-1]
+                content = markdownBody(rng)
+                filename = f"post{interpreter.generateToken('postid')}.md"
+                fm.writePost(filename, content)
+                ref = db.insertPost(owner, title, filename)
+                db.indexPost(ref, title, content)
+                refs.append(ref)
+        pids.extend(tx.resolve(ref) for ref in refs)
+
+    popularity = zipfWeights(len(pids), 1.1)
+    votes = set(zip(rng.choices(pids, weights=popularity, k=len(pids) * args.votes_per_post), rng.choices(uids, k=len(pids) * args.votes_per_post)))
+    for batch in chunks(sorted(votes), 2000):
+        with db.transaction():
+            for pid, uid in batch:
+                db.votePost(uid, pid, 1 if rng.random() < 0.85 else -1)
+    db.rebuildPostScores()
+
+    commented = rng.choices(pids, weights=popularity, k=len(pids) * args.comments_per_post)
+    for batch in chunks(commented, 2000):
+        with db.transaction():
+            for pid in batch:
+                db.insertComment(rng.choice(uids), pid, sentence(rng, rng.randint(3, 20))[:COMMENT_MAX_LENGTH])
+
+    accessids = []
+    for i in range(args.images):
+        owner = rng.choice(uids)
+        accessid = interpreter.generateToken("imgid")
+        filename = f"img{accessid}.png"
+        fm.saveImage(filename, FileStorage(io.BytesIO(pngBytes(rng, rng.choice([200, 800, 2000])))))
+        db.insertImage(owner, sentence(rng, 3)[:-1], filename, accessid)
+        if rng.random() < 0.5:
+            db.setPicture(owner, accessid)
+        accessids.append(accessid)
+
+    # Backdate everything so the daily limits only see what the benchmark itself writes
+    db.executeBatch([
+        ("UPDATE posts SET timestamp = datetime('now', '-1 day', printf('-%d minutes', ? - pid))", (max(pids, default=0),)),
+        ("UPDATE comments SET timestamp = datetime('now', '-1 day', printf('-%d minutes', cid))", ()),
+        ("UPDATE friendships SET timestamp = datetime('now', '-1 day')", ()),
+        ("UPDATE users SET lastaction = datetime('now', '-1 day')", ())
+    ])
+
+    return {
+        "users": len(uids),
+        "friendships": len(edges),
+        "posts": len(pids),
+        "votes": len(votes),
+        "comments": len(commented),
+        "images": len(accessids),
+        "seed_seconds": round(time.perf_counter() - start, 3)
+    }, uids, sessions, pids
+
+def makeOps(rng, num, uids, pids):
+    names = list(MIX)
+    popularity = zipfWeights(len(pids), 1.1)
+    ops = []
+    for name in rng.choices(names, weights=[MIX[n] for n in names], k=num):
+        match name:
+            case "GET /post":
+                ops.append((name, "GET", f"/post/{rng.choices(pids, weights=popularity)[0]}", None))
+            case "GET /user":
+                ops.append((name, "GET", f"/user/{rng.choice(uids)}", None))
+            case "GET /browse/posts":
+                ops.append((name, "GET", "/browse/posts", None))
+            case "GET /browse/users":
+                ops.append((name, "GET", "/browse/users", None))
+            case "GET /search":
+                ops.append((name, "GET", f"/search?post={rng.choice(WORDS)}", None))
+            case "POST /vote":
+                ops.append((name, "POST", f"/vote/{rng.choices(pids, weights=popularity)[0]}", {"vote": rng.choice(["like", "like", "dislike", "unlike"])}))
+            case "POST /comment":
+                ops.append((name, "POST", f"/comment/{rng.choices(pids, weights=popularity)[0]}", {"content": sentence(rng, 8), "g-recaptcha-response": "stub"}))
+            case "POST /write":
+                ops.append((name, "POST", "/write", {"title": sentence(rng, 4)[:-1], "content": markdownBody(rng), "g-recaptcha-response": "stub"}))
+    return ops
+
+def percentile(ordered, p):
+    if len(ordered) == 0:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def summarize(samples, seconds):
+    latencies = sorted(s["seconds"] for s in samples)
+    errors = {}
+    for s in samples:
+        if s["error"] is not None:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / seconds, 2) if seconds > 0 else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None
+        },
+        "queries_per_request": round(sum(s["queries"] for s in samples) / len(samples), 3) if samples else None,
+        "errors": errors
+    }
+
+def drive(app, ops, concurrency, sessions):
+    queryStats = app.extensions['agora'].queryStats
+    lock = threading.Lock()
+    position = [0]
+    samples = []
+    writers = [0]
+
+    def worker():
+        anon = app.test_client()
+        mine = []
+        while True:
+            with lock:
+                if position[0] >= len(ops):
+                    break
+                name, method, path, form = ops[position[0]]
+                position[0] += 1
+                if method == "POST":
+                    # Writers take turns so nobody runs through their rate limit buckets
+                    session = sessions[writers[0] % len(sessions)]
+                    writers[0] += 1
+            if method == "POST":
+                client = app.test_client()
+                client.set_cookie("session", session)
+            else:
+                client = anon
+            start = time.perf_counter()
+            resp = client.open(path, method=method, data=form)
+            elapsed = time.perf_counter() - start
+            statements = queryStats.lastRequest() or []
+            error = None
+            if resp.status_code >= 400:
+                error = f"HTTP {resp.status_code}"
+            elif resp.status_code == 200 and b"AgoraE" in resp.data:
+                match = re.search(rb"<title>(AgoraE\w+)", resp.data)
+                error = match.group(1).decode() if match else None
+            mine.append({"route": name, "seconds": elapsed, "queries": len(statements), "error": error})
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-data benchmark for the Agora routes.")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--posts-per-user", type=int, default=5)
+    parser.add_argument("--friends", type=int, default=3, help="friend requests each new user makes")
+    parser.add_argument("--votes-per-post", type=int, default=8)
+    parser.add_argument("--comments-per-post", type=int, default=2)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="scratch directory, kept afterwards (default: a temporary one)")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)      # Tokens come from the module-level generator
+    workdir = os.path.join(INVOKED_FROM, args.workdir) if args.workdir else tempfile.mkdtemp(prefix="agora-bench-")
+    for d in ["posts", "img", "logs", "metrics"]:
+        os.makedirs(os.path.join(workdir, d), exist_ok=True)
+    dbfile = os.path.join(workdir, "agora.db")
+    if os.path.exists(dbfile):
+        sys.exit(f"{dbfile} already exists; give an empty --workdir")
+    conn = sqlite3.connect(dbfile)
+    conn.executescript(open("./params/agora.schema").read())
+    conn.close()
+
+    mailgun = FakeMailgun(0, os.path.join(workdir, "mail.log"))
+    threading.Thread(target=mailgun.serve_forever, daemon=True).start()
+    config = config_from_env()
+    config.update({
+        'DBFILE': dbfile,
+        'POSTDIR': os.path.join(workdir, "posts"),
+        'IMGDIR': os.path.join(workdir, "img"),
+        'LOGDIR': os.path.join(workdir, "logs"),
+        'METRICSDIR': None,
+        'SESSIONDIR': None,
+        'RECAPTCHA_VERIFIER': 'stub',
+        'MAILGUN_API': f"http://127.0.0.1:{mailgun.server_address[1]}/v3"
+    })
+    app = create_app(config)
+    services = app.extensions['agora']
+
+    dataset, uids, sessions, pids = seed(services, args, rng)
+    drive(app, makeOps(rng, args.warmup, uids, pids), args.concurrency, sessions)
+    samples, seconds = drive(app, makeOps(rng, args.requests, uids, pids), args.concurrency, sessions)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("workdir", "output")},
+        "dataset": dataset,
+        "duration_seconds": round(seconds, 3),
+        **summarize(samples, seconds),
+        "routes": {name: summarize([s for s in samples if s["route"] == name], seconds) for name in MIX},
+        "db_writer": services.db.writerStats()
+    }
+    services.close()
+    mailgun.shutdown()
+    if args.workdir is None:
+        shutil.rmtree(workdir)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(os.path.join(INVOKED_FROM, args.output), 'w') as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+import sys
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from agora_errors import *
+from limits import *
+from AgoraCaptchaVerifier import *
+from AgoraStubCaptchaVerifier import *
+from AgoraSemanticFilter import *
+from AgoraCache import *
+
+## Points the verifier at a port nobody listens on, so every check fails fast.
+
+def raises(f, err):
+    try:
+        f()
+    except err:
+        return True
+    return False
+
+closed = AgoraCaptchaVerifier("key", failOpen=False, url="http://127.0.0.1:9/siteverify")
+for _ in range(RECAPTCHA_BREAKER_THRESHOLD):
+    assert raises(lambda: closed.verify("resp"), AgoraECaptchaUnavailable)
+assert closed.stats()["breaker_open"]
+assert raises(lambda: closed.verify("resp"), AgoraECaptchaUnavailable)
+assert closed.stats()["calls"] == RECAPTCHA_BREAKER_THRESHOLD       # The breaker stopped the last one from going out
+assert closed.stats()["short_circuited"] == 1
+
+opened = AgoraCaptchaVerifier("key", failOpen=True, url="http://127.0.0.1:9/siteverify")
+assert opened.verify("resp") is False
+assert opened.stats()["failed_open"] == 1
+
+assert AgoraStubCaptchaVerifier().verify("resp") is True
+assert raises(lambda: AgoraStubCaptchaVerifier(score=0.0).verify("resp"), AgoraEAreYouHuman)
+
+# A session let through while Google is unreachable gets asked again next time, and one that really passed doesn't
+semantics = AgoraSemanticFilter(None)
+semantics.setCaptchaTrustCache(AgoraLRUCache(10, ttl=60))
+semantics.setCaptchaVerifier(opened)
+semantics.verifyCaptcha("resp", "outage")
+semantics.verifyCaptcha("resp", "outage")
+assert opened.stats()["failed_open"] == 3
+assert semantics.trusted.get("outage") is None
+stub = AgoraStubCaptchaVerifier()
+semantics.setCaptchaVerifier(stub)
+semantics.verifyCaptcha("resp", "passed")
+semantics.verifyCaptcha("resp", "passed")
+assert stub.stats()["calls"] == 1
+
+# The async path shares the breaker and the counters
+async def checkAsync():
+    verifier = AgoraCaptchaVerifier("key", failOpen=False, url="http://127.0.0.1:9/siteverify")
+    for _ in range(RECAPTCHA_BREAKER_THRESHOLD + 1):
+        try:
+            await verifier.verifyAsync("resp")
+            assert False
+        except AgoraECaptchaUnavailable:
+            pass
+    assert verifier.stats()["calls"] == RECAPTCHA_BREAKER_THRESHOLD
+    assert verifier.stats()["short_circuited"] == 1
+    assert raises(lambda: verifier.verify("resp"), AgoraECaptchaUnavailable)
+    assert verifier.stats()["short_circuited"] == 2
+    await verifier.closeAsync()
+    assert await AgoraStubCaptchaVerifier().verifyAsync("resp") is True
+
+    # Failing open doesn't earn a session trust here either
+    opened = AgoraCaptchaVerifier("key", failOpen=True, url="http://127.0.0.1:9/siteverify")
+    semantics.setCaptchaVerifier(opened)
+    assert await opened.verifyAsync("resp") is False
+    await semantics.verifyCaptchaAsync("resp", "asyncoutage")
+    assert semantics.trusted.get("asyncoutage") is None
+    await opened.closeAsync()
+    stub = AgoraStubCaptchaVerifier()
+    semantics.setCaptchaVerifier(stub)
+    await semantics.verifyCaptchaAsync("resp", "asyncpassed")
+    await semantics.verifyCaptchaAsync("resp", "asyncpassed")
+    assert stub.stats()["calls"] == 1
+
+asyncio.run(checkAsync())
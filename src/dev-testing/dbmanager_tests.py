@@ -1,28 +1,114 @@
 import sys
+import time
+sys.path.insert(1, "../params")
 sys.path.insert(1, "../utilities")
 
 from AgoraDatabaseManager import *
+from AgoraMigrator import *
+from AgoraTokenSweeper import *
 
 ## These tests to be performed on an initially empty database.
 
+AgoraMigrator("../params/migrations").migrate("../volumes/test.db")
 dbman = AgoraDatabaseManager("../volumes/test.db")
 
 assert dbman.userExists(1) is None
-dbman.createUser("franklin@dyer.me", "frpzzd", "abc", "xyz")
+dbman.createUser("franklin@dyer.me", "frpzzd", "abc", "xyz", "0000000000")
 assert dbman.userExists(1) == 1
-dbman.createUser("theabecca@gmail.com", "althead", "def", "wxy")
+dbman.createUser("theabecca@gmail.com", "althead", "def", "wxy", "0000000000")
 assert dbman.userExists(2) == 2
 
 dbman.insertFriendReq(2, 1)
-assert dbman.getPublicUser(1)['friends'] == []
-assert dbman.getPrivateUser(1)['foryou'] != []
-assert dbman.getPrivateUser(2)['fromyou'] != []
+assert dbman.getPublicUser(1)['friends'] == {}
+assert dbman.getPrivateUser(1)['foryou'] != {}
+assert dbman.getPrivateUser(2)['fromyou'] != {}
 dbman.confirmFriendReq(2, 1)
-assert dbman.getPublicUser(1)['friends'] == []
+assert dbman.getPublicUser(1)['friends'] == {}
 dbman.confirmFriendReq(1, 2)
-assert dbman.getPublicUser(1)['friends'] != []
-assert dbman.getPrivateUser(1)['foryou'] == []
+assert dbman.getPublicUser(1)['friends'] != {}
+assert dbman.getPrivateUser(1)['foryou'] == {}
 
-assert len(dbman.searchUser('d')) == 2
-assert len(dbman.searchUser('zz')) == 1
-assert len(dbman.searchUser('ead')) == 1
+assert len(dbman.searchUser('d')['results']) == 2
+assert len(dbman.searchUser('zz')['results']) == 1
+assert len(dbman.searchUser('ead')['results']) == 1
+assert len(dbman.searchUser('')['results']) == 2
+assert len(dbman.searchUser('pzz')['results']) == 1
+assert len(dbman.searchUser('al')['results']) == 1
+assert dbman.searchUser('_')['results'] is None     # Matched literally, not as a LIKE wildcard
+assert [u['username'] for u in dbman.searchUser('d', limit=1)['results']] == ["althead"]
+assert [u['username'] for u in dbman.searchUser('d', after=dbman.searchUser('d', limit=1)['next'])['results']] == ["frpzzd"]
+assert dbman.searchUser('', limit=1)['next'] == (1,)
+for page in [lambda: dbman.searchUser('', after=(1, 2)), lambda: dbman.searchUser('ead', before=(1,)), lambda: dbman.searchPost('first', after=(5,))]:
+    try:
+        page()
+        assert False
+    except AgoraEInvalidQuery:
+        pass
+
+dbman.insertPost(1, "first", "f1")
+dbman.insertPost(1, "second", "f2")
+assert [p['title'] for p in dbman.getFeed(2)['results']] == ["second", "first"]
+assert dbman.getFeed(1)['results'] is None
+assert dbman.getFeed(2, limit=1)['next'] is not None
+
+dbman.insertFriendReq(1, 2)     # Already friends, so nothing new gets filed
+assert len(dbman.query("SELECT * FROM friendships")) == 1
+
+with dbman.transaction() as tx:
+    uid = dbman.createUser("third@agora.test", "third", "ghi", "vwx", "0000000000")
+    dbman.createToken(uid, "thirdtoken", "creation")
+    tx.onCommit(lambda: committed.append(True))
+    committed = []
+assert committed == [True]
+assert dbman.tokenExists("thirdtoken", "creation") == tx.resolve(uid)
+
+try:
+    with dbman.transaction():
+        dbman.deleteUser(tx.resolve(uid))
+        raise RuntimeError
+except RuntimeError:
+    pass
+assert dbman.userExists(tx.resolve(uid)) is not None      # Nothing in a failed block reaches the database
+
+# A feed merging two friends pages through both of them in order, whichever friend each post is from
+third = tx.resolve(uid)
+dbman.insertFriendReq(third, 2)
+dbman.confirmFriendReq(2, third)
+for i in range(3):
+    dbman.insertPost(third, f"third{i}", f"t{i}")
+dbman.execute("UPDATE posts SET timestamp = datetime('now', '-' || pid || ' minutes')", ())
+feed = [p['title'] for p in dbman.query("SELECT title FROM posts WHERE owner IN (1, ?) ORDER BY timestamp DESC, pid DESC", (third,))]
+page = dbman.getFeed(2, limit=2)
+titles = [p['title'] for p in page['results']]
+while page['next'] is not None:
+    page = dbman.getFeed(2, after=page['next'], limit=2)
+    titles += [p['title'] for p in page['results']]
+assert titles == feed and len(titles) > 4
+assert [p['title'] for p in dbman.getFeed(2, before=dbman.getFeed(2, after=dbman.getFeed(2, limit=2)['next'], limit=2)['prev'], limit=2)['results']] == feed[:2]
+
+dbman.execute("INSERT INTO tokens (owner, value, type, issued) VALUES (1, 'oldsession', 'session', datetime('now', '-1 day'))", ())
+dbman.createToken(1, "newsession", "session")
+assert dbman.sweepTokens("session", SESSION_MAX_DURATION_SECONDS, 10) == 1
+assert dbman.tokenExists("oldsession", "session") is None
+assert dbman.tokenExists("newsession", "session") == 1
+
+# A failing sweep keeps the sweeper running, and shows up in the log and its stats
+class BrokenDB:
+    def sweepTokens(self, *args):
+        raise RuntimeError("database is locked")
+class Log:
+    def __init__(self):
+        self.lines = []
+    def logif(self, cond, msg):
+        self.lines.append(msg)
+sys.modules["AgoraTokenSweeper"].TOKEN_SWEEP_INTERVAL_SECONDS = 0.05
+sweeper = AgoraTokenSweeper(BrokenDB())
+log = Log()
+sweeper.setFileManager(log)
+sweeper.start()
+time.sleep(0.12)
+assert sweeper.thread.is_alive()
+sweeper.stop()
+assert sweeper.stats()["failures"] >= 1 and sweeper.stats()["last_error"] == "RuntimeError: database is locked"
+assert sweeper.stats()["sweeps"] == 0
+assert log.lines[0] == "Token sweep failed: RuntimeError: database is locked"
@@ -0,0 +1,41 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+## Stands in for the Mailgun messages API. Every accepted message is appended to a JSON-lines
+## file; start the server with MAILGUN_API=http://localhost:<port>/v3 to point it here.
+## usage: python3 fake_mailgun.py <port> <logfile> [<status to answer with>]
+
+class FakeMailgun(ThreadingHTTPServer):
+    def __init__(self, port, logfile, status=200):
+        super().__init__(("127.0.0.1", port), FakeMailgunHandler)
+        self.logfile = logfile
+        self.status = status
+        self.calls = 0
+        self.lock = threading.Lock()
+
+class FakeMailgunHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        with self.server.lock:
+            self.server.calls += 1
+            if self.server.status == 200:
+                with open(self.server.logfile, 'a') as f:
+                    for receiver in form.get("to", []):
+                        f.write(json.dumps({"to": receiver, "subject": form["subject"][0], "text": form["text"][0]}) + "\n")
+        body = json.dumps({"id": f"<{self.server.calls}@fake>", "message": "Queued. Thank you."}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    status = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    FakeMailgun(int(sys.argv[1]), sys.argv[2], status).serve_forever()
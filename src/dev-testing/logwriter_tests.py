@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraLogWriter import *
+
+logdir = tempfile.mkdtemp()
+writer = AgoraLogWriter(logdir, policy="block")
+for i in range(2000):
+    writer.write(f"line {i}")
+writer.close()      # Everything queued is on disk once close() returns
+
+files = os.listdir(logdir)
+lines = [line for name in files for line in open(os.path.join(logdir, name), 'r')]
+assert len(lines) == 2000
+assert lines[-1].endswith("| line 1999\n") or len(files) > 1      # Unless the day rolled over mid-test
+assert writer.stats() == {"queue_depth": 0, "written": 2000, "dropped": 0, "errors": 0}
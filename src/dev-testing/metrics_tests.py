@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraMetrics import *
+
+metrics = AgoraMetrics()
+metrics.begin("agora.home")
+metrics.begin("agora.home")
+metrics.end("agora.home", "GET", 200, 0.003)
+metrics.begin("agora.login_post")
+metrics.end("agora.login_post", "POST", 200, 0.2, "AgoraEIncorrectCreds")
+text = metrics.render()
+assert 'agora_requests_total{endpoint="agora.home",method="GET",status="200"} 1' in text
+assert 'agora_request_duration_seconds_bucket{endpoint="agora.home",le="0.005"} 1' in text
+assert 'agora_request_duration_seconds_bucket{endpoint="agora.login_post",le="0.1"} 0' in text
+assert 'agora_request_duration_seconds_bucket{endpoint="agora.login_post",le="0.25"} 1' in text
+assert 'agora_request_duration_seconds_count{endpoint="agora.login_post"} 1' in text
+assert 'agora_errors_total{endpoint="agora.login_post",error="AgoraEIncorrectCreds"} 1' in text
+assert 'agora_requests_in_flight{endpoint="agora.home"} 1' in text
+
+# Two processes sharing a directory: one scrape adds them up, and an exited one's in-flight requests don't count
+metricsdir = tempfile.mkdtemp()
+parent = AgoraMetrics(metricsdir)
+parent.start()
+pid = os.fork()
+if pid == 0:
+    child = AgoraMetrics(metricsdir)
+    child.start()
+    child.begin("agora.home")
+    child.begin("agora.home")
+    child.end("agora.home", "GET", 200, 0.003)
+    child.close()
+    os._exit(0)
+os.waitpid(pid, 0)
+parent.begin("agora.home")
+parent.end("agora.home", "GET", 200, 0.003)
+text = parent.render()
+assert 'agora_requests_total{endpoint="agora.home",method="GET",status="200"} 2' in text
+assert 'agora_requests_in_flight{endpoint="agora.home"} 0' in text
+parent.close()
+assert sorted(os.listdir(metricsdir)) == ["archive.json", "archive.lock"]
+assert 'agora_requests_total{endpoint="agora.home",method="GET",status="200"} 2' in AgoraMetrics(metricsdir).render()
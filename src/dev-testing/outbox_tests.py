@@ -0,0 +1,68 @@
+import json
+import os
+import sys
+import threading
+import time
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraDatabaseManager import *
+from AgoraMigrator import *
+from AgoraEmailer import *
+from AgoraEmailWorker import *
+from fake_mailgun import *
+
+## Delivers through a fake Mailgun on localhost. To be performed after dbmanager_tests.py.
+
+MAILLOG = "../volumes/test-mail.log"
+if os.path.exists(MAILLOG):
+    os.remove(MAILLOG)
+
+fake = FakeMailgun(8025, MAILLOG)
+threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+AgoraMigrator("../params/migrations").migrate("../volumes/test.db")
+dbman = AgoraDatabaseManager("../volumes/test.db")
+eml = AgoraEmailer("key", "agora.test", "http://127.0.0.1:8025/v3")
+eml.setDeveloperEmails("dev1@agora.test,dev2@agora.test")
+worker = AgoraEmailWorker(dbman, eml)
+
+dbman.createToken(1, "tokentoken", "creation", email=eml.confirmAccountEmail("a@agora.test", "url", "backup"))
+dbman.queueEmails(eml.bugReport(1, 1, "it broke"))
+assert worker.drain() == 3
+assert fake.calls == 2      # Both bug reports went out in one call
+with open(MAILLOG, 'r') as f:
+    assert sorted(json.loads(line)["to"] for line in f) == ["a@agora.test", "dev1@agora.test", "dev2@agora.test"]
+assert worker.drain() == 0
+
+fake.status = 503
+dbman.queueEmails([eml.recoverAccountEmail("a@agora.test", "url")])
+assert worker.drain() == 1
+assert worker.drain() == 0      # Backing off
+assert dbman.query("SELECT attempts FROM outbox")[0]["attempts"] == 1
+
+fake.status = 400
+dbman.execute("UPDATE outbox SET nextattempt = 0", ())
+assert worker.drain() == 1
+assert dbman.query("SELECT nextattempt FROM outbox")[0]["nextattempt"] is None     # Rejected, given up on
+
+# A worker that can't drain stays up, but says so
+class BrokenDB:
+    def claimEmails(self, *args):
+        raise RuntimeError("no such table: outbox")
+class Log:
+    def __init__(self):
+        self.lines = []
+    def logif(self, cond, msg):
+        self.lines.append(msg)
+broken = AgoraEmailWorker(BrokenDB(), eml)
+log = Log()
+broken.setFileManager(log)
+broken.start()
+time.sleep(0.2)
+assert broken.thread.is_alive()
+broken.stop()
+assert broken.stats() == {"failures": 1, "last_error": "RuntimeError: no such table: outbox"}
+assert log.lines == ["Outbox worker failed to drain: RuntimeError: no such table: outbox"]
+
+fake.shutdown()
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraFileManager import *
+
+def raises(f, err):
+    try:
+        f()
+    except err:
+        return True
+    return False
+
+postdir = tempfile.mkdtemp()
+fm = AgoraFileManager(postdir, postdir, postdir)
+
+for layout in POST_STORE_LAYOUTS:
+    store = fm.openPostStore(layout)
+    store.put("postA.md", "hello")
+    store.put("postA.md", "hello again")
+    assert store.get("postA.md") == "hello again"
+    assert not store.putIfAbsent("postA.md", "stale")
+    assert store.putIfAbsent("postB.md", "b")
+    assert sorted(store.list()) == ["postA.md", "postB.md"]
+    store.delete("postA.md")
+    store.delete("postA.md")
+    assert raises(lambda: store.get("postA.md"), AgoraENoSuchPost)
+    store.delete("postB.md")
+
+# Posts stay readable through the fallback while they move, and writes always land in the new layout
+flat = fm.openPostStore("flat")
+flat.put("postC.md", "c")
+flat.put("postD.md", "d")
+fm.setPostLayout("sharded", "flat")
+assert fm.getPost("postC.md") == "c"
+fm.writePost("postD.md", "d2")
+assert list(flat.list()) == ["postC.md"]
+sharded = fm.openPostStore("sharded")
+for name in list(flat.list()):
+    sharded.putIfAbsent(name, flat.get(name))
+    flat.delete(name)
+assert sorted(sharded.list()) == ["postC.md", "postD.md"]
+assert fm.getPost("postD.md") == "d2"
+fm.close()
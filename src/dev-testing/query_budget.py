@@ -0,0 +1,9 @@
+## Fails a test when a route issues more SQL statements than it is budgeted for, which is how
+## an N+1 query usually shows up. Counts come from the app's AgoraQueryStats.
+
+def assertQueryBudget(app, client, path, budget, method="GET", **kwargs):
+    resp = client.open(path, method=method, **kwargs)
+    statements = app.extensions['agora'].queryStats.lastRequest()
+    assert statements is not None, f"{method} {path} was never counted"
+    assert len(statements) <= budget, f"{method} {path} issued {len(statements)} statements, over its budget of {budget}:\n" + "\n".join(statements)
+    return resp
@@ -0,0 +1,74 @@
+import ast
+import re
+import sqlite3
+import sys
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraMigrator import *
+
+## Runs EXPLAIN QUERY PLAN on every SQL string in AgoraDatabaseManager against a fully migrated
+## schema, and fails if a query outside of COLD_QUERIES has to scan a whole table.
+
+# Rarely-run statements that are allowed to scan
+COLD_QUERIES = [
+    "SELECT uid FROM users WHERE hrecovery = ?",
+    "DELETE FROM tokens WHERE owner = ?",
+    "DELETE FROM tokens WHERE owner = ? AND type = ?",
+    "DELETE FROM comments WHERE owner = ?",
+    "DELETE FROM reports WHERE owner = ?",
+    "DELETE FROM votes WHERE owner = ?",
+    "SELECT filename FROM posts",
+    "SELECT filename FROM images",
+    "UPDATE posts SET score = COALESCE((SELECT SUM(likes) FROM votes WHERE postid = posts.pid), 0)",
+]
+
+SQL_VERBS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+def sqlStrings(path):
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            if node.value.lstrip().upper().startswith(SQL_VERBS):
+                yield node.value
+
+# Numbered parameters like ?1 can be used more than once
+def bindings(sql):
+    numbered = [int(n) for n in re.findall(r"\?(\d+)", sql)]
+    return (None,) * (max(numbered) if numbered else sql.count("?"))
+
+def explain(conn, sql):
+    return conn.execute(f"EXPLAIN QUERY PLAN {sql}", bindings(sql)).fetchall()
+
+def fullScans(conn, sql):
+    plan = explain(conn, sql)
+    return [row[3] for row in plan if row[3].startswith("SCAN ") and "VIRTUAL TABLE" not in row[3] and row[3] != "SCAN CONSTANT ROW"]
+
+conn = sqlite3.connect(":memory:", isolation_level=None)
+with open("../params/agora.schema", 'r') as f:
+    conn.executescript(f.read())
+AgoraMigrator("../params/migrations").apply(conn)
+
+failures = []
+for sql in sqlStrings("../utilities/AgoraDatabaseManager.py"):
+    if sql in COLD_QUERIES:
+        continue
+    scans = fullScans(conn, sql)
+    if scans:
+        failures.append(f"{sql}\n    {'; '.join(scans)}")
+
+assert not failures, "Queries doing full table scans:\n" + "\n".join(failures)
+
+# The feed reads a limited run of each friend's posts in index order, so only the merged page ever gets sorted
+feeds = [sql for sql in sqlStrings("../utilities/AgoraDatabaseManager.py") if "F JOIN posts P ON P.pid IN" in sql]
+assert len(feeds) == 2
+for sql in feeds:
+    plan = {row[0]: row for row in explain(conn, sql)}
+    perFriend = [id for id, parent, _, detail in plan.values() if detail.startswith("CORRELATED LIST SUBQUERY")]
+    assert perFriend
+    for id, parent, _, detail in plan.values():
+        if re.search(r"\bposts\b", detail):
+            assert parent in perFriend and "USING COVERING INDEX posts_owner_timestamp" in detail, detail
+        if "TEMP B-TREE FOR ORDER BY" in detail:
+            assert parent not in perFriend, detail
@@ -0,0 +1,73 @@
+import sys
+import time
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraDatabaseManager import *
+from AgoraMigrator import *
+from AgoraRateLimiter import *
+
+## To be performed after dbmanager_tests.py.
+
+AgoraMigrator("../params/migrations").migrate("../volumes/test.db")
+dbman = AgoraDatabaseManager("../volumes/test.db")
+uid = dbman.createUser("limits@agora.test", "limits", "hpassword", "hrecovery", "default")
+other = dbman.createUser("limits2@agora.test", "limits2", "hpassword", "hrecovery", "default")
+dbman.execute("UPDATE users SET lastaction = datetime('now', '-1 day')", ())
+
+def refused(limiter, uid, action, error):
+    try:
+        limiter.acquire(uid, action)
+    except error:
+        return True
+    return False
+
+# Bursts, then one action per interval
+limiter = AgoraRateLimiter(dbman, buckets={"profile": (2, 0.2), "post": (10, 0.01)}, daily={"post": 3})
+limiter.acquire(uid, "profile")
+limiter.acquire(uid, "profile")
+assert refused(limiter, uid, "profile", AgoraETooSoon)
+limiter.acquire(other, "profile")      # Every user has their own buckets
+time.sleep(0.25)
+limiter.acquire(uid, "profile")
+assert refused(limiter, uid, "profile", AgoraETooSoon)
+
+# The daily window counts what's already in the database
+dbman.insertPost(uid, "yesterday", "old.md")
+dbman.execute("UPDATE posts SET timestamp = datetime('now', '-25 hours') WHERE owner = ?", (uid,))
+dbman.insertPost(uid, "earlier today", "new.md")
+limiter.acquire(uid, "post")
+limiter.acquire(uid, "post")
+assert refused(limiter, uid, "post", AgoraETooMany)
+assert limiter.stats() == {"allowed": 6, "toosoon": 2, "toomany": 1, "dirty": 2, "failures": 0, "last_error": None}
+
+# lastaction is only written at checkpoints, and a new limiter picks its buckets up from there
+assert dbman.getUserLastAction(uid) > 3600
+assert limiter.checkpoint() == 2
+assert limiter.checkpoint() == 0
+assert dbman.getUserLastAction(uid) < 5
+fresh = AgoraRateLimiter(dbman, buckets={"profile": (2, 60)}, daily={})
+fresh.acquire(uid, "profile")
+assert refused(fresh, uid, "profile", AgoraETooSoon)
+
+# A checkpoint that can't be written keeps its times for the next one, and is logged and counted
+class BrokenDB:
+    def getUserLastAction(self, uid):
+        return None
+    def setUserLastActions(self, items):
+        raise RuntimeError("database is locked")
+class Log:
+    def __init__(self):
+        self.lines = []
+    def logif(self, cond, msg):
+        self.lines.append(msg)
+broken = AgoraRateLimiter(BrokenDB(), buckets={"profile": (2, 60)}, daily={})
+log = Log()
+broken.setFileManager(log)
+broken.acquire(uid, "profile")
+broken.stop()
+assert broken.stats()["dirty"] == 1
+assert broken.stats()["failures"] == 1 and broken.stats()["last_error"] == "RuntimeError: database is locked"
+assert log.lines == ["Rate limiter failed to checkpoint lastaction: RuntimeError: database is locked"]
+
+dbman.close()
@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import sys
+import tempfile
+os.chdir("..")      # server.py finds its params, utilities and templates relative to src
+sys.path.insert(1, ".")
+sys.path.insert(1, "./dev-testing")
+
+from server import *
+from query_budget import *
+
+## Every page gets a budget of SQL statements. Raise one only after checking that the new statements
+## don't grow with the number of posts, comments or friends on the page.
+
+volumes = tempfile.mkdtemp()
+for d in ["posts", "img", "logs"]:
+    os.mkdir(os.path.join(volumes, d))
+config = config_from_env()
+config.update({
+    'DBFILE': os.path.join(volumes, "agora.db"),
+    'POSTDIR': os.path.join(volumes, "posts"),
+    'IMGDIR': os.path.join(volumes, "img"),
+    'LOGDIR': os.path.join(volumes, "logs"),
+    'RECAPTCHA_VERIFIER': 'stub',
+    'MAILGUN_API': 'http://127.0.0.1:9/v3'      # Nothing listens there; mail just waits in the outbox
+})
+conn = sqlite3.connect(config['DBFILE'])
+conn.executescript(open("./params/agora.schema").read())
+conn.close()
+
+app = create_app(config)
+services = app.extensions['agora']
+model = services.model
+db = services.db
+
+def makeUser(email, username):
+    model.createAccount(email, username, "passwordpassword1", "captcha")
+    model.confirmCreate(db.query("SELECT value FROM tokens WHERE type = 'creation' ORDER BY rowid DESC LIMIT 1")[0]["value"])
+    return model.identify(model.login(username, "passwordpassword1", "captcha"))
+
+alice = makeUser("alice@agora.test", "alice")
+bob = makeUser("bob@agora.test", "bobby")
+uid_a = alice.uid
+uid_b = bob.uid
+db.execute("UPDATE users SET lastaction = datetime('now', '-1 day')", ())   # Both start out on full buckets
+pids = []
+for i in range(3):
+    pids.append(str(model.writePost(alice, f"Post number {i}", "Some *words*", "captcha")))
+for pid in pids:
+    model.comment(bob, pid, "Nice one", "captcha")
+    model.like(bob, pid)
+model.friendRequest(alice, str(uid_b))
+model.friendRequest(bob, str(uid_a))
+
+anon = app.test_client()
+user = app.test_client()
+user.set_cookie("session", alice.token)
+
+assertQueryBudget(app, anon, "/", 0)
+assertQueryBudget(app, anon, f"/post/{pids[0]}", 3)
+assertQueryBudget(app, user, f"/post/{pids[0]}", 4)
+assertQueryBudget(app, anon, f"/user/{uid_a}", 4)
+assertQueryBudget(app, user, f"/user/{uid_a}", 5)
+assertQueryBudget(app, anon, "/browse/posts", 1)
+assertQueryBudget(app, anon, "/browse/users", 1)
+assertQueryBudget(app, anon, "/search?post=number", 1)
+assertQueryBudget(app, user, "/feed", 2)
+
+# Cursors with the wrong number of keys are turned away, not handed to SQLite
+for path in ["/browse/posts?after=WzFd", "/browse/users?after=WzEsMiwzXQ==", "/search?user=ab&after=WzVd", "/feed?before=WzFd"]:
+    resp = user.get(path)
+    assert resp.status_code == 200 and b"AgoraEInvalidQuery" in resp.data, path
+
+# Only the file manager knows about image sizes; an unknown one is no such image
+with open(os.path.join(volumes, "img", "plain.png"), 'wb') as f:
+    f.write(b"not really a png")
+db.insertImage(uid_a, "plain", "plain.png", "plainimage")
+assert anon.get("/userimg/plainimage?size=thumbnail").data == b"not really a png"     # The original stands in until a variant is made
+resp = anon.get("/userimg/plainimage?size=huge")
+assert resp.status_code == 200 and b"AgoraENoSuchImage" in resp.data
+assertQueryBudget(app, user, "/files", 5)
+assertQueryBudget(app, user, f"/vote/{pids[1]}", 3, method="POST", data={"vote": "like"})
+# Rate limits are kept in memory, so only the first comment reads the day's comments back
+assertQueryBudget(app, user, f"/comment/{pids[1]}", 4, method="POST", data={"content": "Thanks", "g-recaptcha-response": "captcha"})
+assertQueryBudget(app, user, f"/comment/{pids[2]}", 3, method="POST", data={"content": "Thanks", "g-recaptcha-response": "captcha"})
+services.sessions.clear()
+assertQueryBudget(app, user, "/files", 6)     # A cold session cache costs one lookup, however many calls need the user
+
+# The budget itself has to bite
+try:
+    assertQueryBudget(app, user, f"/user/{uid_a}", 1)
+    assert False
+except AssertionError as err:
+    assert "over its budget of 1" in str(err)
+
+services.close()
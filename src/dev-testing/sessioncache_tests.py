@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(1, "../params")
+sys.path.insert(1, "../utilities")
+
+from AgoraSessionCache import *
+
+## Two caches sharing a directory stand in for two worker processes.
+
+shared = tempfile.mkdtemp()
+mine = AgoraSessionCache(100, 60, shared)
+theirs = AgoraSessionCache(100, 60, shared)
+alice = {"uid": 1, "suspended": False, "issued": time.time()}
+bob = {"uid": 2, "suspended": False, "issued": time.time()}
+
+# A logout in one worker reaches the other's cache, and the token never reaches the file
+for cache in (mine, theirs):
+    cache.put("alicetoken", alice)
+    cache.put("alicephone", alice)
+    cache.put("bobtoken", bob)
+assert theirs.get("alicetoken") == alice
+mine.discard("alicetoken")
+assert theirs.get("alicetoken") is None
+assert theirs.get("alicephone") == alice
+assert "alicetoken" not in open(os.path.join(shared, "revoked.log")).read()
+
+# So does a suspension, for every session of that user
+mine.discardUser(1)
+assert theirs.get("alicephone") is None
+assert mine.get("alicephone") is None
+assert theirs.get("bobtoken") == bob
+
+# A session read from the database just before its revocation doesn't stick once cached just after it
+theirs.put("alicephone", alice)
+assert theirs.get("alicephone") is None
+theirs.put("bobtoken", bob)
+assert theirs.get("bobtoken") == bob
+
+# Without a directory it's a cache for one process
+alone = AgoraSessionCache(100, 60)
+alone.put("alicetoken", alice)
+alone.discard("alicetoken")
+assert alone.get("alicetoken") is None
+alone.put("bobtoken", bob)
+assert alone.get("bobtoken") == bob
+
+# The log is cut back to the revocations that can still matter, and the other cache follows it across the cut
+small = tempfile.mkdtemp()
+mine = AgoraSessionCache(100, 0.1, small, maxLogBytes=200)
+theirs = AgoraSessionCache(100, 0.1, small, maxLogBytes=200)
+for i in range(20):
+    mine.discard(f"old{i}")
+time.sleep(0.3)
+theirs.put("bobtoken", bob)
+theirs.get("bobtoken")
+mine.discard("bobtoken")
+assert os.path.getsize(os.path.join(small, "revoked.log")) < 200
+assert theirs.get("bobtoken") is None
+time.sleep(0.3)
+theirs.put("alicetoken", alice)
+for i in range(20):
+    mine.discardUser(i + 2)
+mine.discardUser(1)
+assert theirs.get("alicetoken") is None
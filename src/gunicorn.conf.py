@@ -0,0 +1,59 @@
+import os
+import sys
+
+## Production entry point:  gunicorn -c gunicorn.conf.py
+## The master migrates the database once and forks; every worker then builds its own connections,
+## caches and background threads in create_app. SIGHUP replaces the workers gracefully, SIGTERM drains them.
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.join(chdir, 'params'))
+
+from limits import *
+
+wsgi_app = 'server:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('AGORA_WORKERS', SERVER_WORKERS)) or os.cpu_count() or 1
+threads = int(os.environ.get('AGORA_THREADS', SERVER_THREADS))
+worker_class = 'gthread'
+if os.environ.get('AGORA_SERVER') == 'asgi':
+    # One event loop per worker, with ASGI_MODEL_THREADS threads behind it instead of one per connection
+    wsgi_app = 'asgi:create_asgi_app()'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = False     # Importing the app in the master would open the database before fork
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT_SECONDS
+max_requests = SERVER_MAX_REQUESTS
+max_requests_jitter = SERVER_MAX_REQUESTS_JITTER
+accesslog = '-'
+
+def migrate_database(server):
+    os.chdir(chdir)
+    import server as agora
+    applied = agora.migrate(agora.config_from_env())
+    if applied:
+        server.log.info("Applied migrations: %s", ", ".join(applied))
+    # Workers have to import the code afresh, or a SIGHUP would bring the old code back up
+    for name, module in list(sys.modules.items()):
+        if (getattr(module, '__file__', None) or '').startswith(chdir + os.sep):
+            del sys.modules[name]
+
+def on_starting(server):
+    migrate_database(server)
+    # Counters start over with the master; across HUPs they carry on in archive.json
+    metricsdir = os.environ.setdefault('METRICS_DIR', os.path.join(chdir, 'volumes', 'metrics'))
+    os.makedirs(metricsdir, exist_ok=True)
+    for filename in os.listdir(metricsdir):
+        os.remove(os.path.join(metricsdir, filename))
+    # Revocations only matter to caches that outlive them by less than a TTL, so none from before this master do
+    sessiondir = os.environ.setdefault('SESSIONS_DIR', os.path.join(chdir, 'volumes', 'sessions'))
+    os.makedirs(sessiondir, exist_ok=True)
+    for filename in os.listdir(sessiondir):
+        os.remove(os.path.join(sessiondir, filename))
+
+def on_reload(server):
+    migrate_database(server)
+
+def worker_exit(server, worker):
+    app = getattr(worker, 'wsgi', None)
+    app = getattr(app, 'flask', app)    # Under asgi.py
+    if app is not None and 'agora' in getattr(app, 'extensions', {}):
+        app.extensions['agora'].close()     # Flushes logs and finishes queued writes before the process goes
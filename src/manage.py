@@ -0,0 +1,135 @@
+import os
+import sys
+import argparse
+
+sys.path.insert(1, './params')
+sys.path.insert(1, './utilities')
+
+from limits import *
+from AgoraDatabaseManager import *
+from AgoraMigrator import *
+from AgoraFileManager import *
+from AgoraRenderer import *
+from AgoraImageProcessor import *
+from AgoraTokenSweeper import *
+
+POSTDIR = './volumes/posts/'
+IMGDIR = './volumes/img'
+LOGDIR = './volumes/logs'
+DBFILE = './volumes/agora.db'
+MIGRATIONDIR = './params/migrations'
+POST_STORE = os.environ.get('POST_STORE', 'flat')
+POST_STORE_FALLBACK = os.environ.get('POST_STORE_FALLBACK')
+
+def openDB():
+    AgoraMigrator(MIGRATIONDIR).migrate(DBFILE)
+    return AgoraDatabaseManager(DBFILE)
+
+def openFM():
+    fm = AgoraFileManager(POSTDIR, IMGDIR, LOGDIR)
+    fm.setPostLayout(POST_STORE, POST_STORE_FALLBACK)
+    return fm
+
+def rebuildScores(args):
+    db = openDB()
+    db.rebuildPostScores()
+    db.close()
+    print("Rebuilt post scores from votes.")
+
+def renderPosts(args):
+    db = openDB()
+    fm = openFM()
+    fm.setRenderer(AgoraRenderer())
+    rendered, missing = 0, 0
+    for filename in db.getPostFilenames():
+        try:
+            rendered += fm.refreshRenderedPost(filename, force=args.force)
+        except AgoraENoSuchPost:
+            missing += 1
+    db.close()
+    print(f"Rendered {rendered} posts ({missing} missing their markdown file).")
+
+def indexPosts(args):
+    db = openDB()
+    fm = openFM()
+    indexed, missing, last = 0, 0, 0
+    while True:
+        posts = db.getPostsAfter(last, args.batch)
+        if len(posts) == 0:
+            break
+        batch = []
+        for post in posts:
+            try:
+                batch.append((post["pid"], post["title"], fm.getPost(post["filename"])))
+            except AgoraENoSuchPost:
+                missing += 1
+        db.indexPosts(batch)
+        indexed += len(batch)
+        last = posts[-1]["pid"]
+    db.optimizePostIndex()
+    db.close()
+    print(f"Indexed {indexed} posts ({missing} missing their markdown file).")
+
+def deriveImages(args):
+    db = openDB()
+    images = AgoraImageProcessor(IMGDIR)
+    derived, broken = 0, 0
+    for filename in db.getImageFilenames():
+        try:
+            derived += images.derive(filename, force=args.force) > 0
+        except AgoraEBadImage:
+            broken += 1
+    db.close()
+    print(f"Made variants for {derived} images ({broken} missing or unreadable).")
+
+def migratePosts(args):
+    fm = AgoraFileManager(POSTDIR, IMGDIR, LOGDIR)
+    source, target = fm.openPostStore(args.source), fm.openPostStore(args.target)
+    moved, kept = 0, 0
+    for name in list(source.list()):
+        try:
+            content = source.get(name)
+        except AgoraENoSuchPost:
+            continue    # Deleted by the server while we were going
+        # Safe while the server runs on the new layout: anything it already wrote there is newer than our copy
+        if target.putIfAbsent(name, content):
+            moved += 1
+        else:
+            kept += 1
+        source.delete(name)
+    fm.close()
+    print(f"Moved {moved} files from {args.source} to {args.target} ({kept} were already there).")
+
+def sweepTokens(args):
+    db = openDB()
+    report = AgoraTokenSweeper(db).sweep()
+    db.close()
+    counts = ", ".join(f"{n} {ttype}" for ttype, n in report["removed"].items())
+    print(f"Removed {report['total']} expired tokens ({counts}) in {report['seconds']:.3f}s.")
+
+parser = argparse.ArgumentParser(description="Maintenance commands for an Agora instance. Run from the same directory as server.py.")
+commands = parser.add_subparsers(dest="command", required=True)
+
+commands.add_parser("rebuild-scores", help="recompute every post's score from the votes table").set_defaults(run=rebuildScores)
+
+render = commands.add_parser("render-posts", help="render posts whose stored HTML is missing or was made with other sanitizer settings")
+render.add_argument("--force", action="store_true", help="re-render every post, even ones that look up to date")
+render.set_defaults(run=renderPosts)
+
+index = commands.add_parser("index-posts", help="(re)build the full-text search index from the stored post files")
+index.add_argument("--batch", type=int, default=500, help="posts read and indexed per transaction")
+index.set_defaults(run=indexPosts)
+
+derive = commands.add_parser("derive-images", help="make the resized, metadata-free variants of images uploaded before they existed")
+derive.add_argument("--force", action="store_true", help="remake every variant, e.g. after changing IMG_VARIANTS")
+derive.set_defaults(run=deriveImages)
+
+migrate = commands.add_parser("migrate-posts", help="move post files from one storage layout to another; run the server with POST_STORE=<target> POST_STORE_FALLBACK=<source> meanwhile")
+migrate.add_argument("--from", dest="source", choices=POST_STORE_LAYOUTS, default="flat", help="layout to move posts out of")
+migrate.add_argument("--to", dest="target", choices=POST_STORE_LAYOUTS, required=True, help="layout to move posts into")
+migrate.set_defaults(run=migratePosts)
+
+commands.add_parser("sweep-tokens", help="delete tokens older than their TOKEN_TTL_SECONDS right away").set_defaults(run=sweepTokens)
+
+args = parser.parse_args()
+args.run(args)
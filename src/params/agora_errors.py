@@ -12,6 +12,8 @@ class AgoraEInvalidToken(AgoraException):
     pass
 class AgoraEAreYouHuman(AgoraException):
     pass
+class AgoraECaptchaUnavailable(AgoraException):
+    pass
 
 # Errors pertaining to user-uploaded content
 class AgoraEBadImage(AgoraException):
@@ -30,6 +32,8 @@ class AgoraEInvalidQuery(AgoraException):
     pass
 class AgoraETooSoon(AgoraException):
     pass
+class AgoraETooMany(AgoraException):
+    pass
 
 # Authentication errors
 class AgoraEIncorrectCreds(AgoraException):
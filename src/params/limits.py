@@ -10,6 +10,9 @@ SESSION_TOKEN_LENGTH = 30
 SESSION_MAX_DURATION_MINS = 120
 
 POST_RANDOM_ID_LENGTH = 10
+POST_RENDER_CACHE_MAX_ENTRIES = 500
+POST_STORE_LAYOUTS = ["flat", "sharded", "blob"]
+POST_STORE_POOL_SIZE = 10
 IMG_RANDOM_ID_LENGTH = 10
 
 TOKEN_LENGTHS = {
@@ -24,6 +27,32 @@ TOKEN_LENGTHS = {
 }
 
 QUERY_MAX_LENGTH = 100
+SEARCH_TITLE_WEIGHT = 10.0
+BROWSE_PAGE_SIZE = 25
+BROWSE_PAGE_SIZE_MAX = 100
+BROWSE_CURSOR_MAX_LENGTH = 200
+
+FEED_CACHE_MAX_ENTRIES = 5000
+FEED_CACHE_TTL_SECONDS = 30
+
+DB_READ_POOL_SIZE = 10
+DB_BUSY_TIMEOUT_SECONDS = 5
+DB_WRITE_FLUSH_WINDOW_SECONDS = 0.002
+DB_WRITE_BATCH_MAX_UNITS = 200
+DB_SLOW_QUERY_SECONDS = 0.1
+DB_SLOW_QUERY_LOG_SIZE = 100
+DB_QUERY_STATS_MAX_STATEMENTS = 1000
+
+SERVER_WORKERS = 0      # 0 starts one worker process per CPU
+SERVER_THREADS = 8
+SERVER_GRACEFUL_TIMEOUT_SECONDS = 30
+SERVER_MAX_REQUESTS = 10000     # Workers get replaced after this many requests, staggered by the jitter
+SERVER_MAX_REQUESTS_JITTER = 1000
+ASGI_MODEL_THREADS = DB_READ_POOL_SIZE      # Under asgi.py, requests being handled at once per worker; any more wait without a thread
+ASGI_MAX_BODY_BYTES = 4000000
+
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+METRICS_FLUSH_INTERVAL_SECONDS = 5     # How stale another worker's numbers can be in a scrape
 
 USER_MAX_POSTS = 200
 USER_MAX_POSTS_PER_DAY = 5
@@ -35,9 +64,65 @@ USER_MAX_COMMENTS_PER_DAY = 50
 
 FRIEND_REQUESTS_MAX_PER_DAY = 20
 
+RATE_LIMIT_BUCKETS = {      # Per user: (burst, seconds for one more action to be allowed)
+    "profile": (5, 10),     # Status, picture, email and username changes
+    "post": (3, 60),
+    "comment": (5, 10),
+    "image": (5, 10),
+    "delete": (10, 2),      # Posts, comments and images
+    "friend": (5, 10),
+    "accept": (10, 2),
+    "report": (2, 300)
+}
+RATE_LIMIT_DAILY = {        # Per user, in any 24 hours
+    "post": USER_MAX_POSTS_PER_DAY,
+    "comment": USER_MAX_COMMENTS_PER_DAY,
+    "friend": FRIEND_REQUESTS_MAX_PER_DAY
+}
+RATE_LIMIT_MAX_USERS = 10000
+RATE_LIMIT_WINDOW_RELOAD_SECONDS = 60   # How far behind one worker can be on another's posts, comments and friend requests
+RATE_LIMIT_CHECKPOINT_SECONDS = 30      # How often users.lastaction is written
+
 SESSION_MAX_DURATION_SECONDS = 1800
-USER_ACTION_TIMEOUT_SECONDS = 1
+TOKEN_TTL_SECONDS = {     # The sweeper deletes tokens that are older than this
+    "session": SESSION_MAX_DURATION_SECONDS,
+    "creation": 7 * 24 * 3600,
+    "recovery": 24 * 3600,
+    "deletion": 24 * 3600,
+    "email": 24 * 3600
+}
+TOKEN_SWEEP_INTERVAL_SECONDS = 300
+TOKEN_SWEEP_BATCH_SIZE = 500
+SESSION_CACHE_MAX_ENTRIES = 10000
+SESSION_CACHE_TTL_SECONDS = 60
+SESSION_REVOCATION_LOG_MAX_BYTES = 1 << 20      # revoked.log is cut back to its recent lines past this size
+SESSION_REVOCATION_GRACE_SECONDS = 5     # A session cached this soon after its revocation may have been read before it
 RECAPTCHA_THRESHHOLD = 0.7
+RECAPTCHA_FAIL_OPEN = False        # Whether to let people through when Google can't be reached
+RECAPTCHA_HTTP_POOL_SIZE = 10
+RECAPTCHA_CONNECT_TIMEOUT_SECONDS = 1
+RECAPTCHA_READ_TIMEOUT_SECONDS = 2
+RECAPTCHA_BREAKER_THRESHOLD = 5
+RECAPTCHA_BREAKER_COOLDOWN_SECONDS = 30
+RECAPTCHA_TRUST_SECONDS = 300      # 0 asks for a captcha on every post and comment
+RECAPTCHA_TRUST_MAX_ENTRIES = 10000
+
+LOG_QUEUE_MAX_LINES = 10000
+LOG_QUEUE_FULL_POLICY = "drop"     # "drop" loses lines when the disk can't keep up, "block" makes requests wait for room
+LOG_BLOCK_TIMEOUT_SECONDS = 1
+LOG_BATCH_MAX_LINES = 500
+LOG_FLUSH_INTERVAL_SECONDS = 0.5
+
+EMAIL_OUTBOX_POLL_SECONDS = 1
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_BATCH_MAX_RECIPIENTS = 1000
+EMAIL_CLAIM_LEASE_SECONDS = 120
+EMAIL_HTTP_POOL_SIZE = 2
+EMAIL_CONNECT_TIMEOUT_SECONDS = 3
+EMAIL_READ_TIMEOUT_SECONDS = 10
+EMAIL_MAX_ATTEMPTS = 8
+EMAIL_RETRY_BASE_SECONDS = 30
+EMAIL_RETRY_MAX_SECONDS = 3600
 
 #frontend
 
@@ -61,6 +146,16 @@ POST_TITLE_MIN_LENGTH = 1
 IMG_TITLE_MAX_LENGTH = 100
 IMG_TITLE_MIN_LENGTH = 1
 IMG_MAX_SIZE_BYTES = 1000000
+IMG_MAX_PIXELS = 40000000
+IMG_JPEG_QUALITY = 85
+IMG_VARIANTS = {        # Longest side in pixels, about twice the size each one is shown at
+    "avatar": 128,
+    "thumbnail": 512,
+    "display": 1600
+}
+IMG_DEFAULT_VARIANT = "display"
+IMG_CACHE_MAX_AGE_SECONDS = 31536000
+IMG_FALLBACK_MAX_AGE_SECONDS = 3600
 
 COMMENT_MAX_LENGTH = 200
 COMMENT_MIN_LENGTH = 1
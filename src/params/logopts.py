@@ -14,3 +14,9 @@ LOG_DELETE_IMAGE = True
 LOG_SUSPEND = True
 LOG_UNSUSPEND = True
 LOG_ADMIN_DELETION = True
+
+LOG_TOKEN_SWEEPS = True
+LOG_SWEEP_ERRORS = True
+LOG_SLOW_QUERIES = True
+LOG_OUTBOX_ERRORS = True
+LOG_RATE_LIMIT_ERRORS = True
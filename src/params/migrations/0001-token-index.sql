@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS tokens_value_type ON tokens (value, type);
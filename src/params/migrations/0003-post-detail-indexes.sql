@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS comments_post ON comments (post);
+CREATE INDEX IF NOT EXISTS votes_postid_owner ON votes (postid, owner);
@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS friendships_user1 ON friendships (user1);
+CREATE INDEX IF NOT EXISTS friendships_user2 ON friendships (user2);
@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS posts_owner ON posts (owner);
+CREATE INDEX IF NOT EXISTS images_owner ON images (owner);
+CREATE INDEX IF NOT EXISTS images_accessid ON images (accessid);
@@ -0,0 +1,16 @@
+DELETE FROM votes WHERE rowid NOT IN (SELECT MAX(rowid) FROM votes GROUP BY owner, postid);
+DROP INDEX IF EXISTS votes_postid_owner;
+CREATE UNIQUE INDEX votes_postid_owner ON votes (postid, owner);
+
+ALTER TABLE posts ADD COLUMN score INTEGER NOT NULL DEFAULT 0;
+UPDATE posts SET score = COALESCE((SELECT SUM(likes) FROM votes WHERE postid = posts.pid), 0);
+
+CREATE TRIGGER votes_score_insert AFTER INSERT ON votes BEGIN
+    UPDATE posts SET score = score + NEW.likes WHERE pid = NEW.postid;
+END;
+CREATE TRIGGER votes_score_update AFTER UPDATE OF likes ON votes BEGIN
+    UPDATE posts SET score = score - OLD.likes + NEW.likes WHERE pid = NEW.postid;
+END;
+CREATE TRIGGER votes_score_delete AFTER DELETE ON votes BEGIN
+    UPDATE posts SET score = score - OLD.likes WHERE pid = OLD.postid;
+END;
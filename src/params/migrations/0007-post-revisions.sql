@@ -0,0 +1 @@
+ALTER TABLE posts ADD COLUMN revision INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,19 @@
+CREATE VIRTUAL TABLE usersearch USING fts5 (username, content='users', content_rowid='uid', tokenize='trigram');
+INSERT INTO usersearch (usersearch) VALUES ('rebuild');
+
+CREATE TRIGGER users_search_insert AFTER INSERT ON users BEGIN
+    INSERT INTO usersearch (rowid, username) VALUES (NEW.uid, NEW.username);
+END;
+CREATE TRIGGER users_search_delete AFTER DELETE ON users BEGIN
+    INSERT INTO usersearch (usersearch, rowid, username) VALUES ('delete', OLD.uid, OLD.username);
+END;
+CREATE TRIGGER users_search_update AFTER UPDATE OF username ON users BEGIN
+    INSERT INTO usersearch (usersearch, rowid, username) VALUES ('delete', OLD.uid, OLD.username);
+    INSERT INTO usersearch (rowid, username) VALUES (NEW.uid, NEW.username);
+END;
+
+CREATE VIRTUAL TABLE postsearch USING fts5 (title, body, tokenize='unicode61 remove_diacritics 2');
+
+CREATE TRIGGER posts_search_delete AFTER DELETE ON posts BEGIN
+    DELETE FROM postsearch WHERE rowid = OLD.pid;
+END;
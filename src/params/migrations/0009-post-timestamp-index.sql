@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
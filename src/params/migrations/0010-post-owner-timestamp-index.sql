@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS posts_owner_timestamp ON posts (owner, timestamp);
+DROP INDEX IF EXISTS posts_owner;
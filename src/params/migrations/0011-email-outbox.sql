@@ -0,0 +1,13 @@
+CREATE TABLE outbox (
+    mid         INTEGER PRIMARY KEY,
+    recipient   TEXT NOT NULL,
+    subject     TEXT NOT NULL,
+    body        TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    nextattempt REAL DEFAULT 0,
+    lasterror   TEXT,
+    claim       TEXT,
+    created     TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX outbox_nextattempt ON outbox (nextattempt);
+CREATE INDEX outbox_claim ON outbox (claim);
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS tokens_type_issued ON tokens (type, issued);
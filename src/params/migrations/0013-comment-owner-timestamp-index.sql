@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS comments_owner_timestamp ON comments (owner, timestamp);
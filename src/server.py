@@ -1,8 +1,11 @@
+import atexit
+import hashlib
+import mimetypes
 import os
 import sys
-from flask import Flask, render_template, request, redirect, g, send_file
-import html_sanitizer
-import markdown
+import time
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, g, send_file, url_for
+from werkzeug.local import LocalProxy
 
 sys.path.insert(1, './params')
 sys.path.insert(1, './utilities')
@@ -10,45 +13,65 @@ sys.path.insert(1, './utilities')
 from limits import *
 from agora_errors import *
 from logopts import *
-from AgoraSyntacticFilter import *
-from AgoraSemanticFilter import *
-from AgoraInterpreterFilter import *
-from AgoraFilter import *
-from AgoraDatabaseManager import *
-from AgoraEmailer import *
-from AgoraFileManager import *
-
-PORT = sys.argv[1]
-MAILGUN_KEY = sys.argv[2]
-HOST = sys.argv[3]
-RECAPTCHA_SITEKEY = sys.argv[4]
-RECAPTCHA_SERVERKEY = sys.argv[5]
-DEV_EMAILS = sys.argv[6]
-POSTDIR = './volumes/posts/'
-IMGDIR = './volumes/img'
-LOGDIR = './volumes/logs'
-
-agoraInterpreter = AgoraInterpreterFilter(None)
-agoraSemantics = AgoraSemanticFilter(agoraInterpreter)
-agoraSyntax = AgoraSyntacticFilter(agoraSemantics)
-
-agoraDB = AgoraDatabaseManager("./volumes/agora.db")
-agoraSemantics.setDBManager(agoraDB)
-agoraInterpreter.setDBManager(agoraDB)
-
-agoraEmail = AgoraEmailer(MAILGUN_KEY, HOST)
-agoraEmail.setDeveloperEmails(DEV_EMAILS)
-agoraInterpreter.setEmailer(agoraEmail)
-
-agoraFM = AgoraFileManager(POSTDIR, IMGDIR, LOGDIR)
-agoraSemantics.setFileManager(agoraFM)
-agoraInterpreter.setFileManager(agoraFM)
-
-agoraSemantics.setReCaptchaKey(RECAPTCHA_SERVERKEY)
-agoraInterpreter.setHost(HOST)
-
-# Entry point for Agora Model
-agoraModel = agoraSyntax
+from AgoraMigrator import *
+from AgoraServices import *
+from AgoraIdentity import *
+
+def config_from_env(environ=os.environ):
+    return {
+        'PORT': int(environ.get('PORT', 8080)),
+        'MAILGUN_KEY': environ.get('MAILGUN_KEY', ''),
+        'HOST': environ.get('HOST', 'localhost'),
+        'RECAPTCHA_SITEKEY': environ.get('RECAPTCHA_SITEKEY', ''),
+        'RECAPTCHA_SERVERKEY': environ.get('RECAPTCHA_SERVERKEY', ''),
+        'RECAPTCHA_VERIFIER': environ.get('RECAPTCHA_VERIFIER'),
+        'DEV_EMAILS': environ.get('DEV_EMAILS', ''),
+        'MAILGUN_API': environ.get('MAILGUN_API', 'https://api.mailgun.net/v3'),
+        'POST_STORE': environ.get('POST_STORE', 'flat'),
+        'POST_STORE_FALLBACK': environ.get('POST_STORE_FALLBACK'),    # The old layout, while migrate-posts is moving posts out of it
+        'IMG_SENDFILE': environ.get('IMG_SENDFILE'),    # 'x-sendfile' or 'x-accel' hands image bytes to the front proxy
+        'IMG_ACCEL_PREFIX': environ.get('IMG_ACCEL_PREFIX', '/_userimg/'),
+        'POSTDIR': './volumes/posts/',
+        'IMGDIR': './volumes/img',
+        'LOGDIR': './volumes/logs',
+        'DBFILE': './volumes/agora.db',
+        'MIGRATIONDIR': './params/migrations',
+        'METRICSDIR': environ.get('METRICS_DIR'),    # Shared by the worker processes so a scrape covers all of them
+        'SESSIONDIR': environ.get('SESSIONS_DIR')    # Shared by the worker processes so a logout reaches all of them
+    }
+
+# The old positional command line: PORT MAILGUN_KEY HOST RECAPTCHA_SITEKEY RECAPTCHA_SERVERKEY DEV_EMAILS
+def config_from_argv(argv, environ=os.environ):
+    config = config_from_env(environ)
+    for key, value in zip(['PORT', 'MAILGUN_KEY', 'HOST', 'RECAPTCHA_SITEKEY', 'RECAPTCHA_SERVERKEY', 'DEV_EMAILS'], argv[1:]):
+        config[key] = value
+    config['PORT'] = int(config['PORT'])
+    return config
+
+def migrate(config):
+    return AgoraMigrator(config['MIGRATIONDIR']).migrate(config['DBFILE'])
+
+def create_app(config=None):
+    config = config_from_env() if config is None else config
+    migrate(config)     # A no-op when the pre-fork master already did it
+    services = AgoraServices(config)
+    services.start()
+    atexit.register(services.close)
+
+    app = Flask(__name__)
+    app.config.update(config)
+    app.use_x_sendfile = config['IMG_SENDFILE'] == 'x-sendfile'
+    app.extensions['agora'] = services
+    app.register_blueprint(agora)
+    return app
+
+agora = Blueprint('agora', __name__)
+
+# Resolved against the app handling the current request, so each worker process talks to its own connections
+agoraModel = LocalProxy(lambda: current_app.extensions['agora'].model)
+agoraFM = LocalProxy(lambda: current_app.extensions['agora'].fm)
+agoraMetrics = LocalProxy(lambda: current_app.extensions['agora'].metrics)
+agoraQueryStats = LocalProxy(lambda: current_app.extensions['agora'].queryStats)
 
 def handleAgoraError(err):
     return {
@@ -56,182 +79,217 @@ def handleAgoraError(err):
         "error": type(err).__name__
     }
 
-app = Flask(__name__)
-app.debug = True
-
-sanitizerSettings = dict(html_sanitizer.sanitizer.DEFAULT_SETTINGS)
-sanitizerSettings['tags'].add('img')
-sanitizerSettings['tags'].add('center')
-sanitizerSettings['empty'].add('img')
-sanitizerSettings['attributes'].update({'img': ('src',)})
-sanitizer = html_sanitizer.Sanitizer(settings=sanitizerSettings)     # We're using the library's default configuration
+# Under asgi.py the captcha has already been checked by the time a request gets a thread, and this is how it went
+def captcha_response(data):
+    checked = request.environ.get('agora.captcha')
+    if isinstance(checked, AgoraException):
+        raise checked
+    return data['g-recaptcha-response'] if checked is None else checked
 
-@app.errorhandler(AgoraException)
+@agora.app_errorhandler(AgoraException)
 def agoraError(err):
+    g.agoraError = type(err).__name__
     if isinstance(err, AgoraEInvalidToken) or isinstance(err, AgoraENotLoggedIn):
         return redirect('/login')
     g.data.update(handleAgoraError(err))
     return render_template('error.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.before_request
+# Registered ahead of agoraPreproc so the session lookup counts towards the latency
+@agora.before_app_request
+def metricsBegin():
+    g.metricsStart = time.perf_counter()
+    agoraMetrics.begin(request.endpoint or 'none')
+    agoraQueryStats.startRequest()
+
+@agora.after_app_request
+def metricsStatus(resp):
+    g.metricsStatus = resp.status_code
+    return resp
+
+@agora.teardown_app_request
+def metricsEnd(exc):
+    if 'metricsStart' not in g:
+        return
+    error = g.get('agoraError') or (None if exc is None else type(exc).__name__)
+    queries = agoraQueryStats.finishRequest()
+    agoraMetrics.end(request.endpoint or 'none', request.method, g.get('metricsStatus', 500), time.perf_counter() - g.metricsStart, error, queries)
+
+@agora.before_app_request
 def agoraPreproc():
-    agoraDB.connect()
     g.data = {}
-    g.data["recaptcha_sitekey"] = RECAPTCHA_SITEKEY
-    g.sessionToken = request.cookies.get("session")
-    try:
-        g.data["logged_in_user"] = agoraModel.getMyUser(g.sessionToken, concise=True)
-    except AgoraException as err:
-        g.data["logged_in_user"] = None
-
-@app.route('/')
+    g.data["recaptcha_sitekey"] = current_app.config['RECAPTCHA_SITEKEY']
+    if request.endpoint in ('static', 'agora.user_image'):
+        g.identity = AgoraIdentity(None)     # Nobody needs the session looked up just to fetch a file
+    else:
+        # The only session lookup this request makes; everything below gets handed g.identity
+        g.identity = agoraModel.identify(request.cookies.get("session"))
+    g.data["logged_in_user"] = g.identity.user
+
+@agora.route('/')
 def home():
     return render_template('index.html', data=g.data)
 
-@app.route('/users')
+@agora.route('/users')
 def users():
     return "Coming soon..."
 
-@app.route('/user/<uid>')
+@agora.route('/user/<uid>')
 def user(uid):
     userInfo = {}
     myInfo = None
-        
-    userInfo = agoraModel.getUser(uid)
 
     if g.data['logged_in_user'] is not None:
-        myInfo = agoraModel.getMyUser(g.sessionToken) 
-        
-        if uid == str(g.data['logged_in_user']['uid']):
-            userInfo = myInfo
+        myInfo = agoraModel.getMyUser(g.identity)
+
+    if myInfo is not None and uid == str(myInfo['uid']):
+        userInfo = myInfo
+    else:
+        userInfo = agoraModel.getUser(uid)
 
     g.data.update(userInfo)
     g.data['logged_in_user'] = myInfo
 
     return render_template('profile.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.route('/post/<pid>')
+@agora.route('/post/<pid>')
 def post(pid):
     get_post_content(pid)
     return render_template('post.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-def get_post_content(pid):
+def get_post_content(pid, raw=False):
     postInfo = agoraModel.getPost(pid)
-    md_content = agoraFM.getPost(postInfo['filename'])
-    html_content = sanitizer.sanitize(markdown.markdown(md_content))
-    postInfo["content"] = html_content
-    postInfo["raw_content"] = md_content
+    if raw:
+        postInfo["raw_content"] = agoraFM.getPost(postInfo['filename'])
+    else:
+        postInfo["content"] = agoraFM.getRenderedPost(postInfo['filename'], postInfo['revision'])
     g.data.update(postInfo)
     
-@app.route('/userimg/<accessid>')
+@agora.route('/userimg/<accessid>')
 def user_image(accessid):
+    variant = request.args.get('size')
     imgname = agoraModel.getImage(accessid)
-    filepath = agoraFM.relativizeImagePath(imgname)
-    return send_file(filepath, mimetype='image/gif')
+    filepath = agoraFM.relativizeImagePath(imgname, variant)
+    stat = os.stat(filepath)
+    # A file is never rewritten in place, so its name, size and mtime pin down its exact bytes
+    etag = hashlib.sha256(f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:32]
+    # An original standing in for a variant that hasn't been made yet will still change under this URL
+    final = os.path.basename(filepath) != imgname
+    maxAge = IMG_CACHE_MAX_AGE_SECONDS if final else IMG_FALLBACK_MAX_AGE_SECONDS
+    if current_app.config['IMG_SENDFILE'] == 'x-accel':
+        resp = current_app.response_class(mimetype=mimetypes.guess_type(filepath)[0])
+        resp.headers['X-Accel-Redirect'] = current_app.config['IMG_ACCEL_PREFIX'] + os.path.basename(filepath)
+        resp.set_etag(etag)
+        resp.last_modified = stat.st_mtime
+        resp.cache_control.public = True
+        resp.cache_control.max_age = maxAge
+        resp = resp.make_conditional(request)   # The proxy deals with Range itself
+    else:
+        resp = send_file(filepath, etag=etag, conditional=True, max_age=maxAge)
+    resp.cache_control.immutable = final
+    return resp
 
-@app.route('/join')
+@agora.route('/join')
 def join_get():
     return render_template('join.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.route('/join', methods=['POST'])
+@agora.route('/join', methods=['POST'])
 def join_post():
     data = request.form
-    agoraModel.createAccount(data['email'], data['username'], data['password'], data['g-recaptcha-response'])
+    agoraModel.createAccount(data['email'], data['username'], data['password'], captcha_response(data))
     return render_template('info.html', data=g.data, msg='confirm-sent-email')
 
-@app.route('/join/<token>')
+@agora.route('/join/<token>')
 def join_confirm(token):
     agoraModel.confirmCreate(token)
     return redirect('/')
 
-@app.route('/leave', methods=['POST'])
+@agora.route('/leave', methods=['POST'])
 def leave_post():
     formdata = request.form
-    agoraModel.deleteAccount(g.sessionToken, formdata['password'])
+    agoraModel.deleteAccount(g.identity, formdata['password'])
     return render_template('info.html', data=g.data, msg='leave-sent-email')
 
-@app.route('/leave/<token>')
+@agora.route('/leave/<token>')
 def leave_confirm(token):
     agoraModel.confirmDelete(token)
     return render_template('info.html', data=g.data, msg='goodbye')
 
-@app.route('/login')
+@agora.route('/login')
 def login_get():
     return render_template('login.html', data=g.data)
 
-@app.route('/login', methods=['POST'])
+@agora.route('/login', methods=['POST'])
 def login_post():
     data = request.form
-    sessionToken = agoraModel.login(data['username'], data['password'], data['g-recaptcha-response'])
+    sessionToken = agoraModel.login(data['username'], data['password'], captcha_response(data))
     resp = redirect("/account")
     resp.set_cookie("session", sessionToken)
     return resp
 
-@app.route('/logout', methods=['POST'])
+@agora.route('/logout', methods=['POST'])
 def logout():
-    agoraModel.logout(g.sessionToken)
+    agoraModel.logout(g.identity)
     return render_template('info.html', data=g.data, msg='logout')
 
-@app.route('/account')
+@agora.route('/account')
 def account_get():
     if g.data['logged_in_user'] is not None:
-        data = agoraModel.getMyUser(g.sessionToken)
-        return redirect(f"/user/{data['uid']}")
+        return redirect(f"/user/{g.identity.uid}")
     return redirect('/login')
 
-@app.route('/account', methods=['POST'])
+@agora.route('/account', methods=['POST'])
 def account_post():
     data = request.form
     if "status" in data:
-        agoraModel.changeStatus(g.sessionToken, data['status'])
+        agoraModel.changeStatus(g.identity, data['status'])
     if "username" in data:
-        agoraModel.changeUsername(g.sessionToken, data['username'])
+        agoraModel.changeUsername(g.identity, data['username'])
     if "pfp" in data:
-        agoraModel.changePicture(g.sessionToken, data['pfp'])
+        agoraModel.changePicture(g.identity, data['pfp'])
     if "email" in data:
-        agoraModel.changeEmail(g.sessionToken, data['email'])
+        agoraModel.changeEmail(g.identity, data['email'])
     return redirect("/account")
 
-@app.route('/settings')
+@agora.route('/settings')
 def settings_get():
     if g.data['logged_in_user'] is not None:
-        userInfo = agoraModel.getMyUser(g.sessionToken)
+        userInfo = agoraModel.getMyUser(g.identity)
         g.data.update(userInfo)
         return render_template('settings.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
     return redirect('/login')
 
-@app.route('/settings', methods=['POST'])
+@agora.route('/settings', methods=['POST'])
 def settings_post():
     return redirect('/account')
 
-@app.route('/backup')
+@agora.route('/backup')
 def backup_get():
     return render_template('recover-account.html', data=g.data)
 
-@app.route('/backup', methods=['POST'])
+@agora.route('/backup', methods=['POST'])
 def backup_post():
     data = request.form
     if 'email' in data and 'code' in data:
         agoraModel.backupRecover(data['code'], data['email'])
     return render_template('info.html', data=g.data, msg='backup-sent-email')
 
-@app.route('/changepass')
+@agora.route('/changepass')
 def change_password_request_get():
     return render_template('reset-password.html', data=g.data)
 
-@app.route('/changepass', methods=['POST'])
+@agora.route('/changepass', methods=['POST'])
 def change_password_request_post():
     data = request.form
     if "email" in data:
         agoraModel.recoverAccount(data["email"])
     return render_template('info.html', data=g.data, msg='recovery-sent-email')
 
-@app.route('/changepass/<token>')
+@agora.route('/changepass/<token>')
 def change_password_get(token):
     g.data['token'] = token
     return render_template('new-password.html', data=g.data)
 
-@app.route('/changepass/<token>', methods=['POST'])
+@agora.route('/changepass/<token>', methods=['POST'])
 def change_password_post(token):
     data = request.form
     if "password" in data:
@@ -239,166 +297,195 @@ def change_password_post(token):
         return render_template('info.html', data=g.data, msg='confirm-password-reset')
     return redirect('/login')
 
-@app.route('/confirmemail/<token>')
+@agora.route('/confirmemail/<token>')
 def confirm_email(token):
     agoraModel.confirmEmail(token)
     return redirect("/account")
 
-@app.route('/write')
+@agora.route('/write')
 def new_post():
     g.data['new_post'] = True
     return render_template('write-post.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.route('/write', methods=['POST'])
+@agora.route('/write', methods=['POST'])
 def write_post():
     data = request.form
-    pid = agoraModel.writePost(g.sessionToken, data["title"], data["content"], data["g-recaptcha-response"])
+    pid = agoraModel.writePost(g.identity, data["title"], data["content"], captcha_response(data))
     return redirect(f'/post/{pid}')
 
-@app.route('/edit/<pid>')
+@agora.route('/edit/<pid>')
 def edit_post_view(pid):
-    get_post_content(pid)
+    get_post_content(pid, raw=True)
     return render_template('write-post.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.route('/edit/<pid>', methods=['POST'])
+@agora.route('/edit/<pid>', methods=['POST'])
 def edit_post(pid):
     data = request.form
-    agoraModel.editPost(g.sessionToken, pid, data["title"], data["content"])
+    agoraModel.editPost(g.identity, pid, data["title"], data["content"])
     return redirect(f"/post/{pid}")
 
-@app.route('/deletepost/<pid>', methods=['POST'])
+@agora.route('/deletepost/<pid>', methods=['POST'])
 def delete_post(pid):
-    agoraModel.deletePost(g.sessionToken, pid)
+    agoraModel.deletePost(g.identity, pid)
     return redirect("/files")
 
-@app.route('/comment/<pid>', methods=['POST'])
+@agora.route('/comment/<pid>', methods=['POST'])
 def write_comment(pid):
     data = request.form
-    agoraModel.comment(g.sessionToken, pid, data['content'], data['g-recaptcha-response'])
+    agoraModel.comment(g.identity, pid, data['content'], captcha_response(data))
     return redirect(f"/post/{pid}")
 
-@app.route('/deletecomment/<cid>', methods=['POST'])
+@agora.route('/deletecomment/<cid>', methods=['POST'])
 def delete_comment(cid):
-    pid = agoraModel.deleteComment(g.sessionToken, cid)
+    pid = agoraModel.deleteComment(g.identity, cid)
     return redirect(f"/post/{pid}")
 
-@app.route('/admin/user/<uid>')
+@agora.route('/admin/user/<uid>')
 def admin_userview(uid):
-    userInfo = agoraModel.adminGetUser(g.sessionToken, uid)
+    userInfo = agoraModel.adminGetUser(g.identity, uid)
     g.data.update(userInfo)
     return render_template('admin_userview.html', data=g.data)
 
-@app.route('/admin/suspend/<uid>', methods=['POST'])
+@agora.route('/admin/metrics')
+def admin_metrics():
+    return current_app.response_class(agoraModel.adminMetrics(g.identity), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@agora.route('/admin/suspend/<uid>', methods=['POST'])
 def admin_suspend(uid):
-    agoraModel.adminSuspend(g.sessionToken, uid)
+    agoraModel.adminSuspend(g.identity, uid)
     return redirect(f"/admin/user/{uid}")
 
-@app.route('/admin/unsuspend/<uid>', methods=['POST'])
+@agora.route('/admin/unsuspend/<uid>', methods=['POST'])
 def admin_unsuspend(uid):
-    agoraModel.adminUnsuspend(g.sessionToken, uid)
+    agoraModel.adminUnsuspend(g.identity, uid)
     return redirect(f"/admin/user/{uid}")
 
-@app.route('/admin/deleteuser/<uid>', methods=['POST'])
+@agora.route('/admin/deleteuser/<uid>', methods=['POST'])
 def admin_deleteuser(uid):
     data = request.form
-    agoraModel.adminDelete(g.sessionToken, uid, data["password"])
+    agoraModel.adminDelete(g.identity, uid, data["password"])
     return redirect("/")
 
-@app.route('/vote/<pid>', methods=['POST'])
+@agora.route('/vote/<pid>', methods=['POST'])
 def vote(pid):
     data = request.form
     if 'vote' in data:
         match data['vote']:
             case 'like': 
-                agoraModel.like(g.sessionToken, pid)
+                agoraModel.like(g.identity, pid)
             case 'dislike': 
-                agoraModel.dislike(g.sessionToken, pid) 
+                agoraModel.dislike(g.identity, pid) 
             case 'unlike': 
-                agoraModel.unlike(g.sessionToken, pid)
+                agoraModel.unlike(g.identity, pid)
             case _: 
                 print('help!')
     return redirect(f'/post/{pid}')
 
-@app.route('/upload', methods=['POST'])
+@agora.route('/upload', methods=['POST'])
 def upload_image_post():
     imgData = request.files['file']
     data = request.form
     title = data['title']
-    imgID = agoraModel.uploadImage(g.sessionToken, title, imgData)
+    imgID = agoraModel.uploadImage(g.identity, title, imgData)
     return redirect('/files')
 
-@app.route('/upload')
+@agora.route('/upload')
 def upload_image_get():
     return render_template('upload.html', data=g.data)
 
-@app.route('/files')
+@agora.route('/files')
 def files():
     if g.data['logged_in_user'] is None:
         return redirect('/login')
-    userInfo = agoraModel.getMyUser(g.sessionToken)
+    userInfo = agoraModel.getMyUser(g.identity)
     g.data.update(userInfo)
     return render_template('files.html', data=g.data)
 
-@app.route('/deleteimg', methods=['POST'])
+@agora.route('/deleteimg', methods=['POST'])
 def delete_image():
     data = request.form
     if 'delete' in data:
-        agoraModel.deleteImage(g.sessionToken, data['delete'])
+        agoraModel.deleteImage(g.identity, data['delete'])
     return redirect('/files')
 
-@app.route('/search', methods=['POST'])
+@agora.route('/search', methods=['GET', 'POST'])
 def search():
-    data = request.form
+    data = request.values
     if 'user' in data:
         get_search('user', data['user'])
     if 'post' in data:
         get_search('post', data['post'])
     return render_template('search.html', data=g.data)
 
-@app.route('/browse/users')
+@agora.route('/feed')
+def feed():
+    if g.data['logged_in_user'] is None:
+        return redirect('/login')
+    args = request.args
+    page = agoraModel.getFeed(g.identity, args.get('after'), args.get('before'), args.get('size'))
+    g.data['results'] = page['results']
+    g.data['querytype'] = 'post'
+    g.data['next_url'] = None if page['next'] is None else get_page_url('post', "", after=page['next'])
+    g.data['prev_url'] = None if page['prev'] is None else get_page_url('post', "", before=page['prev'])
+    return render_template('feed.html', data=g.data)
+
+@agora.route('/browse/users')
 def browse_users():
     get_search('user', "")
     return render_template('browse.html', data=g.data)
 
-@app.route('/browse/posts')
+@agora.route('/browse/posts')
 def browse_posts():
     get_search('post', "")
     return render_template('browse.html', data=g.data)
 
 def get_search(querytype, query):
-    results = []
+    args = request.args
     if querytype == 'user':
-        results = agoraModel.searchUsers(query)
+        page = agoraModel.searchUsers(query, args.get('after'), args.get('before'), args.get('size'))
     if querytype == 'post':
-        results = agoraModel.searchPosts(query)
-    g.data['results'] = results
+        page = agoraModel.searchPosts(query, args.get('after'), args.get('before'), args.get('size'))
+    g.data['results'] = page['results']
     g.data['querytype'] = querytype
-
-@app.route('/friend/<uid>', methods=['POST'])
+    g.data['next_url'] = None if page['next'] is None else get_page_url(querytype, query, after=page['next'])
+    g.data['prev_url'] = None if page['prev'] is None else get_page_url(querytype, query, before=page['prev'])
+
+def get_page_url(querytype, query, **cursor):
+    params = dict(cursor)
+    if request.endpoint == 'agora.search':
+        params[querytype] = query
+    if 'size' in request.args:
+        params['size'] = request.args['size']
+    return url_for(request.endpoint, **params)
+
+@agora.route('/friend/<uid>', methods=['POST'])
 def friend(uid):
-    agoraModel.friendRequest(g.sessionToken, uid)
+    agoraModel.friendRequest(g.identity, uid)
     data = request.form
     if 'redirect' in data:
         return redirect(data['redirect'])
     return redirect('/account')
 
-@app.route('/unfriend/<uid>', methods=['POST'])
+@agora.route('/unfriend/<uid>', methods=['POST'])
 def unfriend(uid):
-    agoraModel.unfriend(g.sessionToken, uid)
+    agoraModel.unfriend(g.identity, uid)
     data = request.form
     if 'redirect' in data:
         return redirect(data['redirect'])
     return redirect('/account')
 
-@app.route('/report')
+@agora.route('/report')
 def bug_report_get():
     return render_template('report.html', data=g.data, limits=INPUT_LENGTH_LIMITS)
 
-@app.route('/report', methods=['POST'])
+@agora.route('/report', methods=['POST'])
 def bug_report_post():
     data = request.form
     if "content" in data:
-        agoraModel.bugReport(g.sessionToken, data["content"])
+        agoraModel.bugReport(g.identity, data["content"])
     return render_template('info.html', data=g.data, msg='confirm-report-submitted')
 
-app.run(host = "0.0.0.0", port = PORT)
+# Development server only; production runs the factory under gunicorn (see gunicorn.conf.py)
+if __name__ == '__main__':
+    app = create_app(config_from_argv(sys.argv))
+    app.run(host = "0.0.0.0", port = app.config['PORT'], debug = os.environ.get('AGORA_DEBUG') == '1', use_reloader = False)
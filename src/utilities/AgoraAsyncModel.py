@@ -0,0 +1,49 @@
+import asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
+from limits import *
+
+## The model's interface as coroutines. Every call runs the synchronous filter chain on a small, bounded pool
+## of threads, so however many callers are waiting, only that many of them hold a thread and a database
+## connection. Captchas are checked on the event loop first, since that wait is on Google and not on us.
+
+class AgoraAsyncModel:
+    def __init__(self, model, threads=ASGI_MODEL_THREADS):
+        self.model = model
+        self.semantics = None
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="AgoraAsyncModel")
+
+    def setSemanticFilter(self, semantics):
+        self.semantics = semantics
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.model, name)
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    async def verifyCaptcha(self, captcha, sessionToken=None):
+        return await self.semantics.verifyCaptchaAsync(captcha, sessionToken)
+
+    async def createAccount(self, emailAddress, username, password, captcha):
+        captcha = await self.verifyCaptcha(captcha)
+        return await self.run(self.model.createAccount, emailAddress, username, password, captcha)
+
+    async def login(self, username, password, captcha):
+        captcha = await self.verifyCaptcha(captcha)
+        return await self.run(self.model.login, username, password, captcha)
+
+    async def writePost(self, identity, title, content, captcha):
+        captcha = await self.verifyCaptcha(captcha, identity.token)
+        return await self.run(self.model.writePost, identity, title, content, captcha)
+
+    async def comment(self, identity, pid, content, captcha):
+        captcha = await self.verifyCaptcha(captcha, identity.token)
+        return await self.run(self.model.comment, identity, pid, content, captcha)
+
+    async def close(self):
+        await self.semantics.captcha.closeAsync()
+        self.executor.shutdown(wait=True)
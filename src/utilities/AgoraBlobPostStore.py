@@ -0,0 +1,55 @@
+import queue, sqlite3
+from agora_errors import *
+from limits import *
+
+class AgoraBlobPostStore:
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.conns = queue.LifoQueue()
+        conn = self.checkout()
+        conn.execute("CREATE TABLE IF NOT EXISTS bodies (name TEXT PRIMARY KEY, content BLOB NOT NULL) WITHOUT ROWID")
+        self.checkin(conn)
+
+    def checkout(self):
+        try:
+            return self.conns.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.dbname, timeout=DB_BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
+
+    def checkin(self, conn):
+        if self.conns.qsize() < POST_STORE_POOL_SIZE:
+            self.conns.put(conn)
+        else:
+            conn.close()
+
+    def run(self, query, args):
+        conn = self.checkout()
+        try:
+            cur = conn.execute(query, args)
+            return cur.fetchall(), cur.rowcount
+        finally:
+            self.checkin(conn)
+
+    def get(self, name):
+        rows, count = self.run("SELECT content FROM bodies WHERE name = ?", (name,))
+        if len(rows) == 0:
+            raise AgoraENoSuchPost
+        return rows[0][0].decode()
+
+    def put(self, name, content):
+        self.run("INSERT INTO bodies (name, content) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET content = excluded.content", (name, content.encode(),))
+
+    def putIfAbsent(self, name, content):
+        rows, count = self.run("INSERT OR IGNORE INTO bodies (name, content) VALUES (?, ?)", (name, content.encode(),))
+        return count > 0
+
+    def delete(self, name):
+        self.run("DELETE FROM bodies WHERE name = ?", (name,))
+
+    def list(self):
+        rows, count = self.run("SELECT name FROM bodies ORDER BY name", ())
+        for row in rows:
+            yield row[0]
@@ -0,0 +1,123 @@
+import threading, time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from agora_errors import *
+from limits import *
+
+class AgoraCaptchaVerifier:
+    def __init__(self, serverKey, failOpen=RECAPTCHA_FAIL_OPEN, url="https://www.google.com/recaptcha/api/siteverify"):
+        self.serverKey = serverKey
+        self.failOpen = failOpen
+        self.url = url
+        self.session = requests.Session()
+        self.session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=RECAPTCHA_HTTP_POOL_SIZE))
+        self.client = None      # For verifyAsync, made on first use inside the event loop
+        self.lock = threading.Lock()
+        self.consecutiveFailures = 0
+        self.openUntil = 0.0
+        self.numCalls = 0
+        self.numFailures = 0
+        self.numRejected = 0
+        self.numShortCircuited = 0
+        self.numFailedOpen = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+        self.latencyLast = 0.0
+
+    def verify(self, userresp):
+        if not self.allowRequest():
+            with self.lock:
+                self.numShortCircuited += 1
+            return self.unavailable()
+        start = time.monotonic()
+        try:
+            res = self.session.post(self.url, data={"secret": self.serverKey, "response": userresp},
+                    timeout=(RECAPTCHA_CONNECT_TIMEOUT_SECONDS, RECAPTCHA_READ_TIMEOUT_SECONDS))
+            res.raise_for_status()
+            body = res.json()
+        except (requests.RequestException, ValueError):
+            self.record(time.monotonic() - start, False)
+            return self.unavailable()
+        self.record(time.monotonic() - start, True)
+        # Google leaves out the score altogether when the token itself is bad
+        if not body.get("success", False) or body.get("score", 0.0) < RECAPTCHA_THRESHHOLD:
+            with self.lock:
+                self.numRejected += 1
+            raise AgoraEAreYouHuman
+        return True
+
+    # The same check without holding a thread while Google answers
+    async def verifyAsync(self, userresp):
+        if not self.allowRequest():
+            with self.lock:
+                self.numShortCircuited += 1
+            return self.unavailable()
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=RECAPTCHA_HTTP_POOL_SIZE),
+                    timeout=httpx.Timeout(RECAPTCHA_READ_TIMEOUT_SECONDS, connect=RECAPTCHA_CONNECT_TIMEOUT_SECONDS))
+        start = time.monotonic()
+        try:
+            res = await self.client.post(self.url, data={"secret": self.serverKey, "response": userresp})
+            res.raise_for_status()
+            body = res.json()
+        except (httpx.HTTPError, ValueError):
+            self.record(time.monotonic() - start, False)
+            return self.unavailable()
+        self.record(time.monotonic() - start, True)
+        if not body.get("success", False) or body.get("score", 0.0) < RECAPTCHA_THRESHHOLD:
+            with self.lock:
+                self.numRejected += 1
+            raise AgoraEAreYouHuman
+        return True
+
+    async def closeAsync(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def allowRequest(self):
+        with self.lock:
+            if self.consecutiveFailures < RECAPTCHA_BREAKER_THRESHOLD:
+                return True
+            now = time.monotonic()
+            if now < self.openUntil:
+                return False
+            self.openUntil = now + RECAPTCHA_BREAKER_COOLDOWN_SECONDS   # Let this one request through as a probe
+            return True
+
+    def record(self, latency, ok):
+        with self.lock:
+            self.numCalls += 1
+            self.latencyTotal += latency
+            self.latencyMax = max(self.latencyMax, latency)
+            self.latencyLast = latency
+            if ok:
+                self.consecutiveFailures = 0
+                return
+            self.numFailures += 1
+            self.consecutiveFailures += 1
+            if self.consecutiveFailures == RECAPTCHA_BREAKER_THRESHOLD:
+                self.openUntil = time.monotonic() + RECAPTCHA_BREAKER_COOLDOWN_SECONDS
+
+    # Letting someone through without an answer from Google doesn't count as a pass
+    def unavailable(self):
+        if not self.failOpen:
+            raise AgoraECaptchaUnavailable
+        with self.lock:
+            self.numFailedOpen += 1
+        return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.numCalls,
+                "failures": self.numFailures,
+                "rejected": self.numRejected,
+                "short_circuited": self.numShortCircuited,
+                "failed_open": self.numFailedOpen,
+                "breaker_open": self.consecutiveFailures >= RECAPTCHA_BREAKER_THRESHOLD and time.monotonic() < self.openUntil,
+                "latency_seconds_avg": self.latencyTotal / self.numCalls if self.numCalls else 0.0,
+                "latency_seconds_max": self.latencyMax,
+                "latency_seconds_last": self.latencyLast
+            }
@@ -1,5 +1,8 @@
-import os, sqlite3
-from multiprocessing.pool import ThreadPool
+import contextlib, os, queue, re, sqlite3, threading, time
+from limits import *
+from agora_errors import *
+from AgoraDatabaseWriter import *
+from AgoraTransaction import *
 
 def dict_factory(cursor, row):
     d = {}
@@ -10,38 +13,95 @@ def dict_factory(cursor, row):
 class AgoraDatabaseManager:
     def __init__(self, dbname):
         self.dbname = dbname
-        self.readPool = ThreadPool(processes=10)
-        self.writePool = ThreadPool(processes=1)
+        self.connLock = threading.Lock()
+        self.local = threading.local()
+        self.queryStats = None
         self.connect()
 
-    def connect(self):
-        self.conn = sqlite3.connect(self.dbname, check_same_thread=False)
-        self.conn.row_factory = dict_factory
-
-    def commit(self):
-        self.conn.commit()
+    def setQueryStats(self, queryStats):
+        self.queryStats = queryStats
+        self.writer.queryStats = queryStats
 
-    def cur(self):
-        cur = self.conn.cursor()
-        cur.row_factory = dict_factory
-        return cur
-
-    def pool_query(self, query, args=()):
-        cur = self.cur().execute(query, args)
-        res = [x for x in cur.fetchall()]
-        cur.close()
-        return (res if len(res) > 0 else None)
+    def openConnection(self):
+        conn = sqlite3.connect(self.dbname, timeout=DB_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = dict_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
 
-    def pool_execute(self, query, args=()):
-        cur = self.cur().execute(query, args)
-        cur.close()
-        self.commit()
+    def connect(self):
+        self.readConns = queue.LifoQueue()
+        self.numReadConns = 0
+        self.writer = AgoraDatabaseWriter(self.openConnection())
+
+    def close(self):
+        with self.connLock:
+            while not self.readConns.empty():
+                self.readConns.get_nowait().close()
+            self.numReadConns = 0
+        self.writer.close()
+
+    def checkout(self):
+        try:
+            return self.readConns.get_nowait()
+        except queue.Empty:
+            pass
+        with self.connLock:
+            if self.numReadConns < DB_READ_POOL_SIZE:
+                self.numReadConns += 1
+                try:
+                    return self.openConnection()
+                except sqlite3.Error:
+                    self.numReadConns -= 1
+                    raise
+        return self.readConns.get()     # Pool is at capacity, so wait for another reader to finish
+
+    def checkin(self, conn):
+        self.readConns.put(conn)
 
     def query(self, query, args=()):
-        return self.readPool.apply(self.pool_query, (query, args,))
+        conn = self.checkout()
+        start = time.perf_counter()
+        try:
+            res = conn.execute(query, args).fetchall()
+        finally:
+            self.checkin(conn)
+        if self.queryStats is not None:
+            self.queryStats.record(query, time.perf_counter() - start)
+            self.queryStats.count(query)
+        return (res if len(res) > 0 else None)
 
     def execute(self, query, args=()):
-        return self.writePool.apply(self.pool_execute, (query, args,))
+        return self.executeBatch([(query, args)])
+
+    def executeBatch(self, statements):
+        statements = list(statements)
+        if self.queryStats is not None:
+            for query, args in statements:
+                self.queryStats.count(query)
+        tx = getattr(self.local, "tx", None)
+        if tx is not None:
+            return tx.add(statements)
+        rowids = self.writer.submit(statements).result()
+        return rowids[-1] if len(rowids) > 0 else None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Writes made on this thread inside the block are held back and committed together when it exits.
+        # Reads still see the database as it was before the block, and rowids come back as AgoraRowRefs.
+        tx = getattr(self.local, "tx", None)
+        if tx is not None:
+            yield tx    # Nested blocks join the outer transaction
+            return
+        tx = AgoraTransaction(self.writer)
+        self.local.tx = tx
+        try:
+            yield tx
+        finally:
+            self.local.tx = None
+        tx.commit()
+
+    def writerStats(self):
+        return self.writer.stats()
 
 
     def usernameExists(self, username):
@@ -110,16 +170,24 @@ class AgoraDatabaseManager:
         res = self.query("SELECT user1, user2 FROM friendships WHERE user2 = ? AND accepted = 0", (uid,)) 
         return [] if res is None else [tup['user1'] for tup in res] 
 
-    def getPublicUserThumbnail(self, uid):
-        res = self.query("SELECT uid, username, status, pfp FROM users WHERE uid = ?", (uid,))
-        return None if res is None else res[0]
+    def getFriendships(self, uid):
+        res = self.query("SELECT U.uid, U.username, U.status, U.pfp, F.user1, F.accepted FROM friendships F JOIN users U ON U.uid = (CASE WHEN F.user1 = ? THEN F.user2 ELSE F.user1 END) WHERE F.user1 = ? OR F.user2 = ?", (uid, uid, uid,))
+        friends, fromMe, forMe = {}, {}, {}
+        for row in ([] if res is None else res):
+            if row.pop("accepted") == 1:
+                bucket = friends
+            else:
+                bucket = fromMe if row["user1"] == uid else forMe
+            del row["user1"]
+            bucket[row["uid"]] = row
+        return friends, fromMe, forMe
 
     def getPublicUser(self, uid):
         res = self.query("SELECT uid, username, status, suspended, pfp FROM users WHERE uid = ?", (uid,))
         info = res[0]
         res = self.query("SELECT pid, title FROM posts WHERE owner = ?", (uid,))
         info["posts"] = [] if res is None else [post for post in res]
-        info["friends"] = {uid : info for uid, info in zip(self.getFriends(uid), map(self.getPublicUserThumbnail, self.getFriends(uid))) if uid is not None}
+        info["friends"] = self.getFriendships(uid)[0]
         return info
 
     def getUserLastAction(self, uid):        
@@ -129,8 +197,18 @@ class AgoraDatabaseManager:
         else:
             return 24*3600*res[0]['delta']
 
-    def setUserLastAction(self, uid):
-        self.execute("UPDATE users SET lastaction=CURRENT_TIMESTAMP WHERE uid=?", (uid,))
+    def setUserLastActions(self, lastactions):
+        self.executeBatch(("UPDATE users SET lastaction = datetime(?, 'unixepoch') WHERE uid = ?", (when, uid,)) for uid, when in lastactions)
+
+    def getRecentActionTimes(self, uid, action, since):
+        # Unix times of the user's posts, comments or friend requests still on record that were made after since
+        query = {
+            "post": "SELECT (JULIANDAY(timestamp) - 2440587.5) * 86400 as t FROM posts WHERE owner = ? AND timestamp > datetime(?, 'unixepoch')",
+            "comment": "SELECT (JULIANDAY(timestamp) - 2440587.5) * 86400 as t FROM comments WHERE owner = ? AND timestamp > datetime(?, 'unixepoch')",
+            "friend": "SELECT (JULIANDAY(timestamp) - 2440587.5) * 86400 as t FROM friendships WHERE user1 = ? AND timestamp > datetime(?, 'unixepoch')"
+        }[action]
+        res = self.query(query, (uid, since,))
+        return [] if res is None else [row['t'] for row in res]
 
     def isUserSuspended(self, uid):
         res = self.query("SELECT suspended FROM users WHERE uid = ?", (uid,))
@@ -152,19 +230,15 @@ class AgoraDatabaseManager:
         res = self.query("SELECT pid, title FROM posts WHERE owner = ?", (uid,))
         info["posts"] = [] if res is None else [post for post in res]
         
-        info["friends"] = {uid : info for uid, info in zip(self.getFriends(uid), map(self.getPublicUserThumbnail, self.getFriends(uid))) if uid is not None}
-        info["fromyou"] = {uid : info for uid, info in zip(self.getFriendReqsFromMe(uid), map(self.getPublicUserThumbnail, self.getFriendReqsFromMe(uid))) if uid is not None}
-        info["foryou"] = {uid : info for uid, info in zip(self.getFriendReqsForMe(uid), map(self.getPublicUserThumbnail, self.getFriendReqsForMe(uid))) if uid is not None}
+        info["friends"], info["fromyou"], info["foryou"] = self.getFriendships(uid)
 
         res = self.query("SELECT accessid, title FROM images WHERE owner = ?", (uid,))
         info["images"] = [] if res is None else [img for img in res]
         return info
 
     def getPostInfo(self, pid):
-        res = self.query("SELECT P.pid, P.title, P.timestamp, P.owner, P.filename, U.username FROM posts P JOIN users U ON P.owner = U.uid WHERE P.pid = ?", (pid,))
+        res = self.query("SELECT P.pid, P.title, P.timestamp, P.owner, P.filename, P.revision, P.score as votes, U.username FROM posts P JOIN users U ON P.owner = U.uid WHERE P.pid = ?", (pid,))
         info = res[0]
-        res = self.query("SELECT SUM(likes) as votes FROM votes WHERE postid = ?", (pid,))
-        info["votes"] = 0 if res[0]['votes'] is None else res[0]['votes']
         res = self.query("SELECT U.uid, C.cid, C.content, C.timestamp, U.username FROM comments C JOIN users U on C.owner = U.uid WHERE post = ?", (pid,))
         info["comments"] = [] if res is None else [c for c in res]
         return info
@@ -177,41 +251,122 @@ class AgoraDatabaseManager:
         res = self.query("SELECT owner FROM images WHERE accessid = ?", (accessid,))
         return res[0]["owner"]
 
-    def searchUser(self, substr):
-        res = self.query("SELECT uid, username, pfp FROM users WHERE username LIKE '%' || ? || '%'", (substr,))
-        return (None if res is None else [r for r in res])
-
-    def searchPost(self, substr):
-        res = self.query("SELECT P.pid, P.title, P.owner, U.username FROM posts P JOIN users U ON P.owner = U.uid WHERE P.title LIKE '%' || ? || '%' ORDER BY timestamp DESC", (substr,))
-        return (None if res is None else [r for r in res])
-
-
+    def keysetPage(self, forward, backward, args, after, before, start, limit, key):
+        # A cursor from another kind of page, or one made up, won't have the right number of key columns
+        if any(cursor is not None and len(cursor) != len(start) for cursor in (after, before)):
+            raise AgoraEInvalidQuery
+        # Fetch one extra row to find out whether there is another page past this one
+        if before is None:
+            res = self.query(forward, (*args, *(start if after is None else after), limit + 1,)) or []
+            rows = res[:limit]
+            hasNext, hasPrev = len(res) > limit, after is not None
+        else:
+            res = self.query(backward, (*args, *before, limit + 1,)) or []
+            rows = res[:limit][::-1]
+            hasNext, hasPrev = True, len(res) > limit
+        return {
+            "results": rows if len(rows) > 0 else None,
+            "next": key(rows[-1]) if hasNext and len(rows) > 0 else None,
+            "prev": key(rows[0]) if hasPrev and len(rows) > 0 else None
+        }
+
+    def searchUser(self, substr, after=None, before=None, limit=BROWSE_PAGE_SIZE):
+        if substr == "":
+            return self.keysetPage(
+                "SELECT uid, username, pfp FROM users WHERE uid > ? ORDER BY uid LIMIT ?",
+                "SELECT uid, username, pfp FROM users WHERE uid < ? ORDER BY uid DESC LIMIT ?",
+                (), after, before, (0,), limit, lambda r: (r["uid"],))
+        if len(substr) < 3:
+            # The trigram index can't match fewer than three characters, so these go through the username index with LIKE
+            pattern = substr.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return self.keysetPage(
+                "SELECT uid, username, pfp FROM users WHERE username LIKE '%' || ? || '%' ESCAPE '\\' AND (username, uid) > (?, ?) ORDER BY username, uid LIMIT ?",
+                "SELECT uid, username, pfp FROM users WHERE username LIKE '%' || ? || '%' ESCAPE '\\' AND (username, uid) < (?, ?) ORDER BY username DESC, uid DESC LIMIT ?",
+                (pattern,), after, before, ("", 0,), limit, lambda r: (r["username"], r["uid"],))
+        phrase = '"' + substr.replace('"', '""') + '"'
+        return self.keysetPage(
+            "SELECT U.uid, U.username, U.pfp, S.score FROM (SELECT rowid AS uid, rank AS score FROM usersearch WHERE usersearch MATCH ?) S JOIN users U ON U.uid = S.uid WHERE (S.score, S.uid) > (?, ?) ORDER BY S.score, S.uid LIMIT ?",
+            "SELECT U.uid, U.username, U.pfp, S.score FROM (SELECT rowid AS uid, rank AS score FROM usersearch WHERE usersearch MATCH ?) S JOIN users U ON U.uid = S.uid WHERE (S.score, S.uid) < (?, ?) ORDER BY S.score DESC, S.uid DESC LIMIT ?",
+            (phrase,), after, before, (float("-inf"), 0,), limit, lambda r: (r["score"], r["uid"],))
+
+    def searchPost(self, substr, after=None, before=None, limit=BROWSE_PAGE_SIZE):
+        if substr == "":
+            return self.keysetPage(
+                "SELECT P.pid, P.title, P.owner, P.timestamp, U.username FROM posts P JOIN users U ON P.owner = U.uid WHERE (P.timestamp, P.pid) < (?, ?) ORDER BY P.timestamp DESC, P.pid DESC LIMIT ?",
+                "SELECT P.pid, P.title, P.owner, P.timestamp, U.username FROM posts P JOIN users U ON P.owner = U.uid WHERE (P.timestamp, P.pid) > (?, ?) ORDER BY P.timestamp, P.pid LIMIT ?",
+                (), after, before, ("9999-12-31 23:59:59", 2**63 - 1,), limit, lambda r: (r["timestamp"], r["pid"],))
+        terms = re.findall(r"\w+", substr)
+        if len(terms) == 0:
+            return {"results": None, "next": None, "prev": None}
+        match = " ".join(f'"{term}"*' for term in terms)
+        return self.keysetPage(
+            "SELECT P.pid, P.title, P.owner, U.username, S.score FROM (SELECT rowid AS pid, bm25(postsearch, ?, 1.0) AS score FROM postsearch WHERE postsearch MATCH ?) S JOIN posts P ON P.pid = S.pid JOIN users U ON P.owner = U.uid WHERE (S.score, S.pid) > (?, ?) ORDER BY S.score, S.pid LIMIT ?",
+            "SELECT P.pid, P.title, P.owner, U.username, S.score FROM (SELECT rowid AS pid, bm25(postsearch, ?, 1.0) AS score FROM postsearch WHERE postsearch MATCH ?) S JOIN posts P ON P.pid = S.pid JOIN users U ON P.owner = U.uid WHERE (S.score, S.pid) < (?, ?) ORDER BY S.score DESC, S.pid DESC LIMIT ?",
+            (SEARCH_TITLE_WEIGHT, match,), after, before, (float("-inf"), 0,), limit, lambda r: (r["score"], r["pid"],))
+
+    def getFeed(self, uid, after=None, before=None, limit=BROWSE_PAGE_SIZE):
+        # Each friend gives at most a page of their own posts, straight off posts_owner_timestamp, and only those get merged and sorted
+        return self.keysetPage(
+            "SELECT P.pid, P.title, P.owner, P.timestamp, U.username FROM (SELECT user2 AS friend FROM friendships WHERE user1 = ?1 AND accepted = 1 UNION ALL SELECT user1 FROM friendships WHERE user2 = ?1 AND accepted = 1) F JOIN posts P ON P.pid IN (SELECT pid FROM posts WHERE owner = F.friend AND (timestamp, pid) < (?2, ?3) ORDER BY timestamp DESC, pid DESC LIMIT ?4) JOIN users U ON P.owner = U.uid ORDER BY P.timestamp DESC, P.pid DESC LIMIT ?4",
+            "SELECT P.pid, P.title, P.owner, P.timestamp, U.username FROM (SELECT user2 AS friend FROM friendships WHERE user1 = ?1 AND accepted = 1 UNION ALL SELECT user1 FROM friendships WHERE user2 = ?1 AND accepted = 1) F JOIN posts P ON P.pid IN (SELECT pid FROM posts WHERE owner = F.friend AND (timestamp, pid) > (?2, ?3) ORDER BY timestamp, pid LIMIT ?4) JOIN users U ON P.owner = U.uid ORDER BY P.timestamp, P.pid LIMIT ?4",
+            (uid,), after, before, ("9999-12-31 23:59:59", 2**63 - 1,), limit, lambda r: (r["timestamp"], r["pid"],))
+
+    def indexPosts(self, posts):
+        statements = []
+        for pid, title, content in posts:
+            statements.append(("DELETE FROM postsearch WHERE rowid = ?", (pid,)))
+            statements.append(("INSERT INTO postsearch (rowid, title, body) VALUES (?, ?, ?)", (pid, title, content,)))
+        self.executeBatch(statements)
+
+    def indexPost(self, pid, title, content):
+        self.indexPosts([(pid, title, content)])
+
+    def optimizePostIndex(self):
+        self.execute("INSERT INTO postsearch (postsearch) VALUES ('optimize')")
+
+    def getPostsAfter(self, pid, limit):
+        res = self.query("SELECT pid, title, filename FROM posts WHERE pid > ? ORDER BY pid LIMIT ?", (pid, limit,))
+        return [] if res is None else res
 
     def createUser(self, email, username, hpassword, hrecovery, pfp):
-        self.execute("INSERT INTO users (email, username, hpassword, hrecovery, pfp) VALUES (?, ?, ?, ?, ?)", (email, username, hpassword, hrecovery, pfp,))
-        res = self.query("SELECT uid FROM users WHERE email = ?", (email,))
-        return res[0]['uid']
+        return self.execute("INSERT INTO users (email, username, hpassword, hrecovery, pfp) VALUES (?, ?, ?, ?, ?)", (email, username, hpassword, hrecovery, pfp,))
 
     def verifyUser(self, uid):
         self.execute("UPDATE users SET confirmed = 1 WHERE uid = ?", (uid,))
 
 
 
-    def createToken(self, uid, token, ttype, data=None):
+    def createToken(self, uid, token, ttype, data=None, email=None):
         if data is None:
-            self.execute("INSERT INTO tokens (owner, value, type) VALUES (?, ?, ?)", (uid, token, ttype,))
+            statements = [("INSERT INTO tokens (owner, value, type) VALUES (?, ?, ?)", (uid, token, ttype,))]
         else:
-            self.execute("INSERT INTO tokens (owner, value, type, data) VALUES (?, ?, ?, ?)", (uid, token, ttype, data,))
+            statements = [("INSERT INTO tokens (owner, value, type, data) VALUES (?, ?, ?, ?)", (uid, token, ttype, data,))]
+        if email is not None:
+            statements.append(self.outboxInsert(email))     # The token is only ever issued together with the email that carries it
+        self.executeBatch(statements)
+
+    def sweepTokens(self, ttype, ttl, limit):
+        res = self.query("SELECT rowid FROM tokens WHERE type = ? AND issued < datetime('now', ?) LIMIT ?", (ttype, f"-{ttl} seconds", limit,))
+        if res is None:
+            return 0
+        self.executeBatch([("DELETE FROM tokens WHERE rowid = ?", (r["rowid"],)) for r in res])
+        return len(res)
 
     def expireToken(self, token):
         self.execute("DELETE FROM tokens WHERE value = ?", (token,))
 
-    def getTokenAgeSeconds(self, token):
-        res = self.query("SELECT JULIANDAY('now')-JULIANDAY(issued) as delta FROM tokens WHERE value=?", (token,))
+    def getSession(self, token):
+        res = self.query("SELECT T.owner, U.suspended, JULIANDAY('now')-JULIANDAY(T.issued) as delta FROM tokens T JOIN users U ON T.owner = U.uid WHERE T.value = ? AND T.type = 'session'", (token,))
         if res is None:
             return None
-        else:
-            return 24*3600*res[0]["delta"]
+        return {
+            "uid": res[0]["owner"],
+            "suspended": res[0]["suspended"] == 1,
+            "issued": time.time() - 24*3600*res[0]["delta"]
+        }
+
+    def expireUserTokens(self, uid, ttype):
+        self.execute("DELETE FROM tokens WHERE owner = ? AND type = ?", (uid, ttype,))
 
 
 
@@ -230,31 +385,45 @@ class AgoraDatabaseManager:
     def setPassword(self, uid, hpassword):
         self.execute("UPDATE users SET hpassword = ? WHERE uid = ?", (hpassword, uid,))
 
-    def setBackup(self, uid, hbackup):
-        self.execute("UPDATE users SET hrecovery = ? where uid = ?", (hbackup, uid,))
+    def setBackup(self, uid, hbackup, email=None):
+        statements = [("UPDATE users SET hrecovery = ? where uid = ?", (hbackup, uid,))]
+        if email is not None:
+            statements.append(self.outboxInsert(email))
+        self.executeBatch(statements)
 
 
     def insertPost(self, uid, title, location):
-        self.execute("INSERT INTO posts (owner, title, filename) VALUES (?, ?, ?)", (uid, title, location,))
-        return self.query("SELECT pid FROM posts WHERE filename=?", (location,))[0]["pid"]
+        return self.execute("INSERT INTO posts (owner, title, filename) VALUES (?, ?, ?)", (uid, title, location,))
+
+    def getPostFilenames(self):
+        res = self.query("SELECT filename FROM posts")
+        return [] if res is None else [r["filename"] for r in res]
 
     def updatePost(self, pid, title):
-        self.execute("UPDATE posts SET title=? WHERE pid=?", (title, pid,))
+        self.execute("UPDATE posts SET title=?, revision=revision+1 WHERE pid=?", (title, pid,))
 
     def unlikePost(self, uid, pid):
         self.execute("DELETE FROM votes WHERE postid=? AND owner=?", (pid, uid,))
 
+    def votePost(self, uid, pid, likes):
+        self.execute("INSERT INTO votes (owner, postid, likes) VALUES (?, ?, ?) ON CONFLICT (postid, owner) DO UPDATE SET likes = excluded.likes", (uid, pid, likes,))
+
     def likePost(self, uid, pid):
-        self.unlikePost(uid, pid)
-        self.execute("INSERT INTO votes (owner, postid, likes) VALUES (?, ?, ?)", (uid, pid, 1))
+        self.votePost(uid, pid, 1)
 
     def dislikePost(self, uid, pid):
-        self.unlikePost(uid, pid)
-        self.execute("INSERT INTO votes (owner, postid, likes) VALUES (?, ?, ?)", (uid, pid, -1))
+        self.votePost(uid, pid, -1)
+
+    def rebuildPostScores(self):
+        self.execute("UPDATE posts SET score = COALESCE((SELECT SUM(likes) FROM votes WHERE postid = posts.pid), 0)")
 
     def insertImage(self, uid, title, location, accessid):
         self.execute("INSERT INTO images (owner, title, filename, accessid) VALUES (?, ?, ?, ?)", (uid, title, location, accessid,))
 
+    def getImageFilenames(self):
+        res = self.query("SELECT filename FROM images")
+        return [] if res is None else [r["filename"] for r in res]
+
     def insertComment(self, uid, pid, comment):
         self.execute("INSERT INTO comments (owner, post, content) VALUES (?, ?, ?)", (uid, pid, comment,))
 
@@ -266,10 +435,11 @@ class AgoraDatabaseManager:
 
 
     def insertFriendReq(self, uid1, uid2):
-        self.execute("UPDATE friendships SET accepted = 1 WHERE user1 = ? AND user2 = ?", (uid2, uid1,))
-        res = self.query("SELECT accepted FROM friendships WHERE user1 = ? AND user2 = ?", (uid2, uid1,))
-        if res is None:
-            self.execute("INSERT INTO friendships (user1, user2) VALUES (?, ?)", (uid1, uid2,))
+        # Accepts the other user's request if there is one, and otherwise files a new one unless it already exists
+        self.executeBatch([
+            ("UPDATE friendships SET accepted = 1 WHERE user1 = ? AND user2 = ?", (uid2, uid1,)),
+            ("INSERT INTO friendships (user1, user2) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM friendships WHERE (user1 = ? AND user2 = ?) OR (user1 = ? AND user2 = ?))", (uid1, uid2, uid1, uid2, uid2, uid1,))
+        ])
 
     def confirmFriendReq(self, uid1, uid2):
         self.insertFriendReq(uid1, uid2)
@@ -280,28 +450,63 @@ class AgoraDatabaseManager:
 
 
     def deletePost(self, pid):
-        self.execute("DELETE FROM posts WHERE pid = ?", (pid,))
-        self.execute("DELETE FROM comments WHERE post = ?", (pid,))
-        self.execute("DELETE FROM votes WHERE postid = ?", (pid,))
+        self.executeBatch([
+            ("DELETE FROM posts WHERE pid = ?", (pid,)),
+            ("DELETE FROM comments WHERE post = ?", (pid,)),
+            ("DELETE FROM votes WHERE postid = ?", (pid,))
+        ])
 
     def deleteImage(self, accessid):
         self.execute("DELETE FROM images WHERE accessid = ?", (accessid,))
 
+    def getUserFiles(self, uid):
+        posts = self.query("SELECT filename FROM posts WHERE owner = ?", (uid,)) or []
+        images = self.query("SELECT filename FROM images WHERE owner = ?", (uid,)) or []
+        return [r["filename"] for r in posts], [r["filename"] for r in images]
+
     def deleteUser(self, uid):
-        self.execute("DELETE FROM users WHERE uid = ?", (uid,))
-        self.execute("DELETE FROM tokens WHERE owner = ?", (uid,))
-        self.execute("DELETE FROM posts WHERE owner = ?", (uid,))
-        self.execute("DELETE FROM comments WHERE owner = ?", (uid,))
-        self.execute("DELETE FROM images WHERE owner = ?", (uid,))
-        self.execute("DELETE FROM reports WHERE owner = ?", (uid,))
-        self.execute("DELETE FROM friendships WHERE user1 = ? OR user2 = ?", (uid, uid,))
-        self.execute("DELETE FROM votes WHERE owner = ?", (uid,))
+        self.executeBatch([
+            ("DELETE FROM comments WHERE post IN (SELECT pid FROM posts WHERE owner = ?)", (uid,)),
+            ("DELETE FROM votes WHERE postid IN (SELECT pid FROM posts WHERE owner = ?)", (uid,)),
+            ("DELETE FROM users WHERE uid = ?", (uid,)),
+            ("DELETE FROM tokens WHERE owner = ?", (uid,)),
+            ("DELETE FROM posts WHERE owner = ?", (uid,)),
+            ("DELETE FROM comments WHERE owner = ?", (uid,)),
+            ("DELETE FROM images WHERE owner = ?", (uid,)),
+            ("DELETE FROM reports WHERE owner = ?", (uid,)),
+            ("DELETE FROM friendships WHERE user1 = ? OR user2 = ?", (uid, uid,)),
+            ("DELETE FROM votes WHERE owner = ?", (uid,))
+        ])
 
 
 
     def createBugReport(self, uid):
-        self.execute("INSERT INTO reports (owner) VALUES (?)", (uid,))
-        return self.query("SELECT rid FROM reports WHERE owner=? ORDER BY timestamp DESC", (uid,))[0]["rid"]
+        return self.execute("INSERT INTO reports (owner) VALUES (?)", (uid,))
+
+
+
+    def outboxInsert(self, email):
+        recipient, subject, body = email
+        return ("INSERT INTO outbox (recipient, subject, body) VALUES (?, ?, ?)", (recipient, subject, body,))
+
+    def queueEmails(self, emails):
+        if len(emails) > 0:
+            self.executeBatch([self.outboxInsert(email) for email in emails])
+
+    def claimEmails(self, claim, now, lease, limit):
+        # Leasing the rows first means two workers never send the same email, and a worker that dies mid-send only delays it
+        self.execute("UPDATE outbox SET claim = ?, nextattempt = ? WHERE mid IN (SELECT mid FROM outbox WHERE nextattempt <= ? ORDER BY nextattempt LIMIT ?)", (claim, now + lease, now, limit,))
+        return self.query("SELECT mid, recipient, subject, body, attempts FROM outbox WHERE claim = ?", (claim,))
+
+    def completeEmails(self, mids):
+        self.executeBatch([("DELETE FROM outbox WHERE mid = ?", (mid,)) for mid in mids])
+
+    def retryEmails(self, mids, nextattempt, error):
+        self.executeBatch([("UPDATE outbox SET attempts = attempts + 1, nextattempt = ?, lasterror = ? WHERE mid = ?", (nextattempt, error, mid,)) for mid in mids])
+
+    def abandonEmails(self, mids, error):
+        # Undeliverable mail stays in the table for inspection, it just never comes due again
+        self.executeBatch([("UPDATE outbox SET attempts = attempts + 1, nextattempt = NULL, lasterror = ? WHERE mid = ?", (error, mid,)) for mid in mids])
 
 
 
@@ -0,0 +1,116 @@
+import queue, threading, time
+from concurrent.futures import Future
+from limits import *
+from AgoraRowRef import *
+
+class AgoraDatabaseWriter:
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.isolation_level = None    # Transactions are managed explicitly, one per flush
+        self.queue = queue.Queue()
+        self.queryStats = None
+        self.statsLock = threading.Lock()
+        self.numCommits = 0
+        self.numUnits = 0
+        self.numStatements = 0
+        self.commitSecondsTotal = 0.0
+        self.commitSecondsMax = 0.0
+        self.commitSecondsLast = 0.0
+        self.thread = threading.Thread(target=self.run, name="AgoraDatabaseWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, statements):
+        fut = Future()
+        self.queue.put((list(statements), fut))
+        return fut
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.conn.close()
+
+    def collect(self):
+        unit = self.queue.get()
+        if unit is None:
+            return None
+        batch = [unit]
+        deadline = time.monotonic() + DB_WRITE_FLUSH_WINDOW_SECONDS
+        while len(batch) < DB_WRITE_BATCH_MAX_UNITS:
+            timeout = deadline - time.monotonic()
+            try:
+                unit = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if unit is None:
+                self.queue.put(None)    # Flush what we have, then stop on the next collect()
+                break
+            batch.append(unit)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            if batch is None:
+                return
+            self.flush(batch)
+
+    def flush(self, batch):
+        flushStart = time.monotonic()
+        results = []
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for statements, fut in batch:
+                # Each unit gets its own savepoint, so one bad unit doesn't sink the rest of the batch
+                cur.execute("SAVEPOINT unit")
+                try:
+                    rowids = []
+                    for query, args in statements:
+                        args = tuple(rowids[arg.index] if isinstance(arg, AgoraRowRef) else arg for arg in args)
+                        start = time.perf_counter()
+                        rowids.append(cur.execute(query, args).lastrowid)
+                        if self.queryStats is not None:
+                            self.queryStats.record(query, time.perf_counter() - start)
+                except Exception as err:
+                    cur.execute("ROLLBACK TO unit")
+                    cur.execute("RELEASE unit")
+                    results.append((fut, None, err))
+                    continue
+                cur.execute("RELEASE unit")
+                results.append((fut, rowids, None))
+            cur.execute("COMMIT")
+        except Exception as err:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            results = [(fut, None, err) for statements, fut in batch]
+        finally:
+            cur.close()
+        elapsed = time.monotonic() - flushStart
+
+        with self.statsLock:
+            self.numCommits += 1
+            self.numUnits += len(batch)
+            self.numStatements += sum(len(statements) for statements, fut in batch)
+            self.commitSecondsTotal += elapsed
+            self.commitSecondsMax = max(self.commitSecondsMax, elapsed)
+            self.commitSecondsLast = elapsed
+
+        # Nobody hears back until the whole batch is durable
+        for fut, rowids, err in results:
+            if err is None:
+                fut.set_result(rowids)
+            else:
+                fut.set_exception(err)
+
+    def stats(self):
+        with self.statsLock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "commits": self.numCommits,
+                "units": self.numUnits,
+                "statements": self.numStatements,
+                "commit_seconds_avg": self.commitSecondsTotal / self.numCommits if self.numCommits else 0.0,
+                "commit_seconds_max": self.commitSecondsMax,
+                "commit_seconds_last": self.commitSecondsLast,
+                "units_per_commit": self.numUnits / self.numCommits if self.numCommits else 0.0
+            }
@@ -0,0 +1,85 @@
+import random, threading, time, uuid
+import requests
+from limits import *
+from logopts import *
+
+class AgoraEmailWorker:
+    def __init__(self, db, eml):
+        self.db = db
+        self.eml = eml
+        self.fm = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.numFailures = 0
+        self.lastError = None
+
+    def setFileManager(self, fm):
+        self.fm = fm
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="AgoraEmailWorker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                sent = self.drain()
+            except Exception as err:
+                sent = 0    # Keep the worker alive through database hiccups, the mail is still in the outbox
+                self.failed(err)
+            if sent == 0:
+                self.stopping.wait(EMAIL_OUTBOX_POLL_SECONDS)
+
+    def drain(self):
+        claim = uuid.uuid4().hex
+        due = self.db.claimEmails(claim, time.time(), EMAIL_CLAIM_LEASE_SECONDS, EMAIL_OUTBOX_BATCH_SIZE) or []
+        # Identical messages (bug reports to every developer) go out as one Mailgun call
+        groups = {}
+        for email in due:
+            groups.setdefault((email["subject"], email["body"]), []).append(email)
+        for (subject, body), emails in groups.items():
+            for i in range(0, len(emails), EMAIL_BATCH_MAX_RECIPIENTS):
+                self.deliver(subject, body, emails[i:i + EMAIL_BATCH_MAX_RECIPIENTS])
+        return len(due)
+
+    def deliver(self, subject, body, emails):
+        mids = [email["mid"] for email in emails]
+        try:
+            res = self.eml.sendBatch([email["recipient"] for email in emails], subject, body)
+        except requests.RequestException as err:
+            return self.retry(emails, type(err).__name__)
+        if res.status_code < 300:
+            self.db.completeEmails(mids)
+        elif res.status_code == 429 or res.status_code >= 500:
+            self.retry(emails, f"HTTP {res.status_code}")
+        else:
+            self.db.abandonEmails(mids, f"HTTP {res.status_code}: {res.text[:200]}")  # Retrying won't fix a rejected message
+
+    def retry(self, emails, error):
+        attempts = max(email["attempts"] for email in emails) + 1
+        mids = [email["mid"] for email in emails]
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            return self.db.abandonEmails(mids, error)
+        backoff = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+        self.db.retryEmails(mids, time.time() + backoff * random.uniform(0.5, 1.0), error)
+
+    def failed(self, err):
+        error = f"{type(err).__name__}: {err}"
+        with self.lock:
+            self.numFailures += 1
+            self.lastError = error
+        if self.fm is not None:
+            self.fm.logif(LOG_OUTBOX_ERRORS, f"Outbox worker failed to drain: {error}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "failures": self.numFailures,
+                "last_error": self.lastError
+            }
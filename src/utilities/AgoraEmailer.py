@@ -1,55 +1,68 @@
-import sys
-# import smtplib
+import json
 import requests
-from requests.auth import HTTPBasicAuth 
-# from email.message import EmailMessage
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from limits import *
+
+## Composes Agora's emails and hands batches of them to Mailgun. Nothing here is called from a
+## request: the compose methods return (receiver, subject, message) tuples for the outbox, and
+## AgoraEmailWorker does the sending.
 
 class AgoraEmailer:
-    def __init__(self, password, host):
+    def __init__(self, password, host, api="https://api.mailgun.net/v3"):
         self.password = password
         self.host = host
+        self.api = api
         self.devs = []
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth('api', self.password)
+        self.session.mount(api, HTTPAdapter(pool_connections=1, pool_maxsize=EMAIL_HTTP_POOL_SIZE))
 
     def setDeveloperEmails(self, emails):
-        self.devs = emails.split(',')
+        self.devs = [em for em in emails.split(',') if em != '']
 
-    def sendEmail(self, receiver, subject, message):
-        auth = HTTPBasicAuth('api', self.password)
+    def sendBatch(self, receivers, subject, message):
         form = {
             "from": f"Agora Gods <postmaster@{self.host}>",
-            "to": receiver,
+            "to": receivers,
             "subject": subject,
             "text": message
         }
-        res = requests.post(f"https://api.mailgun.net/v3/{self.host}/messages", auth=auth, data=form)
+        if len(receivers) > 1:
+            # Makes Mailgun send each receiver their own copy instead of one email with everybody in "To"
+            form["recipient-variables"] = json.dumps({rcv: {} for rcv in receivers})
+        return self.session.post(f"{self.api}/{self.host}/messages", data=form,
+                timeout=(EMAIL_CONNECT_TIMEOUT_SECONDS, EMAIL_READ_TIMEOUT_SECONDS))
+
+    def close(self):
+        self.session.close()
 
     def confirmAccountEmail(self, receiver, url, backup):
         subject = "Confirm your Agora account"
         message = f"Confirm your new Agora account by visiting the following page:\n{url}\nYour account backup recovery code is {backup}. Don't lose it!"
-        self.sendEmail(receiver, subject, message)
+        return (receiver, subject, message)
 
     def recoverAccountEmail(self, receiver, url):
         subject = "Recover your Agora account"
         message = f"Reset your Agora password by visiting the following page:\n{url}"
-        self.sendEmail(receiver, subject, message)
+        return (receiver, subject, message)
 
     def newRecoveryToken(self, receiver, recovery):
         subject = "New recovery token"
         message = f"You have recently changed your email or used your former recovery token.\n Here is your new recovery token: {recovery}"
-        self.sendEmail(receiver, subject, message)
+        return (receiver, subject, message)
 
     def changeAccountEmail(self, receiver, url):
         subject = "Confirm your new Agora email"
         message = f"Confirm that this is your new email for your Agora account by visiting the following page:\n{url}"
-        self.sendEmail(receiver, subject, message)
+        return (receiver, subject, message)
 
     def deleteAccountEmail(self, receiver, url):
         subject = "Confirm deletion of your Agora account"
         message = f"Visit the following page to confirm the deletion of your Agora account:\n{url}"
-        self.sendEmail(receiver, subject, message)
+        return (receiver, subject, message)
 
     def bugReport(self, rid, user, content):
         subject = f"Bug report #{rid}"
         message = f"Bug report submitted by user {user}:\n\n{content}"
-        for em in self.devs:
-            self.sendEmail(em, subject, message)
+        return [(em, subject, message) for em in self.devs]
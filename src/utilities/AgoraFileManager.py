@@ -1,64 +1,131 @@
-from multiprocessing.pool import ThreadPool
-from datetime import datetime
-from agora_errors import *
-from multiprocessing.pool import ThreadPool
-from datetime import datetime
 import os
 from agora_errors import *
+from limits import *
+from AgoraCache import *
+from AgoraLogWriter import *
+from AgoraFlatPostStore import *
+from AgoraShardedPostStore import *
+from AgoraBlobPostStore import *
+from AgoraLayeredPostStore import *
 
 class AgoraFileManager:
     def __init__(self, postdir, imgdir, logdir):
         self.postdir = postdir
         self.imgdir = imgdir
         self.logdir = logdir
-        self.logPool = ThreadPool(processes=1)
+        self.logWriter = AgoraLogWriter(logdir)
+        self.posts = AgoraFlatPostStore(postdir)
+        self.renderer = None
+        self.images = None
 
-    def getPost(self, filename):
-        path = os.path.join(self.postdir, filename)
-        if os.path.isfile(path):
-            return open(path, 'r').read()
-        else:
-            raise AgoraENoSuchPost
+    def setRenderer(self, renderer):
+        self.renderer = renderer
+        self.renderCache = AgoraLRUCache(POST_RENDER_CACHE_MAX_ENTRIES)
+
+    def setImageProcessor(self, images):
+        self.images = images
+
+    def openPostStore(self, layout):
+        if layout == "flat":
+            return AgoraFlatPostStore(self.postdir)
+        if layout == "sharded":
+            return AgoraShardedPostStore(self.postdir)
+        if layout == "blob":
+            return AgoraBlobPostStore(os.path.join(self.postdir, "posts.db"))
+        raise ValueError(f"Unknown post store layout: {layout}")
+
+    def setPostLayout(self, layout, fallback=None):
+        store = self.openPostStore(layout)
+        if fallback is not None and fallback != layout:
+            store = AgoraLayeredPostStore(store, self.openPostStore(fallback))
+        self.posts = store
 
     def getPost(self, filename):
-        path = os.path.join(self.postdir, filename)
-        if os.path.isfile(path):
-            return open(path, 'r').read()
-        else:
-            raise AgoraENoSuchPost
+        return self.posts.get(filename)
 
     def writePost(self, filename, content):
-        path = os.path.join(self.postdir, filename)
-        with open(path, 'w+') as f:
-            f.write(content)
+        self.posts.put(filename, content)
+        if self.renderer is not None:
+            self.writeRenderedPost(filename, content)
 
     def editPost(self, filename, content):
-        path = os.path.join(self.postdir, filename)
-        with open(path, 'w') as f:
-            f.write(content)
+        self.writePost(filename, content)
+
+    def renderedName(self, filename):
+        return f"{os.path.splitext(filename)[0]}.html"
+
+    def writeRenderedPost(self, filename, content):
+        html = self.renderer.render(content)
+        self.posts.put(self.renderedName(filename), f"<!-- {self.renderer.fingerprint} -->\n{html}")
+        return html
+
+    def readRenderedPost(self, filename):
+        try:
+            header, _, html = self.posts.get(self.renderedName(filename)).partition("\n")
+        except AgoraENoSuchPost:
+            return None
+        if header.strip() != f"<!-- {self.renderer.fingerprint} -->":
+            return None     # Rendered with different sanitizer settings
+        return html
+
+    def refreshRenderedPost(self, filename, force=False):
+        if not force and self.readRenderedPost(filename) is not None:
+            return False
+        self.writeRenderedPost(filename, self.getPost(filename))
+        return True
+
+    def getRenderedPost(self, filename, revision):
+        key = (filename, revision)
+        html = self.renderCache.get(key)
+        if html is None:
+            html = self.readRenderedPost(filename)
+            if html is None:
+                html = self.writeRenderedPost(filename, self.getPost(filename))
+            self.renderCache.put(key, html)
+        return html
 
     def saveImage(self, filename, file):
         path = os.path.join(self.imgdir, filename)
         file.save(path)
+        if self.images is not None:
+            try:
+                self.images.derive(filename)
+            except AgoraEBadImage:
+                self.deleteImage(filename)
+                raise
 
     def deleteImage(self, filename):
         os.remove(os.path.join(self.imgdir, filename))
+        if self.images is not None:
+            self.images.removeVariants(filename)
 
     def deletePost(self, filename):
-        os.remove(os.path.join(self.postdir, filename))
+        self.posts.delete(filename)
+        self.posts.delete(self.renderedName(filename))
 
-    def relativizeImagePath(self, filename):
-        return os.path.join(self.imgdir, filename)
+    def deleteUserFiles(self, posts, images):
+        for filename in posts:
+            self.deletePost(filename)
+        for filename in images:
+            if os.path.isfile(os.path.join(self.imgdir, filename)):
+                self.deleteImage(filename)
 
-    def poolLog(self, msg):
-        path = os.path.join(self.logdir, f"{datetime.today().strftime('%Y-%m-%d')}.log")
-        with open(path, 'a+') as f:
-            f.write(f"{datetime.now().strftime('%I:%M%p')} | {msg}\n")
+    def relativizeImagePath(self, filename, variant=None):
+        if variant is not None and variant not in IMG_VARIANTS:
+            raise AgoraENoSuchImage
+        if self.images is None:
+            return os.path.join(self.imgdir, filename)
+        # Originals keep whatever metadata they were uploaded with, so they're only served until the backfill catches up
+        path = os.path.join(self.imgdir, self.images.variantName(filename, variant or IMG_DEFAULT_VARIANT))
+        return path if os.path.isfile(path) else os.path.join(self.imgdir, filename)
 
     def log(self, msg):
-        return self.logPool.apply(self.poolLog, (msg,))
+        self.logWriter.write(msg)
 
     def logif(self, cond, msg):
         if cond:
             self.log(msg)
 
+
+    def close(self):
+        self.logWriter.close()
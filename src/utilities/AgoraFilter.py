@@ -7,12 +7,14 @@ class AgoraFilter:
     def confirmCreate(self, creationToken):
         raise NotImplementedError
 
+    def identify(self, sessionToken):
+        raise NotImplementedError
     def login(self, username, password):
         raise NotImplementedError
-    def logout(self, sessionToken):
+    def logout(self, identity):
         raise NotImplementedError
 
-    def deleteAccount(self, sessionToken, password):
+    def deleteAccount(self, identity, password):
         raise NotImplementedError
     def confirmDelete(self, deletionToken):
         raise NotImplementedError
@@ -30,52 +32,56 @@ class AgoraFilter:
         raise NotImplementedError
     def getImage(self, imageId):
         raise NotImplementedError
-    def searchUsers(self, query):
+    def searchUsers(self, query, after, before, pagesize):
         raise NotImplementedError
-    def searchPosts(self, query):
+    def searchPosts(self, query, after, before, pagesize):
         raise NotImplementedError
 
-    def getMyUser(self, sessionToken):
+    def getMyUser(self, identity):
+        raise NotImplementedError
+    def getFeed(self, identity, after, before, pagesize):
         raise NotImplementedError
 
-    def changeStatus(self, sessionToken, newStatus):
+    def changeStatus(self, identity, newStatus):
         raise NotImplementedError
-    def changePicture(self, sessionToken, imageId):
+    def changePicture(self, identity, imageId):
         raise NotImplementedError
-    def changeEmail(self, sessionToken, emailAddress):
+    def changeEmail(self, identity, emailAddress):
         raise NotImplementedError
-    def changeUsername(self, sessionToken, username):
+    def changeUsername(self, identity, username):
         raise NotImplementedError
 
-    def writePost(self, sessionToken, title, content):
+    def writePost(self, identity, title, content):
         raise NotImplementedError
-    def deletePost(self, sessionToken, pid):
+    def deletePost(self, identity, pid):
         raise NotImplementedError
-    def uploadImage(self, sessionToken, title, imgData):
+    def uploadImage(self, identity, title, imgData):
         raise NotImplementedError
-    def deleteImage(self, sessionToken, imageId):
+    def deleteImage(self, identity, imageId):
         raise NotImplementedError
-    def listImages(self, sessionToken):
+    def listImages(self, identity):
         raise NotImplementedError
 
-    def friendRequest(self, sessionToken, uid):
+    def friendRequest(self, identity, uid):
         raise NotImplementedError
-    def viewFriendReqs(self, sessionToken):
+    def viewFriendReqs(self, identity):
         raise NotImplementedError
-    def acceptFriendReq(self, sessionToken, uid):
+    def acceptFriendReq(self, identity, uid):
         raise NotImplementedError
 
-    def comment(self, sessionToken, pid):
+    def comment(self, identity, pid):
         raise NotImplementedError
 
-    def bugReport(self, sessionToken, content):
+    def bugReport(self, identity, content):
         raise NotImplementedError
 
-    def adminGetUser(self, sessionToken, uid):
+    def adminGetUser(self, identity, uid):
+        raise NotImplementedError
+    def adminSuspend(self, identity, uid):
         raise NotImplementedError
-    def adminSuspend(self, sessionToken, uid):
+    def adminUnsuspend(self, identity, uid):
         raise NotImplementedError
-    def adminUnsuspend(self, sessionToken, uid):
+    def adminDelete(self, identity, uid, password):
         raise NotImplementedError
-    def adminDelete(self, sessionToken, uid, password):
+    def adminMetrics(self, identity):
         raise NotImplementedError
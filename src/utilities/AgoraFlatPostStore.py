@@ -0,0 +1,53 @@
+import os, re, threading
+from agora_errors import *
+
+class AgoraFlatPostStore:
+    def __init__(self, postdir):
+        self.postdir = postdir
+
+    def path(self, name):
+        return os.path.join(self.postdir, name)
+
+    def get(self, name):
+        try:
+            with open(self.path(name), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise AgoraENoSuchPost
+
+    def writeTemp(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, 'w') as f:
+            f.write(content)
+        return tmp
+
+    def put(self, name, content):
+        # Readers never see a half-written file, since the rename is atomic
+        path = self.path(name)
+        os.replace(self.writeTemp(path, content), path)
+
+    def putIfAbsent(self, name, content):
+        path = self.path(name)
+        tmp = self.writeTemp(path, content)
+        try:
+            os.link(tmp, path)      # Unlike a rename, fails instead of clobbering a newer copy
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp)
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def isStoredName(self, name):
+        return re.match(r"^[\w-]+\.(md|html)$", name) is not None
+
+    def list(self):
+        for name in os.listdir(self.postdir):
+            if self.isStoredName(name) and os.path.isfile(os.path.join(self.postdir, name)):
+                yield name
@@ -0,0 +1,16 @@
+from agora_errors import *
+
+## Who is making the current request. identify() works it out once from the session cookie,
+## and the filter chain takes it in place of the session token from then on.
+
+class AgoraIdentity:
+    def __init__(self, token, uid=None, user=None, error=AgoraEInvalidToken):
+        self.token = token
+        self.uid = uid
+        self.user = user        # The concise private user row
+        self.error = None if uid is not None else error
+
+    def require(self):
+        if self.uid is None:
+            raise self.error
+        return self.uid
@@ -0,0 +1,50 @@
+import os
+from PIL import Image, ImageOps
+from agora_errors import *
+from limits import *
+
+class AgoraImageProcessor:
+    def __init__(self, imgdir):
+        self.imgdir = imgdir
+
+    def variantName(self, filename, variant):
+        stem, extension = os.path.splitext(filename)
+        return f"{stem}-{variant}{extension}"
+
+    def derive(self, filename, force=False):
+        made = 0
+        try:
+            with Image.open(os.path.join(self.imgdir, filename)) as original:
+                if original.width * original.height > IMG_MAX_PIXELS:
+                    raise AgoraEBadImage
+                original.load()
+                # Bake the EXIF rotation into the pixels, since the metadata that carried it is about to go
+                img = ImageOps.exif_transpose(original)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            raise AgoraEBadImage
+        for variant, size in IMG_VARIANTS.items():
+            path = os.path.join(self.imgdir, self.variantName(filename, variant))
+            if not force and os.path.isfile(path):
+                continue
+            self.encode(img, size, path)
+            made += 1
+        return made
+
+    def encode(self, img, size, path):
+        resized = img.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        tmp = f"{path}.tmp{os.getpid()}"
+        # Only the pixels get written: no EXIF, ICC or text chunks make it into a derivative
+        if path.lower().endswith(".png"):
+            if resized.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                resized = resized.convert("RGBA")
+            resized.save(tmp, format="PNG", optimize=True)
+        else:
+            resized.convert("RGB").save(tmp, format="JPEG", quality=IMG_JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, path)
+
+    def removeVariants(self, filename):
+        for variant in IMG_VARIANTS:
+            path = os.path.join(self.imgdir, self.variantName(filename, variant))
+            if os.path.isfile(path):
+                os.remove(path)
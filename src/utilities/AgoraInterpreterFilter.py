@@ -15,24 +15,42 @@ class AgoraInterpreterFilter:
     def setHost(self, host):
         self.host = host
 
+    def setMetrics(self, metrics):
+        self.metrics = metrics
+
     def setFileManager(self, fm):
         self.fm = fm
 
+    def setSessionCache(self, sessions):
+        self.sessions = sessions
+
+    def forgetSessions(self, uid):
+        self.sessions.discardUser(uid)
+
+    def setFeedCache(self, feeds):
+        self.feeds = feeds
+
+    def forgetFriendFeeds(self, uid):
+        for friend in self.db.getFriends(uid):
+            self.feeds.discard(friend)
+
     def generateToken(self, ttype):
         return ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in range(TOKEN_LENGTHS[ttype]))
 
     def createAccount(self, emailAddress, username, hpassword, acceptable):
-        old_uid = self.db.emailExists(emailAddress)
+        old_uid = self.db.emailExists(emailAddress) if acceptable else None     # A confirmed account is never clobbered
+        with self.db.transaction():
+            if not old_uid is None:
+                self.purgeUser(old_uid)     # Delete any unconfirmed accounts with this address
+            if acceptable:
+                recovery = self.generateToken("backup")
+                hrecovery = hashlib.sha256(recovery.encode()).hexdigest()
+                uid = self.db.createUser(emailAddress, username, hpassword, hrecovery, "0"*IMG_RANDOM_ID_LENGTH)
+                confirm = self.generateToken("creation")
+                confirmUrl = f'{self.host}/join/{confirm}'
+                self.db.createToken(uid, confirm, "creation", email=self.eml.confirmAccountEmail(emailAddress, confirmUrl, recovery))
         if not old_uid is None:
-            self.db.deleteUser(old_uid)     # Delete any unconfirmed accounts with this address
-        if acceptable:
-            recovery = self.generateToken("backup")
-            hrecovery = hashlib.sha256(recovery.encode()).hexdigest()
-            uid = self.db.createUser(emailAddress, username, hpassword, hrecovery, "0"*IMG_RANDOM_ID_LENGTH)
-            confirm = self.generateToken("creation")
-            confirmUrl = f'{self.host}/join/{confirm}'
-            self.eml.confirmAccountEmail(emailAddress, confirmUrl, recovery)
-            self.db.createToken(uid, confirm, "creation")
+            self.forgetSessions(old_uid)
     
     def confirmCreate(self, uid, creationToken):
         self.db.expireToken(creationToken)
@@ -45,15 +63,23 @@ class AgoraInterpreterFilter:
 
     def logout(self, sessionToken):
         self.db.expireToken(sessionToken)
+        self.sessions.discard(sessionToken)
 
     def deleteAccount(self, uid, emailAddress):
         confirm = self.generateToken("deletion")
-        self.db.createToken(uid, confirm, "deletion")
         confirmUrl = f'{self.host}/leave/{confirm}'
-        self.eml.deleteAccountEmail(emailAddress, confirmUrl)
+        self.db.createToken(uid, confirm, "deletion", email=self.eml.deleteAccountEmail(emailAddress, confirmUrl))
 
     def confirmDelete(self, uid):
-        self.db.deleteUser(uid)
+        self.forgetFriendFeeds(uid)     # Has to happen before the friendships are gone
+        self.purgeUser(uid)
+        self.forgetSessions(uid)
+
+    def purgeUser(self, uid):
+        posts, images = self.db.getUserFiles(uid)
+        with self.db.transaction() as tx:
+            self.db.deleteUser(uid)
+            tx.onCommit(lambda: self.fm.deleteUserFiles(posts, images))
 
 
 
@@ -61,12 +87,14 @@ class AgoraInterpreterFilter:
         if not acceptable:
             return
         recoveryToken = self.generateToken("recovery")
-        self.db.createToken(uid, recoveryToken, "recovery")
-        self.eml.recoverAccountEmail(emailAddress, f"{self.host}/changepass/{recoveryToken}")
+        recoverUrl = f"{self.host}/changepass/{recoveryToken}"
+        self.db.createToken(uid, recoveryToken, "recovery", email=self.eml.recoverAccountEmail(emailAddress, recoverUrl))
  
     def confirmRecover(self, uid, recoveryToken, hpassword):
         self.db.expireToken(recoveryToken)
         self.db.setPassword(uid, hpassword)
+        self.db.expireUserTokens(uid, "session")    # A reset password logs out every existing session
+        self.forgetSessions(uid)
 
     def backupRecover(self, uid, hbackup, emailAddress, acceptable=True):
         self.changeEmail(uid, emailAddress, acceptable)
@@ -81,9 +109,8 @@ class AgoraInterpreterFilter:
     
     def changeEmail(self, uid, emailAddress, acceptable):
         emailToken = self.generateToken("email")
-        self.db.createToken(uid, emailToken, "email", data=emailAddress)
         confirmUrl = f'{self.host}/confirmemail/{emailToken}'
-        self.eml.changeAccountEmail(emailAddress, confirmUrl)
+        self.db.createToken(uid, emailToken, "email", data=emailAddress, email=self.eml.changeAccountEmail(emailAddress, confirmUrl))
    
     def confirmEmail(self, uid, emailToken):
         newEmail = self.db.tokenData(emailToken)
@@ -91,8 +118,7 @@ class AgoraInterpreterFilter:
         self.db.setEmail(uid, newEmail)
         recovery = self.generateToken("recovery")
         hrecovery = hashlib.sha256(recovery.encode()).hexdigest()
-        self.eml.newRecoveryToken(newEmail, recovery)
-        self.db.setBackup(uid, hrecovery)
+        self.db.setBackup(uid, hrecovery, email=self.eml.newRecoveryToken(newEmail, recovery))
 
     def changeUsername(self, uid, username):
         self.db.setUsername(uid, username)
@@ -101,25 +127,38 @@ class AgoraInterpreterFilter:
 
     def writePost(self, uid, title, content):
         filename = f"post{self.generateToken('postid')}.md"
-        pid = self.db.insertPost(uid, title, filename)
-        self.fm.writePost(filename, content)
-        return pid
+        self.fm.writePost(filename, content)     # Before the row, so nobody can open the post ahead of its file
+        try:
+            # The row and its search entry go in together, in one commit
+            with self.db.transaction() as tx:
+                pid = self.db.insertPost(uid, title, filename)
+                self.db.indexPost(pid, title, content)
+        except Exception:
+            self.fm.deletePost(filename)
+            raise
+        self.forgetFriendFeeds(uid)
+        return tx.resolve(pid)
 
     def editPost(self, pid, title, content):
-        filename = self.db.getPostInfo(pid)["filename"]
-        self.db.updatePost(pid, title)
-        self.fm.editPost(filename, content)
+        pinfo = self.db.getPostInfo(pid)
+        self.fm.editPost(pinfo["filename"], content)     # Files first, so nobody caches the old rendering under the new revision
+        with self.db.transaction():
+            self.db.updatePost(pid, title)
+            self.db.indexPost(pid, title, content)
+        self.forgetFriendFeeds(pinfo["owner"])
 
     def deletePost(self, pid):
-        filename = self.db.getPostInfo(pid)["filename"]
-        self.db.deletePost(pid)
-        self.fm.deletePost(filename)
+        pinfo = self.db.getPostInfo(pid)
+        with self.db.transaction() as tx:
+            self.db.deletePost(pid)
+            tx.onCommit(lambda: self.fm.deletePost(pinfo["filename"]))
+        self.forgetFriendFeeds(pinfo["owner"])
     
     def uploadImage(self, uid, title, extension, imgData):
         accessid = self.generateToken('imgid')
         filename = f"img{accessid}.{extension}"
+        self.fm.saveImage(filename, imgData)     # Rejects anything that doesn't decode before it gets a row
         self.db.insertImage(uid, title, filename, accessid)
-        self.fm.saveImage(filename, imgData)
         return accessid
 
     def deleteImage(self, imageId):
@@ -131,9 +170,13 @@ class AgoraInterpreterFilter:
 
     def friendRequest(self, uid1, uid2):
         self.db.insertFriendReq(uid1, uid2)
+        self.feeds.discard(uid1)
+        self.feeds.discard(uid2)
 
     def unfriend(self, uid1, uid2):
         self.db.deleteFriendReq(uid1, uid2)
+        self.feeds.discard(uid1)
+        self.feeds.discard(uid2)
 
     def comment(self, uid, pid, content):
         self.db.insertComment(uid, pid, content)
@@ -152,16 +195,23 @@ class AgoraInterpreterFilter:
 
     def bugReport(self, uid, content):
         rid = self.db.createBugReport(uid)
-        self.eml.bugReport(rid, uid, content)
+        self.db.queueEmails(self.eml.bugReport(rid, uid, content))
         return rid
 
 
 
     def adminSuspend(self, uid):
         self.db.suspendUser(uid)
+        self.forgetSessions(uid)
     
     def adminUnsuspend(self, uid):
         self.db.unsuspendUser(uid)
+        self.forgetSessions(uid)
     
     def adminDelete(self, uid):
-        self.db.deleteUser(uid)
+        self.forgetFriendFeeds(uid)     # Has to happen before the friendships are gone
+        self.purgeUser(uid)
+        self.forgetSessions(uid)
+
+    def adminMetrics(self):
+        return self.metrics.render()
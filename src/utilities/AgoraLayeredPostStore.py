@@ -0,0 +1,28 @@
+from agora_errors import *
+
+class AgoraLayeredPostStore:
+    # Serves reads from the old layout until migrate-posts has moved everything into the new one
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def get(self, name):
+        try:
+            return self.primary.get(name)
+        except AgoraENoSuchPost:
+            return self.fallback.get(name)
+
+    def put(self, name, content):
+        self.primary.put(name, content)
+        self.fallback.delete(name)
+
+    def putIfAbsent(self, name, content):
+        return self.primary.putIfAbsent(name, content)
+
+    def delete(self, name):
+        self.primary.delete(name)
+        self.fallback.delete(name)
+
+    def list(self):
+        yield from self.primary.list()
+        yield from self.fallback.list()
@@ -0,0 +1,83 @@
+import os, queue, threading, time
+from datetime import datetime
+from limits import *
+
+class AgoraLogWriter:
+    def __init__(self, logdir, policy=LOG_QUEUE_FULL_POLICY):
+        self.logdir = logdir
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_MAX_LINES)
+        self.file = None
+        self.day = None
+        self.statsLock = threading.Lock()
+        self.numWritten = 0
+        self.numDropped = 0
+        self.numErrors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="AgoraLogWriter", daemon=True)
+        self.thread.start()
+
+    def write(self, msg):
+        now = datetime.now()
+        line = (now.strftime('%Y-%m-%d'), f"{now.strftime('%I:%M%p')} | {msg}\n")
+        try:
+            if self.policy == "block":
+                self.queue.put(line, timeout=LOG_BLOCK_TIMEOUT_SECONDS)
+            else:
+                self.queue.put_nowait(line)
+        except queue.Full:
+            with self.statsLock:
+                self.numDropped += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)    # Waits for room even under the drop policy, so everything queued before it gets written
+        self.thread.join()
+
+    def run(self):
+        while True:
+            lines = [self.queue.get()]
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL_SECONDS
+            try:
+                while len(lines) < LOG_BATCH_MAX_LINES and lines[-1] is not None:
+                    lines.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                pass
+            stopping = None in lines
+            self.flush([line for line in lines if line is not None])
+            if stopping:
+                if self.file is not None:
+                    self.file.close()
+                return
+
+    def flush(self, lines):
+        try:
+            for day, text in lines:
+                if day != self.day:
+                    self.rotate(day)
+                self.file.write(text)
+            if self.file is not None:
+                self.file.flush()
+            with self.statsLock:
+                self.numWritten += len(lines)
+        except OSError:
+            with self.statsLock:
+                self.numErrors += 1
+            self.day = None     # Reopen on the next batch
+
+    def rotate(self, day):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.logdir, f"{day}.log"), 'a')
+        self.day = day
+
+    def stats(self):
+        with self.statsLock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "written": self.numWritten,
+                "dropped": self.numDropped,
+                "errors": self.numErrors
+            }
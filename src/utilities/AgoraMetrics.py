@@ -0,0 +1,216 @@
+import bisect, contextlib, fcntl, json, os, threading
+from limits import *
+
+## Request counts, latency histograms, errors and in-flight requests per endpoint, in Prometheus text format.
+## Given a directory shared by all worker processes, each one writes its numbers there every few seconds
+## and render() adds them all up; a worker that exits folds its numbers into archive.json.
+
+class AgoraMetrics:
+    def __init__(self, dirname=None, buckets=METRICS_LATENCY_BUCKETS):
+        self.dirname = dirname
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.requests = {}      # (endpoint, method, status) -> count
+        self.latency = {}       # endpoint -> count per bucket, then +Inf, then the sum of seconds
+        self.errors = {}        # (endpoint, error class) -> count
+        self.inflight = {}      # endpoint -> requests being handled right now
+        self.queries = {}       # endpoint -> SQL statements issued
+        self.queryStats = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def setQueryStats(self, queryStats):
+        self.queryStats = queryStats
+
+    def begin(self, endpoint):
+        with self.lock:
+            self.inflight[endpoint] = self.inflight.get(endpoint, 0) + 1
+
+    def end(self, endpoint, method, status, seconds, error=None, queries=0):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.inflight[endpoint] -= 1
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[i] += 1
+            hist[-1] += seconds
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + queries
+            if error is not None:
+                self.errors[(endpoint, error)] = self.errors.get((endpoint, error), 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            snap = self.serialize({"requests": self.requests, "latency": self.latency, "errors": self.errors,
+                    "inflight": self.inflight, "queries": self.queries, "sql": {}})
+        if self.queryStats is not None:
+            snap["sql"] = self.queryStats.snapshot()
+        return snap
+
+    # The JSON-friendly form of a total: tuple keys become lists
+    def serialize(self, total):
+        return {
+            "requests": [[*key, n] for key, n in total["requests"].items()],
+            "latency": {endpoint: list(hist) for endpoint, hist in total["latency"].items()},
+            "errors": [[*key, n] for key, n in total["errors"].items()],
+            "inflight": dict(total["inflight"]),
+            "queries": dict(total["queries"]),
+            "sql": [[norm, *entry] for norm, entry in total["sql"].items()]
+        }
+
+    def start(self):
+        if self.dirname is None:
+            return
+        os.makedirs(self.dirname, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="AgoraMetrics", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(METRICS_FLUSH_INTERVAL_SECONDS):
+            try:
+                self.flush()
+            except OSError:
+                pass    # Scrapes see slightly older numbers from us until the next try
+
+    def flush(self):
+        self.writeJSON(os.path.join(self.dirname, f"{os.getpid()}.json"), self.snapshot())
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is None:
+            return
+        self.thread.join()
+        self.thread = None
+        with self.dirLock(fcntl.LOCK_EX):
+            archive = self.empty()
+            old = self.readJSON(os.path.join(self.dirname, "archive.json"))
+            if old is not None:
+                self.merge(archive, old, live=False)
+            self.merge(archive, self.snapshot(), live=False)
+            self.writeJSON(os.path.join(self.dirname, "archive.json"), self.serialize(archive))
+            try:
+                os.remove(os.path.join(self.dirname, f"{os.getpid()}.json"))
+            except FileNotFoundError:
+                pass
+
+    def collect(self):
+        total = self.empty()
+        self.merge(total, self.snapshot(), live=True)
+        if self.dirname is None or not os.path.isdir(self.dirname):
+            return total
+        with self.dirLock(fcntl.LOCK_SH):
+            for filename in os.listdir(self.dirname):
+                stem, extension = os.path.splitext(filename)
+                if extension != ".json" or stem == str(os.getpid()):
+                    continue
+                snap = self.readJSON(os.path.join(self.dirname, filename))
+                if snap is not None:
+                    # Whatever a dead worker had in flight is never going to finish
+                    self.merge(total, snap, live=stem.isdigit() and self.isAlive(int(stem)))
+        return total
+
+    def render(self):
+        total = self.collect()
+        lines = [
+            "# HELP agora_requests_total Requests handled, by endpoint, method and status.",
+            "# TYPE agora_requests_total counter"
+        ]
+        for (endpoint, method, status), n in sorted(total["requests"].items()):
+            lines.append(f'agora_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {n}')
+        lines.append("# HELP agora_request_duration_seconds Time spent handling requests, by endpoint.")
+        lines.append("# TYPE agora_request_duration_seconds histogram")
+        for endpoint, hist in sorted(total["latency"].items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ["+Inf"], hist):
+                cumulative += n
+                lines.append(f'agora_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'agora_request_duration_seconds_sum{{endpoint="{endpoint}"}} {hist[-1]:.6f}')
+            lines.append(f'agora_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+        lines.append("# HELP agora_errors_total Requests that ended in an exception, by endpoint and exception class.")
+        lines.append("# TYPE agora_errors_total counter")
+        for (endpoint, error), n in sorted(total["errors"].items()):
+            lines.append(f'agora_errors_total{{endpoint="{endpoint}",error="{error}"}} {n}')
+        lines.append("# HELP agora_requests_in_flight Requests being handled right now, by endpoint.")
+        lines.append("# TYPE agora_requests_in_flight gauge")
+        for endpoint, n in sorted(total["inflight"].items()):
+            lines.append(f'agora_requests_in_flight{{endpoint="{endpoint}"}} {n}')
+        lines.append("# HELP agora_db_statements_total SQL statements issued while handling requests, by endpoint.")
+        lines.append("# TYPE agora_db_statements_total counter")
+        for endpoint, n in sorted(total["queries"].items()):
+            lines.append(f'agora_db_statements_total{{endpoint="{endpoint}"}} {n}')
+        sql = sorted(total["sql"].items())
+        lines.append("# HELP agora_db_statement_calls_total Executions of each normalized SQL statement.")
+        lines.append("# TYPE agora_db_statement_calls_total counter")
+        lines.extend(f'agora_db_statement_calls_total{{statement="{self.escape(norm)}"}} {entry[0]}' for norm, entry in sql)
+        lines.append("# HELP agora_db_statement_seconds_total Time spent executing each normalized SQL statement.")
+        lines.append("# TYPE agora_db_statement_seconds_total counter")
+        lines.extend(f'agora_db_statement_seconds_total{{statement="{self.escape(norm)}"}} {entry[1]:.6f}' for norm, entry in sql)
+        lines.append("# HELP agora_db_statement_seconds_max Longest single execution of each normalized SQL statement.")
+        lines.append("# TYPE agora_db_statement_seconds_max gauge")
+        lines.extend(f'agora_db_statement_seconds_max{{statement="{self.escape(norm)}"}} {entry[2]:.6f}' for norm, entry in sql)
+        lines.append("# HELP agora_db_slow_statements_total Executions over DB_SLOW_QUERY_SECONDS, by normalized SQL statement.")
+        lines.append("# TYPE agora_db_slow_statements_total counter")
+        lines.extend(f'agora_db_slow_statements_total{{statement="{self.escape(norm)}"}} {entry[3]}' for norm, entry in sql)
+        return "\n".join(lines) + "\n"
+
+    def escape(self, value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def empty(self):
+        return {"requests": {}, "latency": {}, "errors": {}, "inflight": {}, "queries": {}, "sql": {}}
+
+    # Adds a serialized snapshot into a total
+    def merge(self, total, snap, live):
+        for endpoint, method, status, n in snap["requests"]:
+            key = (endpoint, method, status)
+            total["requests"][key] = total["requests"].get(key, 0) + n
+        for endpoint, hist in snap["latency"].items():
+            mine = total["latency"].setdefault(endpoint, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, n in enumerate(hist):
+                mine[i] += n
+        for endpoint, error, n in snap["errors"]:
+            total["errors"][(endpoint, error)] = total["errors"].get((endpoint, error), 0) + n
+        for endpoint, n in snap["inflight"].items():
+            total["inflight"][endpoint] = total["inflight"].get(endpoint, 0) + (n if live else 0)
+        for endpoint, n in snap.get("queries", {}).items():
+            total["queries"][endpoint] = total["queries"].get(endpoint, 0) + n
+        for norm, calls, seconds, maxSeconds, slow in snap.get("sql", []):
+            mine = total["sql"].setdefault(norm, [0, 0.0, 0.0, 0])
+            mine[0] += calls
+            mine[1] += seconds
+            mine[2] = max(mine[2], maxSeconds)
+            mine[3] += slow
+        return total
+
+    def isAlive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @contextlib.contextmanager
+    def dirLock(self, mode):
+        with open(os.path.join(self.dirname, "archive.lock"), 'a') as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def readJSON(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def writeJSON(self, path, data):
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
@@ -0,0 +1,41 @@
+import os, re, sqlite3
+
+class AgoraMigrator:
+    def __init__(self, migrationdir):
+        self.migrationdir = migrationdir
+
+    def migrations(self):
+        found = []
+        for filename in os.listdir(self.migrationdir):
+            match = re.match(r"^(\d+)-[\w-]+\.sql$", filename)
+            if match:
+                found.append((int(match.group(1)), filename))
+        return sorted(found)
+
+    def schemaVersion(self, conn):
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def apply(self, conn):
+        applied = []
+        version = self.schemaVersion(conn)
+        for number, filename in self.migrations():
+            if number <= version:
+                continue
+            with open(os.path.join(self.migrationdir, filename), 'r') as f:
+                script = f.read()
+            # executescript() commits anything pending first, so the transaction has to live inside the script
+            try:
+                conn.executescript(f"BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            applied.append(filename)
+        return applied
+
+    def migrate(self, dbname):
+        conn = sqlite3.connect(dbname, isolation_level=None)
+        try:
+            return self.apply(conn)
+        finally:
+            conn.close()
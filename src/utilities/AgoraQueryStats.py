@@ -0,0 +1,73 @@
+import collections, re, threading, time
+from limits import *
+from logopts import *
+
+## Timing per normalized SQL statement, the slowest recent statements, and the statements issued
+## by the request the calling thread is handling.
+
+class AgoraQueryStats:
+    def __init__(self, slowSeconds=DB_SLOW_QUERY_SECONDS):
+        self.slowSeconds = slowSeconds
+        self.fm = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.normalized = {}
+        self.statements = {}    # normalized SQL -> [calls, seconds, max seconds, slow calls]
+        self.slow = collections.deque(maxlen=DB_SLOW_QUERY_LOG_SIZE)
+
+    def setFileManager(self, fm):
+        self.fm = fm
+
+    def normalize(self, sql):
+        norm = self.normalized.get(sql)
+        if norm is None:
+            norm = re.sub(r"'(?:[^']|'')*'", "?", sql)
+            norm = re.sub(r"\b\d+(?:\.\d+)?\b", "?", norm)
+            norm = " ".join(norm.split())
+            if len(self.normalized) < DB_QUERY_STATS_MAX_STATEMENTS:
+                self.normalized[sql] = norm
+        return norm
+
+    def record(self, sql, seconds):
+        norm = self.normalize(sql)
+        slow = seconds >= self.slowSeconds
+        with self.lock:
+            entry = self.statements.get(norm)
+            if entry is None:
+                if len(self.statements) >= DB_QUERY_STATS_MAX_STATEMENTS:
+                    norm = "(other)"
+                entry = self.statements.setdefault(norm, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if slow:
+                entry[3] += 1
+                self.slow.append({"time": time.time(), "statement": norm, "seconds": seconds})
+        if slow and self.fm is not None:
+            self.fm.logif(LOG_SLOW_QUERIES, f"Slow query ({seconds * 1000:.1f} ms): {norm}")
+
+    # Called on the thread that issues the statement, which for writes is not the one that runs it
+    def count(self, sql):
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.append(self.normalize(sql))
+
+    def startRequest(self):
+        self.local.trace = []
+
+    def finishRequest(self):
+        trace = getattr(self.local, "trace", None) or []
+        self.local.trace = None
+        self.local.last = trace
+        return len(trace)
+
+    def lastRequest(self):
+        return getattr(self.local, "last", None)
+
+    def slowQueries(self):
+        with self.lock:
+            return list(self.slow)
+
+    def snapshot(self):
+        with self.lock:
+            return [[norm, *entry] for norm, entry in self.statements.items()]
@@ -0,0 +1,141 @@
+import collections, threading, time
+from limits import *
+from logopts import *
+from agora_errors import *
+from AgoraCache import *
+
+## Per-user limits on writes, kept in memory: a token bucket for each action, and for the actions with a
+## daily cap, the times of the user's last 24 hours of them. Nothing here touches the writer on the way
+## through; users.lastaction is only brought up to date every RATE_LIMIT_CHECKPOINT_SECONDS.
+## A user's state is loaded with plain reads the first time we see them, and the daily windows are read again
+## every RATE_LIMIT_WINDOW_RELOAD_SECONDS, which is how workers find out about each other's posts and comments.
+
+DAY_SECONDS = 24 * 3600
+
+class AgoraRateLimiter:
+    def __init__(self, db, buckets=RATE_LIMIT_BUCKETS, daily=RATE_LIMIT_DAILY):
+        self.db = db
+        self.fm = None
+        self.buckets = buckets      # action -> (burst, seconds for one token to come back)
+        self.daily = daily          # action -> most allowed in any 24 hours
+        self.users = AgoraLRUCache(RATE_LIMIT_MAX_USERS)
+        self.lock = threading.Lock()
+        self.dirty = {}             # uid -> time of their last action, not yet checkpointed
+        self.stopping = threading.Event()
+        self.thread = None
+        self.numAllowed = 0
+        self.numTooSoon = 0
+        self.numTooMany = 0
+        self.numFailures = 0
+        self.lastError = None
+
+    def setFileManager(self, fm):
+        self.fm = fm
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="AgoraRateLimiter", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        try:
+            self.checkpoint()
+        except Exception as err:
+            self.failed(err)    # Losing the last few lastaction times only means slightly fuller buckets next time
+
+    def run(self):
+        while not self.stopping.wait(RATE_LIMIT_CHECKPOINT_SECONDS):
+            try:
+                self.checkpoint()
+            except Exception as err:
+                self.failed(err)    # The times stay dirty and go out with the next checkpoint
+
+    def checkpoint(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return 0
+        try:
+            self.db.setUserLastActions(dirty.items())
+        except Exception:
+            with self.lock:
+                for uid, when in dirty.items():
+                    self.dirty[uid] = max(when, self.dirty.get(uid, when))
+            raise
+        return len(dirty)
+
+    def acquire(self, uid, action):
+        now = time.time()
+        state = self.userState(uid, now)
+        if action in self.daily:
+            self.loadWindow(uid, action, state, now)
+        burst, interval = self.buckets[action]
+        with self.lock:
+            bucket = state["buckets"].get(action)
+            if bucket is None:
+                # As though the bucket had been full until the last action we have on record
+                tokens = burst - 1 + (now - state["lastaction"]) / interval
+            else:
+                tokens = bucket[0] + (now - bucket[1]) / interval
+            tokens = min(burst, tokens)
+            window = state["windows"].get(action)
+            if window is not None:
+                events = window["events"]
+                while events and events[0] <= now - DAY_SECONDS:
+                    events.popleft()
+                if len(events) >= self.daily[action]:
+                    self.numTooMany += 1
+                    raise AgoraETooMany
+            if tokens < 1:
+                state["buckets"][action] = (tokens, now)
+                self.numTooSoon += 1
+                raise AgoraETooSoon
+            state["buckets"][action] = (tokens - 1, now)
+            if window is not None:
+                window["events"].append(now)
+            self.dirty[uid] = now
+            self.numAllowed += 1
+
+    def userState(self, uid, now):
+        state = self.users.get(uid)
+        if state is None:
+            elapsed = self.db.getUserLastAction(uid)
+            lastaction = 0 if elapsed is None else now - elapsed
+            state = {"lastaction": lastaction, "buckets": {}, "windows": {}}
+            with self.lock:
+                # Another thread may have got here first, and its state may already have been spent from
+                state = self.users.get(uid) or state
+                self.users.put(uid, state)
+        return state
+
+    def loadWindow(self, uid, action, state, now):
+        window = state["windows"].get(action)
+        if window is not None and now - window["loaded"] < RATE_LIMIT_WINDOW_RELOAD_SECONDS:
+            return
+        times = self.db.getRecentActionTimes(uid, action, now - DAY_SECONDS)
+        with self.lock:
+            # What the database has covers every worker; ours since the read may not have committed yet
+            mine = [] if window is None else [t for t in window["events"] if t >= now]
+            state["windows"][action] = {"loaded": now, "events": collections.deque(sorted(times) + mine)}
+
+    def failed(self, err):
+        error = f"{type(err).__name__}: {err}"
+        with self.lock:
+            self.numFailures += 1
+            self.lastError = error
+        if self.fm is not None:
+            self.fm.logif(LOG_RATE_LIMIT_ERRORS, f"Rate limiter failed to checkpoint lastaction: {error}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "allowed": self.numAllowed,
+                "toosoon": self.numTooSoon,
+                "toomany": self.numTooMany,
+                "dirty": len(self.dirty),
+                "failures": self.numFailures,
+                "last_error": self.lastError
+            }
@@ -0,0 +1,29 @@
+import hashlib
+import json
+import html_sanitizer
+import markdown
+
+class AgoraRenderer:
+    def __init__(self):
+        settings = dict(html_sanitizer.sanitizer.DEFAULT_SETTINGS)
+        settings['tags'].add('img')
+        settings['tags'].add('center')
+        settings['empty'].add('img')
+        settings['attributes'].update({'img': ('src',)})
+        self.settings = settings
+        self.sanitizer = html_sanitizer.Sanitizer(settings=settings)     # We're using the library's default configuration
+        self.fingerprint = self.computeFingerprint()
+
+    def computeFingerprint(self):
+        # Changes whenever the sanitizer settings or the markdown library do, which invalidates every stored rendering
+        def stable(value):
+            if isinstance(value, (set, frozenset)):
+                return sorted(value)
+            if callable(value):
+                return f"{value.__module__}.{value.__qualname__}"
+            return str(value)
+        settings = json.dumps(self.settings, sort_keys=True, default=stable)
+        return hashlib.sha256(f"{markdown.__version__}\n{settings}".encode()).hexdigest()[:16]
+
+    def render(self, content):
+        return self.sanitizer.sanitize(markdown.markdown(content))
@@ -0,0 +1,4 @@
+class AgoraRowRef:
+    # Stands for the rowid of an INSERT queued earlier in the same transaction, filled in by the writer
+    def __init__(self, index):
+        self.index = index
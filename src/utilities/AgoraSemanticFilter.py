@@ -1,43 +1,73 @@
 from AgoraFilter import *
+from AgoraIdentity import *
+from AgoraVerifiedCaptcha import *
 from agora_errors import *
 from limits import *
-import requests
+import time
 from logopts import *
 
 class AgoraSemanticFilter(AgoraFilter):
     def setDBManager(self, db):
         self.db = db
 
-    def setReCaptchaKey(self, key):
-        self.reCaptchaServerKey = key
+    def setCaptchaVerifier(self, verifier):
+        self.captcha = verifier
+
+    def setCaptchaTrustCache(self, trusted):
+        self.trusted = trusted
     
     def setFileManager(self, fm):
         self.fm = fm
 
+    def setSessionCache(self, sessions):
+        self.sessions = sessions
 
+    def setFeedCache(self, feeds):
+        self.feeds = feeds
 
-    def doLogin(self, sessionToken):
-        uid = self.db.tokenExists(sessionToken, "session")
-        if uid is None:
-            raise AgoraEInvalidToken
-        if self.db.isUserSuspended(uid):
+    def setRateLimiter(self, limiter):
+        self.limiter = limiter
+
+
+
+    def authenticate(self, sessionToken):
+        session = self.sessions.get(sessionToken)
+        if session is None:
+            session = self.db.getSession(sessionToken)
+            if session is None:
+                raise AgoraEInvalidToken
+            self.sessions.put(sessionToken, session)
+        if session["suspended"]:
             raise AgoraENotAuthorized
-        if self.db.getTokenAgeSeconds(sessionToken) > SESSION_MAX_DURATION_SECONDS:
+        if time.time() - session["issued"] > SESSION_MAX_DURATION_SECONDS:
+            self.sessions.discard(sessionToken)
             self.db.expireToken(sessionToken)   # Here I am breaking my unspoken rule that AgoraSemanticFilter not write to the DB
             raise AgoraENotLoggedIn
-        return uid
+        return session["uid"]
+
+    def doLogin(self, identity):
+        return identity.require()
+
+    def applyRateLimit(self, uid, action):
+        self.limiter.acquire(uid, action)
 
-    def applyTimeLimit(self, uid):
-        if self.db.getUserLastAction(uid) < USER_ACTION_TIMEOUT_SECONDS:
-            raise AgoraETooSoon
-        else:
-            self.db.setUserLastAction(uid)      # Here I am breaking that unspoken rule again!
+    def verifyCaptcha(self, userresp, sessionToken=None):
+        if isinstance(userresp, AgoraVerifiedCaptcha):
+            return
+        # A session that passed a captcha recently isn't asked again until its trust runs out
+        trusting = sessionToken is not None and self.trusted is not None
+        if trusting and self.trusted.get(sessionToken) is not None:
+            return
+        # Only a real pass earns trust; one let through while Google is unreachable doesn't
+        if self.captcha.verify(userresp) and trusting:
+            self.trusted.put(sessionToken, True)
 
-    def verifyCaptcha(self, userresp):
-        reCaptchaUrl = "https://www.google.com/recaptcha/api/siteverify"
-        resp = requests.post(reCaptchaUrl, data={"secret": self.reCaptchaServerKey, "response": userresp})
-        if resp.json()["score"] < RECAPTCHA_THRESHHOLD:
-            raise AgoraEAreYouHuman
+    async def verifyCaptchaAsync(self, userresp, sessionToken=None):
+        trusting = sessionToken is not None and self.trusted is not None
+        if not (trusting and self.trusted.get(sessionToken) is not None):
+            if await self.captcha.verifyAsync(userresp) and trusting:
+                self.trusted.put(sessionToken, True)
+        return AgoraVerifiedCaptcha()
 
 
 
@@ -59,6 +89,13 @@ class AgoraSemanticFilter(AgoraFilter):
 
 
 
+    def identify(self, sessionToken):
+        try:
+            uid = self.authenticate(sessionToken)
+        except AgoraException as err:
+            return AgoraIdentity(sessionToken, error=type(err))
+        return AgoraIdentity(sessionToken, uid, self.db.getPrivateUser(uid, concise=True))
+
     def login(self, username, hpassword, captcha):
         self.verifyCaptcha(captcha)
         uid = self.db.passwordCorrect(username, hpassword)
@@ -71,15 +108,15 @@ class AgoraSemanticFilter(AgoraFilter):
         self.fm.logif(LOG_LOGINS, f"User {uid} logged in.")
         return self.next.login(uid)
 
-    def logout(self, sessionToken):
-        if not self.db.tokenExists(sessionToken, "session"):
+    def logout(self, identity):
+        if not self.db.tokenExists(identity.token, "session"):
             raise AgoraEInvalidToken
-        return self.next.logout(sessionToken)
+        return self.next.logout(identity.token)
 
 
 
-    def deleteAccount(self, sessionToken, hpassword):
-        uid = self.db.tokenExists(sessionToken, "session")
+    def deleteAccount(self, identity, hpassword):
+        uid = self.db.tokenExists(identity.token, "session")
         if uid is None:
             raise AgoraEInvalidToken
         dat = self.db.getPrivateUser(uid)
@@ -137,33 +174,45 @@ class AgoraSemanticFilter(AgoraFilter):
             raise AgoraENoSuchImage
         return loc
     
-    def searchUsers(self, query):
-        return self.db.searchUser(query)
+    def searchUsers(self, query, after, before, pagesize):
+        return self.db.searchUser(query, after=after, before=before, limit=pagesize)
     
-    def searchPosts(self, query):
-        return self.db.searchPost(query)
+    def searchPosts(self, query, after, before, pagesize):
+        return self.db.searchPost(query, after=after, before=before, limit=pagesize)
+
 
 
+    def getMyUser(self, identity, concise=False):
+        uid = self.doLogin(identity)
+        if concise:
+            return identity.user
+        return self.db.getPrivateUser(uid)
 
-    def getMyUser(self, sessionToken, concise=False):
-        uid = self.doLogin(sessionToken)
-        return self.db.getPrivateUser(uid, concise=concise)
+    def getFeed(self, identity, after, before, pagesize):
+        uid = self.doLogin(identity)
+        if after is not None or before is not None or pagesize != BROWSE_PAGE_SIZE:
+            return self.db.getFeed(uid, after=after, before=before, limit=pagesize)
+        page = self.feeds.get(uid)     # Only the first page is cached, since that's the one everybody sees
+        if page is None:
+            page = self.db.getFeed(uid, limit=pagesize)
+            self.feeds.put(uid, page)
+        return page
 
 
 
-    def changeStatus(self, sessionToken, newStatus):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def changeStatus(self, identity, newStatus):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "profile")
         return self.next.changeStatus(uid, newStatus)
 
-    def changePicture(self, sessionToken, imageId):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def changePicture(self, identity, imageId):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "profile")
         return self.next.changePicture(uid, imageId)
     
-    def changeEmail(self, sessionToken, emailAddress):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def changeEmail(self, identity, emailAddress):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "profile")
         otherOwner = self.db.emailExists(emailAddress)  # We don't raise an error when uid is None, in order to avoid disclosing emails
         return self.next.changeEmail(uid, emailAddress, otherOwner is None)
    
@@ -175,9 +224,9 @@ class AgoraSemanticFilter(AgoraFilter):
         self.fm.logif(LOG_EMAIL_CHANGE, f"User {uid} changed their email to {newEmail.encode('unicode_escape')}")
         return self.next.confirmEmail(uid, emailToken)
 
-    def changeUsername(self, sessionToken, username):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def changeUsername(self, identity, username):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "profile")
         if not self.db.usernameExists(username) is None:
             raise AgoraEInvalidUsername
         oldUsername = self.db.getPublicUser(uid)["username"]
@@ -186,15 +235,15 @@ class AgoraSemanticFilter(AgoraFilter):
 
 
 
-    def writePost(self, sessionToken, title, content, captcha):
-        self.verifyCaptcha(captcha)
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def writePost(self, identity, title, content, captcha):
+        self.verifyCaptcha(captcha, identity.token)
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "post")
         self.fm.logif(LOG_CREATE_POST, f"User {uid} wrote a new post")
         return self.next.writePost(uid, title, content)
 
-    def editPost(self, sessionToken, pid, title, content):
-        uid = self.doLogin(sessionToken)
+    def editPost(self, identity, pid, title, content):
+        uid = self.doLogin(identity)
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         pinfo = self.db.getPostInfo(pid)
@@ -203,9 +252,9 @@ class AgoraSemanticFilter(AgoraFilter):
         return self.next.editPost(pid, title, content)
            
  
-    def deletePost(self, sessionToken, pid):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def deletePost(self, identity, pid):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "delete")
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         pinfo = self.db.getPostInfo(pid)
@@ -214,18 +263,18 @@ class AgoraSemanticFilter(AgoraFilter):
         self.fm.logif(LOG_DELETE_POST, f"User {uid} deleted the post formerly with PID {pid}")
         return self.next.deletePost(pid)
     
-    def uploadImage(self, sessionToken, title, extension, imgData):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def uploadImage(self, identity, title, extension, imgData):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "image")
         numImages = self.db.getNumImages(uid)
         if numImages > USER_MAX_IMAGES:
             raise AgoraEBadImage
         self.fm.logif(LOG_CREATE_IMAGE, f"User {uid} uploaded an image")
         return self.next.uploadImage(uid, title, extension, imgData)
     
-    def deleteImage(self, sessionToken, imageId):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def deleteImage(self, identity, imageId):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "delete")
         if self.db.imgExists(imageId) is None:
             raise AgoraENoSuchImage
         imgowner = self.db.getImageOwner(imageId)
@@ -234,51 +283,51 @@ class AgoraSemanticFilter(AgoraFilter):
         self.fm.logif(LOG_DELETE_IMAGE, f"User {uid} deleted the image {imageId}")
         return self.next.deleteImage(imageId)
     
-    def listImages(self, sessionToken):
-        uid = self.doLogin(sessionToken)
+    def listImages(self, identity):
+        uid = self.doLogin(identity)
         info = self.db.getPrivateUser(uid)
         return info["images"]
 
 
 
-    def friendRequest(self, sessionToken, uid2):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def friendRequest(self, identity, uid2):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "friend")
         if self.db.userExists(uid2) is None:
             raise AgoraENoSuchUser
         return self.next.friendRequest(uid, uid2)
 
-    def unfriend(self, sessionToken, uid2):
-        uid = self.doLogin(sessionToken)
+    def unfriend(self, identity, uid2):
+        uid = self.doLogin(identity)
         if self.db.userExists(uid2) is None:
              raise AgoraENoSuchUser
         return self.next.unfriend(uid, uid2)
 
-    def viewFriendReqs(self, sessionToken):
-        uid = self.doLogin(sessionToken)
+    def viewFriendReqs(self, identity):
+        uid = self.doLogin(identity)
         info = self.db.getPrivateUser(uid)
         return info["foryou"]
     
-    def acceptFriendReq(self, sessionToken, uid2):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def acceptFriendReq(self, identity, uid2):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "accept")
         if self.db.userExists(uid2) is None:
             raise AgoraENoSuchUser
         return self.next.friendRequest(uid, uid2)
 
 
 
-    def comment(self, sessionToken, pid, content, captcha):
-        self.verifyCaptcha(captcha)
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def comment(self, identity, pid, content, captcha):
+        self.verifyCaptcha(captcha, identity.token)
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "comment")
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         return self.next.comment(uid, pid, content)
 
-    def deleteComment(self, sessionToken, cid):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def deleteComment(self, identity, cid):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "delete")
         owner = self.db.commentExists(cid)
         if owner is None:
             raise AgoraENoSuchComment
@@ -286,33 +335,33 @@ class AgoraSemanticFilter(AgoraFilter):
             raise AgoraENotAuthorized
         return self.next.deleteComment(cid)
     
-    def like(self, sessionToken, pid):
-        uid = self.doLogin(sessionToken)
+    def like(self, identity, pid):
+        uid = self.doLogin(identity)
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         return self.next.like(uid, pid) 
 
-    def unlike(self, sessionToken, pid):
-        uid = self.doLogin(sessionToken)
+    def unlike(self, identity, pid):
+        uid = self.doLogin(identity)
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         return self.next.unlike(uid, pid) 
     
-    def dislike(self, sessionToken, pid):
-        uid = self.doLogin(sessionToken)
+    def dislike(self, identity, pid):
+        uid = self.doLogin(identity)
         if self.db.postExists(pid) is None:
             raise AgoraENoSuchPost
         return self.next.dislike(uid, pid) 
 
-    def bugReport(self, sessionToken, content):
-        uid = self.doLogin(sessionToken)
-        self.applyTimeLimit(uid)
+    def bugReport(self, identity, content):
+        uid = self.doLogin(identity)
+        self.applyRateLimit(uid, "report")
         return self.next.bugReport(uid, content)
 
 
 
-    def adminGetUser(self, sessionToken, uid):
-        my_uid = self.doLogin(sessionToken)
+    def adminGetUser(self, identity, uid):
+        my_uid = self.doLogin(identity)
         if not self.db.isUserAdmin(my_uid):
             raise AgoraENotAuthorized
         if self.db.userExists(uid) is None:
@@ -320,8 +369,8 @@ class AgoraSemanticFilter(AgoraFilter):
         return self.db.getPrivateUser(uid)
     
 
-    def adminSuspend(self, sessionToken, uid):
-        my_uid = self.doLogin(sessionToken)
+    def adminSuspend(self, identity, uid):
+        my_uid = self.doLogin(identity)
         if not self.db.isUserAdmin(my_uid):
             raise AgoraENotAuthorized
         if self.db.userExists(uid) is None:
@@ -332,8 +381,8 @@ class AgoraSemanticFilter(AgoraFilter):
         return self.next.adminSuspend(uid)
     
 
-    def adminUnsuspend(self, sessionToken, uid):
-        my_uid = self.doLogin(sessionToken)
+    def adminUnsuspend(self, identity, uid):
+        my_uid = self.doLogin(identity)
         if not self.db.isUserAdmin(my_uid):
             raise AgoraENotAuthorized
         if self.db.userExists(uid) is None:
@@ -344,8 +393,8 @@ class AgoraSemanticFilter(AgoraFilter):
         return self.next.adminUnsuspend(uid)
 
 
-    def adminDelete(self, sessionToken, uid, hpassword):
-        my_uid = self.doLogin(sessionToken)
+    def adminDelete(self, identity, uid, hpassword):
+        my_uid = self.doLogin(identity)
         my_user = self.db.getPublicUser(uid)["username"]
         if not self.db.isUserAdmin(my_uid):
             raise AgoraENotAuthorized
@@ -357,3 +406,9 @@ class AgoraSemanticFilter(AgoraFilter):
             raise AgoraENotAuthorized       # Admins cannot delete other admins
         self.fm.logif(LOG_ADMIN_DELETION, f"Administrator {my_uid} deleted user {uid}")
         return self.next.adminDelete(uid)
+
+    def adminMetrics(self, identity):
+        my_uid = self.doLogin(identity)
+        if not self.db.isUserAdmin(my_uid):
+            raise AgoraENotAuthorized
+        return self.next.adminMetrics()
@@ -0,0 +1,103 @@
+from limits import *
+from AgoraSyntacticFilter import *
+from AgoraSemanticFilter import *
+from AgoraInterpreterFilter import *
+from AgoraDatabaseManager import *
+from AgoraEmailer import *
+from AgoraEmailWorker import *
+from AgoraTokenSweeper import *
+from AgoraFileManager import *
+from AgoraCache import *
+from AgoraSessionCache import *
+from AgoraRenderer import *
+from AgoraImageProcessor import *
+from AgoraCaptchaVerifier import *
+from AgoraStubCaptchaVerifier import *
+from AgoraMetrics import *
+from AgoraQueryStats import *
+from AgoraRateLimiter import *
+from AgoraAsyncModel import *
+
+## Everything one serving process needs: connections, caches, background threads and the filter chain.
+## Build it after fork, never before, since none of it survives being copied into a child.
+
+class AgoraServices:
+    def __init__(self, config):
+        self.interpreter = AgoraInterpreterFilter(None)
+        self.semantics = AgoraSemanticFilter(self.interpreter)
+        self.syntax = AgoraSyntacticFilter(self.semantics)
+
+        self.db = AgoraDatabaseManager(config['DBFILE'])
+        self.semantics.setDBManager(self.db)
+        self.interpreter.setDBManager(self.db)
+
+        self.sessions = AgoraSessionCache(SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_TTL_SECONDS, config['SESSIONDIR'])
+        self.semantics.setSessionCache(self.sessions)
+        self.interpreter.setSessionCache(self.sessions)
+
+        self.feeds = AgoraLRUCache(FEED_CACHE_MAX_ENTRIES, ttl=FEED_CACHE_TTL_SECONDS)
+        self.semantics.setFeedCache(self.feeds)
+        self.interpreter.setFeedCache(self.feeds)
+
+        self.limiter = AgoraRateLimiter(self.db)
+        self.semantics.setRateLimiter(self.limiter)
+
+        self.email = AgoraEmailer(config['MAILGUN_KEY'], config['HOST'], config['MAILGUN_API'])
+        self.email.setDeveloperEmails(config['DEV_EMAILS'])
+        self.interpreter.setEmailer(self.email)
+        self.outbox = AgoraEmailWorker(self.db, self.email)
+
+        self.fm = AgoraFileManager(config['POSTDIR'], config['IMGDIR'], config['LOGDIR'])
+        self.fm.setPostLayout(config['POST_STORE'], config['POST_STORE_FALLBACK'])
+        self.fm.setRenderer(AgoraRenderer())
+        self.fm.setImageProcessor(AgoraImageProcessor(config['IMGDIR']))
+        self.semantics.setFileManager(self.fm)
+        self.interpreter.setFileManager(self.fm)
+
+        self.outbox.setFileManager(self.fm)
+        self.limiter.setFileManager(self.fm)
+        self.sweeper = AgoraTokenSweeper(self.db)
+        self.sweeper.setFileManager(self.fm)
+
+        if config['RECAPTCHA_VERIFIER'] == 'stub':
+            self.semantics.setCaptchaVerifier(AgoraStubCaptchaVerifier())
+        else:
+            self.semantics.setCaptchaVerifier(AgoraCaptchaVerifier(config['RECAPTCHA_SERVERKEY']))
+        if RECAPTCHA_TRUST_SECONDS > 0:
+            self.semantics.setCaptchaTrustCache(AgoraLRUCache(RECAPTCHA_TRUST_MAX_ENTRIES, ttl=RECAPTCHA_TRUST_SECONDS))
+        else:
+            self.semantics.setCaptchaTrustCache(None)
+        self.interpreter.setHost(config['HOST'])
+
+        self.queryStats = AgoraQueryStats()
+        self.queryStats.setFileManager(self.fm)
+        self.db.setQueryStats(self.queryStats)
+
+        self.metrics = AgoraMetrics(config['METRICSDIR'])
+        self.metrics.setQueryStats(self.queryStats)
+        self.interpreter.setMetrics(self.metrics)
+
+        # Entry point for Agora Model
+        self.model = self.syntax
+        self.asyncModel = AgoraAsyncModel(self.model)     # Its threads only start once asgi.py gives it work
+        self.asyncModel.setSemanticFilter(self.semantics)
+        self.closed = False
+
+    # Every worker runs its own outbox worker and sweeper: claims are leased and sweeps are idempotent
+    def start(self):
+        self.outbox.start()
+        self.sweeper.start()
+        self.limiter.start()
+        self.metrics.start()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.sweeper.stop()
+        self.limiter.stop()     # Checkpoints users.lastaction, so before the writer goes
+        self.metrics.close()
+        self.outbox.stop()
+        self.email.close()
+        self.fm.close()     # Writes out any queued log lines
+        self.db.close()
@@ -0,0 +1,111 @@
+import fcntl, hashlib, os, threading, time
+from limits import *
+from AgoraCache import *
+
+## The session cache, with revocations shared between worker processes. A logout, suspension, deletion or
+## recovery in any worker is appended to revoked.log in a directory they all share, and every lookup first
+## reads whatever has been appended since the last one, so no worker goes on trusting a revoked session.
+## Tokens only ever reach the file hashed. Without a directory this is a plain per-process cache.
+
+class AgoraSessionCache(AgoraLRUCache):
+    def __init__(self, maxsize, ttl, dirname=None, maxLogBytes=SESSION_REVOCATION_LOG_MAX_BYTES):
+        super().__init__(maxsize, ttl=ttl)
+        self.path = None if dirname is None else os.path.join(dirname, "revoked.log")
+        self.maxLogBytes = maxLogBytes
+        self.syncLock = threading.Lock()
+        self.inode = None
+        self.offset = 0
+        # Remembered for a while, in case a thread read a session just before its revocation and caches it just after
+        self.revokedTokens = {}     # token hash -> when
+        self.revokedUsers = {}      # uid -> when
+
+    def key(self, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token, default=None):
+        self.sync()
+        key = self.key(token)
+        entry = super().get(key)
+        if entry is None:
+            return default
+        session, cached = entry
+        revoked = max(self.revokedTokens.get(key, 0), self.revokedUsers.get(session["uid"], 0))
+        if cached < revoked + SESSION_REVOCATION_GRACE_SECONDS:
+            super().discard(key)
+            return default
+        return session
+
+    def put(self, token, session):
+        super().put(self.key(token), (session, time.time()))
+
+    def discard(self, token):
+        key = self.key(token)
+        super().discard(key)
+        self.publish("t", key)
+
+    def discardUser(self, uid):
+        super().discardIf(lambda key, entry: entry[0]["uid"] == uid)
+        self.publish("u", uid)
+
+    def publish(self, kind, value):
+        if self.path is None:
+            return
+        line = f"{time.time():.3f} {kind} {value}\n".encode()
+        while True:
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    # Another worker may have rotated the file while we waited for the lock
+                    if os.fstat(f.fileno()).st_ino != os.stat(self.path).st_ino:
+                        continue
+                    f.write(line)
+                    f.flush()
+                    if f.tell() > self.maxLogBytes:
+                        self.rotate()
+                    return
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Called with the lock held. Lines older than two TTLs can't matter to any cache any more
+    def rotate(self):
+        cutoff = time.time() - 2 * self.ttl
+        with open(self.path, 'rb') as f:
+            lines = [line for line in f.read().splitlines(keepends=True) if float(line.split(b" ", 1)[0]) >= cutoff]
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, 'wb') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path)
+
+    def sync(self):
+        if self.path is None:
+            return
+        try:
+            st = os.stat(self.path)
+            if st.st_ino == self.inode and st.st_size == self.offset:
+                return      # Nothing new, which is nearly always
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f, self.syncLock:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self.inode or st.st_size < self.offset:
+                self.inode, self.offset = st.st_ino, 0     # Rotated: read it all again, which does no harm
+            if st.st_size == self.offset:
+                return
+            f.seek(self.offset)
+            data = f.read()
+            data = data[:data.rfind(b"\n") + 1]     # A line still being written waits for the next lookup
+            self.offset += len(data)
+            now = time.time()
+            for line in data.decode().splitlines():
+                when, kind, value = line.split(" ")
+                if kind == "t":
+                    self.revokedTokens[value] = float(when)
+                    super().discard(value)
+                else:
+                    uid = int(value)
+                    self.revokedUsers[uid] = float(when)
+                    super().discardIf(lambda key, entry: entry[0]["uid"] == uid)
+            for revoked in (self.revokedTokens, self.revokedUsers):
+                for value in [v for v, when in revoked.items() if when < now - 2 * self.ttl]:
+                    del revoked[value]
@@ -0,0 +1,18 @@
+import hashlib, os, re
+from AgoraFlatPostStore import *
+
+class AgoraShardedPostStore(AgoraFlatPostStore):
+    # posts/3f/a2/post<id>.md, so no directory ever holds more than a few files per 65536 posts
+    def path(self, name):
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return os.path.join(self.postdir, digest[0:2], digest[2:4], name)
+
+    def list(self):
+        for outer in sorted(os.listdir(self.postdir)):
+            if re.match(r"^[0-9a-f]{2}$", outer) is None:
+                continue
+            for inner in sorted(os.listdir(os.path.join(self.postdir, outer))):
+                shard = os.path.join(self.postdir, outer, inner)
+                for name in os.listdir(shard):
+                    if self.isStoredName(name):
+                        yield name
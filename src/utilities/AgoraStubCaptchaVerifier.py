@@ -0,0 +1,51 @@
+import asyncio, threading, time
+from agora_errors import *
+from limits import *
+
+## Never leaves the process: every response gets the same score, after an optional fake round trip.
+## For benchmarks and local development only.
+
+class AgoraStubCaptchaVerifier:
+    def __init__(self, score=1.0, latency=0.0):
+        self.score = score
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.numCalls = 0
+        self.numRejected = 0
+
+    def verify(self, userresp):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self.lock:
+            self.numCalls += 1
+            if self.score < RECAPTCHA_THRESHHOLD:
+                self.numRejected += 1
+                raise AgoraEAreYouHuman
+        return True
+
+    async def verifyAsync(self, userresp):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        with self.lock:
+            self.numCalls += 1
+            if self.score < RECAPTCHA_THRESHHOLD:
+                self.numRejected += 1
+                raise AgoraEAreYouHuman
+        return True
+
+    async def closeAsync(self):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.numCalls,
+                "failures": 0,
+                "rejected": self.numRejected,
+                "short_circuited": 0,
+                "failed_open": 0,
+                "breaker_open": False,
+                "latency_seconds_avg": self.latency,
+                "latency_seconds_max": self.latency,
+                "latency_seconds_last": self.latency
+            }
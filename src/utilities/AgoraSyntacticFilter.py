@@ -1,7 +1,10 @@
+import base64
 import email
 import hashlib
+import json
 import os
 from AgoraFilter import *
+from AgoraIdentity import *
 from limits import *
 from agora_errors import *
 
@@ -33,6 +36,9 @@ class AgoraSyntacticFilter(AgoraFilter):
         if tokenType == "backup":
             return hashlib.sha256(token.encode()).hexdigest()
 
+    def validateIdentity(self, identity):
+        identity.require()
+
     def validateStatus(self, status):
         if not self.isLengthBetween(status, STATUS_MIN_LENGTH, STATUS_MAX_LENGTH):
             raise AgoraEInvalidStatus
@@ -73,6 +79,34 @@ class AgoraSyntacticFilter(AgoraFilter):
         if not self.isLengthBetween(content, 0, QUERY_MAX_LENGTH):
             raise AgoraEInvalidQuery
 
+    def validateCursor(self, cursor):
+        if cursor is None or cursor == "":
+            return None
+        if len(cursor) > BROWSE_CURSOR_MAX_LENGTH:
+            raise AgoraEInvalidQuery
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise AgoraEInvalidQuery
+        if not isinstance(key, list) or not all(isinstance(k, (str, int, float)) for k in key):
+            raise AgoraEInvalidQuery
+        return tuple(key)
+
+    def encodeCursor(self, key):
+        if key is None:
+            return None
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def validatePageSize(self, pagesize):
+        if pagesize is None:
+            return BROWSE_PAGE_SIZE
+        if not pagesize.isdigit() or not (1 <= int(pagesize) <= BROWSE_PAGE_SIZE_MAX):
+            raise AgoraEInvalidQuery
+        return int(pagesize)
+
+    def encodePage(self, page):
+        return dict(page, next=self.encodeCursor(page["next"]), prev=self.encodeCursor(page["prev"]))
+
     def isValidId(self, strid):
         return strid.isdigit()
 
@@ -92,21 +126,28 @@ class AgoraSyntacticFilter(AgoraFilter):
 
 
 
+    def identify(self, sessionToken):
+        try:
+            self.validateToken(sessionToken, "session")
+        except AgoraException as err:
+            return AgoraIdentity(sessionToken, error=type(err))
+        return self.next.identify(sessionToken)
+
     def login(self, username, password, captcha):
         self.validateUsername(username)
         hpassword = self.validatePassword(password)
         return self.next.login(username, hpassword, captcha)
 
-    def logout(self, sessionToken):
-        self.validateToken(sessionToken, "session")
-        return self.next.logout(sessionToken)
+    def logout(self, identity):
+        self.validateToken(identity.token, "session")    # Even a session that no longer logs in can be logged out
+        return self.next.logout(identity)
 
 
 
-    def deleteAccount(self, sessionToken, password):
-        self.validateToken(sessionToken, "session")
+    def deleteAccount(self, identity, password):
+        self.validateToken(identity.token, "session")
         hpassword = self.validatePassword(password)
-        return self.next.deleteAccount(sessionToken, hpassword)
+        return self.next.deleteAccount(identity, hpassword)
 
     def confirmDelete(self, deletionToken):
         self.validateToken(deletionToken, "deletion")
@@ -145,166 +186,177 @@ class AgoraSyntacticFilter(AgoraFilter):
             raise AgoraENoSuchImage
         return self.next.getImage(imageId)
     
-    def searchUsers(self, query):
+    def searchUsers(self, query, after=None, before=None, pagesize=None):
         self.validateQuery(query)
-        return self.next.searchUsers(query)
+        page = self.next.searchUsers(query, self.validateCursor(after), self.validateCursor(before), self.validatePageSize(pagesize))
+        return self.encodePage(page)
     
-    def searchPosts(self, query):
+    def searchPosts(self, query, after=None, before=None, pagesize=None):
         self.validateQuery(query)
-        return self.next.searchPosts(query)
+        page = self.next.searchPosts(query, self.validateCursor(after), self.validateCursor(before), self.validatePageSize(pagesize))
+        return self.encodePage(page)
+
 
 
+    def getMyUser(self, identity, concise=False):
+        self.validateIdentity(identity)
+        return self.next.getMyUser(identity, concise=concise)
 
-    def getMyUser(self, sessionToken, concise=False):
-        self.validateToken(sessionToken, "session")
-        return self.next.getMyUser(sessionToken, concise=concise)
+    def getFeed(self, identity, after=None, before=None, pagesize=None):
+        self.validateIdentity(identity)
+        page = self.next.getFeed(identity, self.validateCursor(after), self.validateCursor(before), self.validatePageSize(pagesize))
+        return self.encodePage(page)
 
 
 
-    def changeStatus(self, sessionToken, newStatus):
-        self.validateToken(sessionToken, "session")
+    def changeStatus(self, identity, newStatus):
+        self.validateIdentity(identity)
         self.validateStatus(newStatus)
-        return self.next.changeStatus(sessionToken, newStatus)
+        return self.next.changeStatus(identity, newStatus)
     
-    def changePicture(self, sessionToken, imageId):
-        self.validateToken(sessionToken, "session")
+    def changePicture(self, identity, imageId):
+        self.validateIdentity(identity)
         if not self.isValidImgId(imageId):
             raise AgoraENoSuchImage
-        return self.next.changePicture(sessionToken, imageId)
+        return self.next.changePicture(identity, imageId)
     
-    def changeEmail(self, sessionToken, emailAddress):
-        self.validateToken(sessionToken, "session")
+    def changeEmail(self, identity, emailAddress):
+        self.validateIdentity(identity)
         self.validateEmail(emailAddress)
-        return self.next.changeEmail(sessionToken, emailAddress)
+        return self.next.changeEmail(identity, emailAddress)
 
     def confirmEmail(self, emailToken):
         self.validateToken(emailToken, "email")
         return self.next.confirmEmail(emailToken)
 
-    def changeUsername(self, sessionToken, username):
-        self.validateToken(sessionToken, "session")
+    def changeUsername(self, identity, username):
+        self.validateIdentity(identity)
         self.validateUsername(username)
-        return self.next.changeUsername(sessionToken, username)
+        return self.next.changeUsername(identity, username)
 
-    def writePost(self, sessionToken, title, content, captcha):
-        self.validateToken(sessionToken, "session")
+    def writePost(self, identity, title, content, captcha):
+        self.validateIdentity(identity)
         self.validatePostTitle(title)
         self.validatePost(content)
-        return self.next.writePost(sessionToken, title, content, captcha)
+        return self.next.writePost(identity, title, content, captcha)
 
-    def editPost(self, sessionToken, pid, title, content):
-        self.validateToken(sessionToken, "session")
+    def editPost(self, identity, pid, title, content):
+        self.validateIdentity(identity)
         self.validatePostTitle(title)
         self.validatePost(content)
-        return self.next.editPost(sessionToken, pid, title, content)   
+        return self.next.editPost(identity, pid, title, content)   
  
-    def deletePost(self, sessionToken, pid):
-        self.validateToken(sessionToken, "session")
+    def deletePost(self, identity, pid):
+        self.validateIdentity(identity)
         if not self.isValidId(pid):
             raise AgoraENoSuchPost
-        return self.next.deletePost(sessionToken, int(pid))
+        return self.next.deletePost(identity, int(pid))
     
-    def uploadImage(self, sessionToken, title, imgData):
-        self.validateToken(sessionToken, "session")
+    def uploadImage(self, identity, title, imgData):
+        self.validateIdentity(identity)
         extension = self.validateImageTitle(title)
         self.validateImage(imgData)
-        return self.next.uploadImage(sessionToken, title, extension, imgData)
+        return self.next.uploadImage(identity, title, extension, imgData)
     
-    def deleteImage(self, sessionToken, imageId):
-        self.validateToken(sessionToken, "session")
+    def deleteImage(self, identity, imageId):
+        self.validateIdentity(identity)
         if not self.isValidImgId(imageId):
             raise AgoraENoSuchImage
-        return self.next.deleteImage(sessionToken, imageId)
+        return self.next.deleteImage(identity, imageId)
 
-    def listImages(self, sessionToken):
-        self.validateToken(sessionToken, "session")
-        return self.next.listImages(sessionToken)
+    def listImages(self, identity):
+        self.validateIdentity(identity)
+        return self.next.listImages(identity)
 
 
 
-    def friendRequest(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def friendRequest(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.friendRequest(sessionToken, int(uid))
+        return self.next.friendRequest(identity, int(uid))
 
-    def unfriend(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def unfriend(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.unfriend(sessionToken, int(uid))
+        return self.next.unfriend(identity, int(uid))
 
-    def viewFriendReqs(self, sessionToken):
-        self.validateToken(sessionToken, "session")
-        return self.next.viewFriendReqs(sessionToken)
+    def viewFriendReqs(self, identity):
+        self.validateIdentity(identity)
+        return self.next.viewFriendReqs(identity)
     
-    def acceptFriendReq(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def acceptFriendReq(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.acceptFriendReq(sessionToken, int(uid))
+        return self.next.acceptFriendReq(identity, int(uid))
 
 
 
-    def comment(self, sessionToken, pid, content, captcha):
-        self.validateToken(sessionToken, "session")
+    def comment(self, identity, pid, content, captcha):
+        self.validateIdentity(identity)
         if not self.isValidId(pid):
             raise AgoraENoSuchPost
         self.validateComment(content)
-        return self.next.comment(sessionToken, int(pid), content, captcha)
+        return self.next.comment(identity, int(pid), content, captcha)
 
-    def deleteComment(self, sessionToken, cid):
-        self.validateToken(sessionToken, "session")
+    def deleteComment(self, identity, cid):
+        self.validateIdentity(identity)
         if not self.isValidId(cid):
             raise AgoraEInvalidComment
-        return self.next.deleteComment(sessionToken, int(cid))
+        return self.next.deleteComment(identity, int(cid))
     
-    def like(self, sessionToken, pid):
-        self.validateToken(sessionToken, "session")
+    def like(self, identity, pid):
+        self.validateIdentity(identity)
         if not self.isValidId(pid):
             raise AgoraENoSuchPost
-        return self.next.like(sessionToken, int(pid))
+        return self.next.like(identity, int(pid))
 
-    def unlike(self, sessionToken, pid): 
-        self.validateToken(sessionToken, "session")
+    def unlike(self, identity, pid): 
+        self.validateIdentity(identity)
         if not self.isValidId(pid):
             raise AgoraENoSuchPost
-        return self.next.unlike(sessionToken, int(pid))
+        return self.next.unlike(identity, int(pid))
 
-    def dislike(self, sessionToken, pid):
-        self.validateToken(sessionToken, "session")
+    def dislike(self, identity, pid):
+        self.validateIdentity(identity)
         if not self.isValidId(pid):
             raise AgoraENoSuchPost
-        return self.next.dislike(sessionToken, int(pid))
+        return self.next.dislike(identity, int(pid))
 
-    def bugReport(self, sessionToken, content):
-        self.validateToken(sessionToken, "session")
+    def bugReport(self, identity, content):
+        self.validateIdentity(identity)
         self.validateReport(content)
-        return self.next.bugReport(sessionToken, content)
+        return self.next.bugReport(identity, content)
 
 
 
-    def adminGetUser(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def adminGetUser(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.adminGetUser(sessionToken, int(uid))
+        return self.next.adminGetUser(identity, int(uid))
 
-    def adminSuspend(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def adminSuspend(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.adminSuspend(sessionToken, int(uid))
+        return self.next.adminSuspend(identity, int(uid))
 
-    def adminUnsuspend(self, sessionToken, uid):
-        self.validateToken(sessionToken, "session")
+    def adminUnsuspend(self, identity, uid):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
-        return self.next.adminUnsuspend(sessionToken, int(uid))
+        return self.next.adminUnsuspend(identity, int(uid))
     
-    def adminDelete(self, sessionToken, uid, password):
-        self.validateToken(sessionToken, "session")
+    def adminDelete(self, identity, uid, password):
+        self.validateIdentity(identity)
         if not self.isValidId(uid):
             raise AgoraENoSuchUser
         hpassword = self.validatePassword(password)
-        return self.next.adminDelete(sessionToken, int(uid), hpassword)
+        return self.next.adminDelete(identity, int(uid), hpassword)
+
+    def adminMetrics(self, identity):
+        self.validateIdentity(identity)
+        return self.next.adminMetrics(identity)
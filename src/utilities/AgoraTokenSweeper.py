@@ -0,0 +1,73 @@
+import threading, time
+from limits import *
+from logopts import *
+
+class AgoraTokenSweeper:
+    def __init__(self, db):
+        self.db = db
+        self.fm = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.lastReport = None
+        self.numSweeps = 0
+        self.numRemoved = 0
+        self.numFailures = 0
+        self.lastError = None
+
+    def setFileManager(self, fm):
+        self.fm = fm
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="AgoraTokenSweeper", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(TOKEN_SWEEP_INTERVAL_SECONDS):
+            try:
+                self.sweep()
+            except Exception as err:
+                self.failed(err)    # Whatever we missed is still expired next time around
+
+    def sweep(self):
+        start = time.monotonic()
+        removed = {}
+        for ttype, ttl in TOKEN_TTL_SECONDS.items():
+            removed[ttype] = 0
+            # Small batches keep each delete a short unit on the writer, between everybody else's writes
+            while not self.stopping.is_set():
+                n = self.db.sweepTokens(ttype, ttl, TOKEN_SWEEP_BATCH_SIZE)
+                removed[ttype] += n
+                if n < TOKEN_SWEEP_BATCH_SIZE:
+                    break
+        report = {"removed": removed, "total": sum(removed.values()), "seconds": time.monotonic() - start}
+        with self.lock:
+            self.lastReport = report
+            self.numSweeps += 1
+            self.numRemoved += report["total"]
+        if self.fm is not None and report["total"] > 0:
+            self.fm.logif(LOG_TOKEN_SWEEPS, f"Swept {report['total']} expired tokens in {report['seconds']:.3f}s")
+        return report
+
+    def failed(self, err):
+        error = f"{type(err).__name__}: {err}"
+        with self.lock:
+            self.numFailures += 1
+            self.lastError = error
+        if self.fm is not None:
+            self.fm.logif(LOG_SWEEP_ERRORS, f"Token sweep failed: {error}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sweeps": self.numSweeps,
+                "removed": self.numRemoved,
+                "last": self.lastReport,
+                "failures": self.numFailures,
+                "last_error": self.lastError
+            }
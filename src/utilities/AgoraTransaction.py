@@ -0,0 +1,25 @@
+from AgoraRowRef import *
+
+class AgoraTransaction:
+    def __init__(self, writer):
+        self.writer = writer
+        self.statements = []
+        self.callbacks = []
+        self.rowids = None
+
+    def add(self, statements):
+        self.statements.extend(statements)
+        return AgoraRowRef(len(self.statements) - 1)
+
+    def onCommit(self, fn):
+        self.callbacks.append(fn)
+
+    def resolve(self, value):
+        return self.rowids[value.index] if isinstance(value, AgoraRowRef) else value
+
+    def commit(self):
+        if len(self.statements) > 0:
+            self.rowids = self.writer.submit(self.statements).result()
+        # Files only go once the rows pointing at them are gone for good
+        for fn in self.callbacks:
+            fn()
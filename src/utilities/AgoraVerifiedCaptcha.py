@@ -0,0 +1,5 @@
+## Stands in for a captcha response that has already been checked, asynchronously, before the request
+## reached the filter chain. Form data only ever comes in as strings, so a client can't send one of these.
+
+class AgoraVerifiedCaptcha:
+    pass